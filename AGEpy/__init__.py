@@ -15,4 +15,16 @@ from .cytoscape import *
 from .blast import *
 from .genomes import *
 from .geo import *
-from .utils import *
\ No newline at end of file
+from .utils import *
+from .cache import *
+from .bgzf import *
+from .tabix import *
+from .twobit import *
+from .composition import *
+from .cigar import *
+from .coverage import *
+from .junctions import *
+from .counts import *
+from .samqc import *
+from .bam import *
+from .intervals import *
\ No newline at end of file
@@ -0,0 +1,452 @@
+import os
+import struct
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .bgzf import _readBlock, _inflateBlock
+from .sam import _SAMtagsPattern, _SAMtagsFrame, _concatSAM
+from .cigar import CIGAR_OPS, CIGARstats
+
+_BAM_RECORD=np.dtype([('block_size','<i4'),('refID','<i4'),('pos','<i4'),('l_read_name','u1'),('mapq','u1'),('bin','<u2'),
+                      ('n_cigar_op','<u2'),('flag','<u2'),('l_seq','<i4'),('next_refID','<i4'),('next_pos','<i4'),('tlen','<i4')])
+
+# both bases of a packed SEQ byte
+_SEQ_PAIRS=np.frombuffer(b"=ACMGRSVTWYHKDBN", dtype=np.uint8)[np.stack([np.arange(256) >> 4, np.arange(256) & 15], axis=1)]
+
+_AUX_INTEGERS={ ord(t):np.dtype(d) for t, d in [("c","<i1"),("C","<u1"),("s","<i2"),("S","<u2"),("i","<i4"),("I","<u4")] }
+_AUX_ARRAYS={ ord(t):np.dtype(d) for t, d in [("c","<i1"),("C","<u1"),("s","<i2"),("S","<u2"),("i","<i4"),("I","<u4"),("f","<f4")] }
+_AUX_SAM_TYPES=np.arange(256, dtype=np.uint8)
+_AUX_SAM_TYPES[list(_AUX_INTEGERS)]=ord("i")
+
+def _ranges(starts, lengths):
+    """
+    Expands ranges [start, start+length) into one flat array of indexes.
+    """
+    lengths=np.asarray(lengths, dtype=np.int64)
+    first=np.cumsum(lengths)-lengths
+    return np.arange(int(lengths.sum()), dtype=np.int64)-np.repeat(first, lengths)+np.repeat(np.asarray(starts, dtype=np.int64), lengths)
+
+def _joinRanges(pool, starts, lengths, seps):
+    """
+    Concatenates byte ranges of a pool, each followed by a separator byte or by nothing where the separator is -1.
+
+    :returns: bytes
+    """
+    lengths=np.asarray(lengths, dtype=np.int64)
+    has_sep=seps >= 0
+    size=lengths+has_sep
+    out_starts=np.cumsum(size)-size
+    out=np.empty(int(size.sum()), dtype=np.uint8)
+    out[_ranges(out_starts, lengths)]=pool[_ranges(starts, lengths)]
+    out[( out_starts+lengths )[has_sep]]=seps[has_sep]
+    return out.tobytes()
+
+def _extract(data, starts, lengths):
+    """
+    Extracts byte ranges of an array, each followed by one spare byte, through a mask built from a difference array.
+    Ranges, including their spare byte, must not overlap and data must have one byte after the last range.
+
+    :returns: the extracted bytes and the position of the spare byte of each range in them
+    """
+    lengths=np.asarray(lengths, dtype=np.int64)
+    diff=np.zeros(len(data)+1, dtype=np.int8)
+    diff[starts]=1
+    diff[starts+lengths+1]-=1
+    mask=np.cumsum(diff[:-1], dtype=np.int8).view(bool)
+    return data[mask], np.cumsum(lengths+1)-1
+
+def _strings(data, starts, lengths):
+    """
+    Decodes byte ranges of an array into a list of strings. See _extract().
+    """
+    chars, spare = _extract(data, starts, lengths)
+    chars[spare]=10
+    return chars.tobytes().decode("latin-1").split("\n")[:-1]
+
+def _BAMstream(handle, n_threads=1, batch=64):
+    """
+    Reads BGZF blocks from the current position of a binary file handle and inflates them in batches.
+    If n_threads > 1, blocks are inflated on a thread pool while the previous batch is being parsed.
+
+    :returns: a generator of inflated bytes
+    """
+    def raw():
+        blocks=[]
+        while True:
+            block=_readBlock(handle)
+            if block is None:
+                break
+            blocks.append(block)
+            if len(blocks) == batch:
+                yield blocks
+                blocks=[]
+        if len(blocks) > 0:
+            yield blocks
+
+    if n_threads <= 1:
+        for blocks in raw():
+            yield b"".join([ _inflateBlock(b) for b in blocks ])
+        return
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        pending=None
+        for blocks in raw():
+            inflated=pool.map(_inflateBlock, blocks)
+            if pending is not None:
+                yield b"".join(pending)
+            pending=inflated
+        if pending is not None:
+            yield b"".join(pending)
+
+def _readBAMheader(stream):
+    """
+    Reads the header of a BAM file from an inflated stream.
+
+    :returns: a list with the header lines, a list with the reference sequence names and the bytes following the header
+    """
+    data=bytearray()
+
+    def need(n):
+        while len(data) < n:
+            block=next(stream, None)
+            if block is None:
+                raise ValueError("truncated BAM header")
+            data.extend(block)
+
+    need(8)
+    if bytes(data[:4]) != b"BAM\x01":
+        raise ValueError("not a BAM file")
+    l_text=struct.unpack("<i", data[4:8])[0]
+    need(12+l_text)
+    text=bytes(data[8:8+l_text]).rstrip(b"\x00").decode()
+    n_ref=struct.unpack("<i", data[8+l_text:12+l_text])[0]
+    pos=12+l_text
+    refs=[]
+    lengths=[]
+    for i in range(n_ref):
+        need(pos+4)
+        l_name=struct.unpack("<i", data[pos:pos+4])[0]
+        need(pos+8+l_name)
+        refs.append(bytes(data[pos+4:pos+3+l_name]).decode())
+        lengths.append(struct.unpack("<i", data[pos+4+l_name:pos+8+l_name])[0])
+        pos=pos+8+l_name
+    head=[ l+"\n" for l in text.split("\n") if len(l) > 0 ]
+    if not any([ l.startswith("@SQ") for l in head ]):
+        head=head+[ "@SQ\tSN:%s\tLN:%i\n" %(r, l) for r, l in zip(refs, lengths) ]
+    return head, refs, data[pos:]
+
+def _auxText(data, aux_start, aux_end):
+    """
+    Converts the binary optional fields of BAM records into SAM text. All records are walked in lockstep, one field
+    per record at a time; integer and float values are formatted with numpy and the text of all fields is assembled
+    in one scatter.
+
+    :returns: a list with the tab separated optional fields of each record as bytes
+    """
+    n=len(aux_start)
+    zeros=np.flatnonzero(data == 0)
+    pools=[data]
+    base=len(data)
+    rows, order, starts, lengths = [], [], [], []
+    p=aux_start.astype(np.int64)
+    k=0
+    while True:
+        active=np.flatnonzero(p < aux_end)
+        if len(active) == 0:
+            break
+        q=p[active]
+        kind=data[q+2]
+        prefix=np.empty((len(q), 5), dtype=np.uint8)
+        prefix[:,0]=data[q]
+        prefix[:,1]=data[q+1]
+        prefix[:,2]=58
+        prefix[:,3]=_AUX_SAM_TYPES[kind]
+        prefix[:,4]=58
+        pools.append(prefix.ravel())
+        prefix_starts=base+5*np.arange(len(q), dtype=np.int64)
+        base=base+prefix.size
+        value_starts=q+3
+        value_lengths=np.ones(len(q), dtype=np.int64)
+        size=np.ones(len(q), dtype=np.int64)
+        for t in np.unique(kind):
+            sel=np.flatnonzero(kind == t)
+            text=None
+            if t in _AUX_INTEGERS or t == ord("f"):
+                dtype=_AUX_INTEGERS.get(t, np.dtype("<f4"))
+                values=data[( q[sel]+3 )[:,None]+np.arange(dtype.itemsize)].view(dtype).ravel()
+                if t == ord("f"):
+                    text=np.array([ b"%g" %v for v in values.tolist() ])
+                else:
+                    text=values.astype(np.int64).astype(bytes)
+                size[sel]=dtype.itemsize
+            elif t == ord("A"):
+                size[sel]=1
+            elif t == ord("Z") or t == ord("H"):
+                ends=zeros[np.searchsorted(zeros, q[sel]+3)]
+                value_lengths[sel]=ends-q[sel]-3
+                size[sel]=ends-q[sel]-2
+            elif t == ord("B"):
+                fields=[]
+                for i in q[sel].tolist():
+                    dtype=_AUX_ARRAYS[data[i+3]]
+                    count=struct.unpack("<i", data[i+4:i+8].tobytes())[0]
+                    values=data[i+8:i+8+count*dtype.itemsize].view(dtype).tolist()
+                    fields.append(b",".join([chr(data[i+3]).encode()]+[ b"%g" %v for v in values ]))
+                    size[sel[len(fields)-1]]=5+count*dtype.itemsize
+                text=np.array(fields)
+            else:
+                raise ValueError("unknown optional field type %s" %chr(t))
+            if text is not None:
+                width=text.dtype.itemsize
+                chars=text.view(np.uint8).reshape(len(text), width)
+                pools.append(chars.ravel())
+                value_starts[sel]=base+width*np.arange(len(text), dtype=np.int64)
+                value_lengths[sel]=( chars != 0 ).sum(axis=1)
+                base=base+chars.size
+        rows.append(np.repeat(active, 2))
+        order.append(np.full(2*len(q), 2*k)+np.tile([0,1], len(q)))
+        starts.append(np.stack([prefix_starts, value_starts], axis=1).ravel())
+        lengths.append(np.stack([np.full(len(q), 5), value_lengths], axis=1).ravel())
+        p[active]=q+3+size
+        k=k+1
+
+    # an empty piece ends each record
+    rows.append(np.arange(n))
+    order.append(np.full(n, 2*k))
+    starts.append(np.zeros(n, dtype=np.int64))
+    lengths.append(np.zeros(n, dtype=np.int64))
+    rows=np.concatenate(rows)
+    order=np.concatenate(order)
+    sort=np.lexsort((order, rows))
+    rows=rows[sort]
+    order=order[sort]
+    seps=np.full(len(rows), -1)
+    last=order == 2*k
+    seps[last]=10
+    is_value=( order % 2 == 1 ) & ~last
+    followed=np.zeros(len(rows), dtype=bool)
+    followed[:-1]=~last[1:]
+    seps[is_value & followed]=9
+    pool=np.concatenate(pools)
+    text=_joinRanges(pool, np.concatenate(starts)[sort], np.concatenate(lengths)[sort], seps)
+    return text.split(b"\n")[:-1]
+
+def _parseBAMrecords(buf, starts, refs, offset=0, tags=None, pattern=None):
+    """
+    Decodes BAM records into the columns of a SAM chunk. Fixed size fields are read through a numpy record view,
+    read names, sequences and qualities are gathered from the buffer with numpy and CIGARs are decoded once per distinct CIGAR.
+
+    :param buf: bytes with complete BAM records
+    :param starts: the offset of each record in buf
+    :param refs: a list of reference sequence names
+    :param offset: index of the first record
+    :param tags: a list of optional fields to be extracted into typed columns, see _SAMtagsFrame()
+    :param pattern: a pattern as returned by _SAMtagsPattern(tags)
+
+    :returns: a Pandas dataframe as the chunks of readSAMchunks()
+    """
+    data=np.frombuffer(buf, dtype=np.uint8)
+    starts=np.asarray(starts, dtype=np.int64)
+    n=len(starts)
+    fixed=data[starts[:,None]+np.arange(_BAM_RECORD.itemsize)].view(_BAM_RECORD).ravel()
+    l_read_name=fixed['l_read_name'].astype(np.int64)
+    n_cigar=fixed['n_cigar_op'].astype(np.int64)
+    l_seq=fixed['l_seq'].astype(np.int64)
+    name_start=starts+_BAM_RECORD.itemsize
+    cigar_start=name_start+l_read_name
+    seq_start=cigar_start+4*n_cigar
+    seq_bytes=( l_seq+1 )//2
+    qual_start=seq_start+seq_bytes
+    aux_start=qual_start+l_seq
+    aux_end=starts+4+fixed['block_size'].astype(np.int64)
+
+    # the NUL ending each read name is the spare byte
+    data=np.append(data, np.uint8(0))
+    names=_strings(data, name_start, np.maximum(l_read_name-1, 0))
+
+    packed, spare = _extract(data, seq_start, seq_bytes)
+    pairs=_SEQ_PAIRS[packed].ravel()
+    seqs=_strings(pairs, 2*( spare-seq_bytes ), l_seq)
+
+    quals, spare = _extract(data, qual_start, l_seq)
+    quals=quals+np.uint8(33)
+    quals[spare]=10
+    quals=quals.tobytes().decode("latin-1").split("\n")[:-1]
+    for i in np.flatnonzero(( l_seq == 0 ) | ( data[qual_start] == 255 )).tolist():
+        quals[i]="*"
+    for i in np.flatnonzero(l_seq == 0).tolist():
+        seqs[i]="*"
+
+    codes, uniques = pd.factorize(np.array([ buf[s:s+4*c] for s, c in zip(cigar_start.tolist(), n_cigar.tolist()) ], dtype=object))
+    cigars=[]
+    for u in uniques:
+        ops=np.frombuffer(u, dtype="<u4")
+        cigars.append("".join([ "%i%s" %(v >> 4, CIGAR_OPS[v & 15]) for v in ops.tolist() ]) if len(ops) > 0 else "*")
+    refID=fixed['refID'].astype(np.int64)
+    next_refID=fixed['next_refID'].astype(np.int64)
+    references=list(refs)+["*","="]
+    rname=np.where(refID < 0, len(refs), refID)
+    rnext=np.where(next_refID < 0, len(refs), np.where(( next_refID == refID ), len(refs)+1, next_refID))
+
+    sam=pd.DataFrame({'QNAME':pd.Series(names, dtype=str),
+                      'FLAG':fixed['flag'].astype(np.uint16),
+                      'RNAME':pd.Categorical.from_codes(rname, categories=references).remove_unused_categories(),
+                      'POS':( fixed['pos']+1 ).astype(np.int32),
+                      'MAPQ':fixed['mapq'].astype(np.uint8),
+                      'CIGAR':pd.Categorical.from_codes(codes, categories=list(cigars)),
+                      'RNEXT':pd.Categorical.from_codes(rnext, categories=references).remove_unused_categories(),
+                      'PNEXT':( fixed['next_pos']+1 ).astype(np.int32),
+                      'TLEN':fixed['tlen'].astype(np.int32),
+                      'SEQ':pd.Series(seqs, dtype=str),
+                      'QUAL':pd.Series(quals, dtype=str)})
+    raw=np.empty(n, dtype=object)
+    raw[:]=_auxText(data, aux_start, aux_end)
+    sam["TAGS"]=raw
+    if tags is not None and len(tags) > 0:
+        for t, values in _SAMtagsFrame(raw, tags, pattern).items():
+            sam[t]=values
+    sam.index=pd.RangeIndex(offset, offset+n)
+    return sam
+
+def _BAMchunks(stream, refs, chunksize, tags=None, data=b""):
+    """
+    Splits an inflated stream of BAM records into chunks of chunksize records.
+
+    :returns: a generator of Pandas dataframes as the chunks of readSAMchunks()
+    """
+    pattern=_SAMtagsPattern(tags) if tags else None
+    data=bytearray(data)
+    block_size=struct.Struct("<i").unpack_from
+    offset=0
+    starts=[]
+    pos=0
+    done=False
+    while not done:
+        block=next(stream, None)
+        if block is None:
+            done=True
+        else:
+            data.extend(block)
+        while True:
+            while len(starts) < chunksize and pos+4 <= len(data):
+                size=block_size(data, pos)[0]
+                if pos+4+size > len(data):
+                    break
+                starts.append(pos)
+                pos=pos+4+size
+            if len(starts) < chunksize and not ( done and len(starts) > 0 ):
+                break
+            buf=bytes(data[:pos])
+            del data[:pos]
+            sam=_parseBAMrecords(buf, starts, refs, offset, tags, pattern)
+            offset=offset+len(sam)
+            starts=[]
+            pos=0
+            yield sam
+
+def readBAMchunks(BAMfile, chunksize=200000, header=False, tags=None, n_threads=1):
+    """
+    Reads a BAM file in chunks without loading it into memory. BGZF blocks are inflated with zlib, on a thread pool
+    if n_threads > 1, and records are decoded into the same chunks as readSAMchunks().
+
+    :param BAMfile: /path/to/file.bam
+    :param chunksize: number of alignments per chunk
+    :param header: logical, if True, the header lines are returned together with the chunks
+    :param tags: a list of optional fields to be extracted into typed columns eg. ['NH','NM','AS']. See readSAMchunks().
+    :param n_threads: number of threads inflating BGZF blocks
+
+    :returns: a generator of Pandas dataframes with the columns 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL','TAGS' plus one column per requested optional field and a list of the header lines if header=True. See readSAMchunks().
+    """
+    f=open(BAMfile, "rb")
+    stream=_BAMstream(f, n_threads)
+    head, refs, data = _readBAMheader(stream)
+
+    def chunks():
+        try:
+            for sam in _BAMchunks(stream, refs, chunksize, tags, data):
+                yield sam
+        finally:
+            stream.close()
+            f.close()
+
+    if header:
+        return head, chunks()
+    return chunks()
+
+def readBAMindex(index_path):
+    """
+    Reads a BAM index (.bai).
+
+    :param index_path: /path/to/file.bam.bai
+
+    :returns: a dictionary with the linear index of virtual offsets of each reference sequence in 'linear', in the order of the BAM header
+    """
+    with open(index_path, "rb") as f:
+        data=f.read()
+    if data[:4] != b"BAI\x01":
+        raise ValueError("%s is not a BAM index" %index_path)
+    n_ref=struct.unpack("<i", data[4:8])[0]
+    pos=8
+    linear=[]
+    for r in range(n_ref):
+        n_bin=struct.unpack("<i", data[pos:pos+4])[0]
+        pos=pos+4
+        for b in range(n_bin):
+            n_chunk=struct.unpack("<i", data[pos+4:pos+8])[0]
+            pos=pos+8+16*n_chunk
+        n_intv=struct.unpack("<i", data[pos:pos+4])[0]
+        linear.append(struct.unpack("<%iQ" %n_intv, data[pos+4:pos+4+8*n_intv]))
+        pos=pos+4+8*n_intv
+    return {"linear":linear}
+
+def fetchBAM(BAMfile, seqname, start, end, tags=None, index=None, n_threads=1, chunksize=10000):
+    """
+    Retrieves the alignments of an indexed BAM file overlapping a region. Reading starts at the virtual offset of
+    the linear index window of the region and stops at the first alignment past the region.
+
+    :param BAMfile: /path/to/file.bam with an index in /path/to/file.bam.bai or /path/to/file.bai
+    :param seqname: sequence name
+    :param start: 1-based start of the region
+    :param end: 1-based, inclusive end of the region
+    :param tags: a list of optional fields to be extracted into typed columns. See readSAMchunks().
+    :param index: an index as returned by readBAMindex(). If None, it is read from the .bai file.
+    :param n_threads: number of threads inflating BGZF blocks
+    :param chunksize: number of alignments to be decoded at a time
+
+    :returns: a Pandas dataframe of the overlapping alignments as the chunks of readSAMchunks()
+    """
+    if index is None:
+        index_path=BAMfile+".bai"
+        if not os.path.exists(index_path):
+            index_path=os.path.splitext(BAMfile)[0]+".bai"
+        index=readBAMindex(index_path)
+    seqname=str(seqname)
+    beg=max(int(start)-1, 0)
+    end=int(end)
+    chunks=[]
+    with open(BAMfile, "rb") as f:
+        stream=_BAMstream(f, n_threads)
+        head, refs, data = _readBAMheader(stream)
+        stream.close()
+        if seqname not in refs or end <= beg:
+            return _concatSAM([], tags)
+        linear=index["linear"][refs.index(seqname)]
+        if len(linear) == 0:
+            return _concatSAM([], tags)
+        # windows without alignments have offset 0
+        voffset=max(linear[:min(beg >> 14, len(linear)-1)+1])
+        f.seek(voffset >> 16)
+        stream=_BAMstream(f, n_threads)
+        first=next(stream, b"")[voffset & 0xffff:]
+        for sam in _BAMchunks(stream, refs, chunksize, tags, first):
+            on=( sam['RNAME'] == seqname ).to_numpy()
+            pos=sam['POS'].to_numpy().astype(np.int64)-1
+            reference_length=np.maximum(CIGARstats(sam['CIGAR'])['reference_length'].to_numpy(), 1)
+            keep=on & ( pos < end ) & ( pos+reference_length > beg )
+            if keep.any():
+                chunks.append(sam[keep])
+            if not on[-1] or pos[-1] >= end:
+                break
+        stream.close()
+    sam=_concatSAM(chunks, tags)
+    sam.index=pd.RangeIndex(len(sam))
+    return sam
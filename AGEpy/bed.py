@@ -8,6 +8,7 @@ import urllib.request as urllib2
 #import StringIO python2
 from io import StringIO
 import gzip
+from functools import reduce
 try:
     import pybedtools
     from pybedtools import BedTool
@@ -17,6 +18,7 @@ except:
 from .gtf import GTFtoBED
 from .gtf import readGTF
 from .gtf import retrieve_GTF_field
+from .intervals import intersectBED
 
 
 def writeBED(inBED, file_path):
@@ -84,8 +86,6 @@ def GetPeaksExons(bed,parsedGTF):
     :returns: a Pandas dataframe
     """
 
-    bedtool_AB=dfTObedtool(bed)
-
     exonsGTF=parsedGTF[parsedGTF["feature"]=="exon"]
     exonsGTF.reset_index(inplace=True, drop=True)
 
@@ -104,10 +104,8 @@ def GetPeaksExons(bed,parsedGTF):
     cols=[bedcols,exonsBEDcols_,["overlap"] ]
     cols=[item for sublist in cols for item in sublist]
 
-    bedtool_exons=dfTObedtool(exonsBED)
-
-    bedtool_target_exons=bedtool_AB.intersect(bedtool_exons, wo=True, s=True)
-    dfTargetE=pd.read_table(bedtool_target_exons.fn, names=cols)
+    dfTargetE=intersectBED(bed.drop_duplicates(), exonsBED.drop_duplicates(), how="wo", strand="same")
+    dfTargetE.columns=cols
     ExonsTransGenes=parsedGTF[["exon_id","transcript_id","gene_id"]].drop_duplicates()
     dfTargets=pd.merge(dfTargetE,ExonsTransGenes,on=["exon_id"],how="left")
     dfTargets["count"]=1
@@ -216,10 +214,8 @@ def AnnotateBED(bed, GTF, genome_file, bedcols=None, promoter=[1000,200]):
     sys.stdout.flush()
 
     GTF=readGTF(GTF)
-    GTF["gene_name"]=retrieve_GTF_field("gene_name", GTF)
-    GTF["gene_id"]=retrieve_GTF_field("gene_id", GTF)
-    GTF["gene_name"]=GTF["gene_name"]+"/"+GTF["gene_id"]
-    GTF=GTF.drop(["gene_id"],axis=1)
+    fields=retrieve_GTF_field(["gene_name","gene_id"], GTF)
+    GTF["gene_name"]=fields["gene_name"]+"/"+fields["gene_id"]
 
     print("Generating promoters annotation.")
     sys.stdout.flush()
@@ -242,14 +238,14 @@ def AnnotateBED(bed, GTF, genome_file, bedcols=None, promoter=[1000,200]):
     promoters=promoters[["seqname","feature","promoter_start","promoter_end","gene_name"]]
     promoters.columns=["seqname","feature","start","end","gene_name"]
 
-    promoters.loc[:,"feature"]="promoter"
+    promoters["feature"]="promoter"
     promoters.drop_duplicates(inplace=True)
     promoters.reset_index(inplace=True, drop=True)
 
     chr_sizes=pd.read_table(genome_file,header=None)
     chr_sizes.columns=["seqname","size"]
     chr_sizes.loc[:,"seqname"]=chr_sizes["seqname"].astype(str)
-    promoters.loc[:,"seqname"]=promoters["seqname"].astype(str)
+    promoters["seqname"]=promoters["seqname"].astype(str)
 
     promoters=pd.merge(promoters,chr_sizes,how="left",on=["seqname"])
     def CorrectStart(df):
@@ -293,9 +289,6 @@ def AnnotateBED(bed, GTF, genome_file, bedcols=None, promoter=[1000,200]):
     print( "Intersecting annotation tables and bed." )
     sys.stdout.flush()
 
-    refGTF=dfTObedtool(GTFs)
-    pos=dfTObedtool(bed)
-
     colsGTF=GTFs.columns.tolist()
     newCols=bed.columns.tolist()
 
@@ -303,9 +296,10 @@ def AnnotateBED(bed, GTF, genome_file, bedcols=None, promoter=[1000,200]):
         newCols.append(f+"_")
     newCols_=[ s for s in newCols if s not in ["seqname_","start_", "end_"]]
 
-    pos=pos.intersect(refGTF, loj=True)
-    pos=pd.read_table(pos.fn , names=newCols)
-    pos=pos[newCols_]
+    pos=intersectBED(bed.drop_duplicates(), GTFs.drop_duplicates(), how="loj")
+    pos.columns=newCols+["overlap"]
+    pos=pos[newCols_].copy()
+    pos["gene_name_"]=pos["gene_name_"].fillna(".")
 
     print("Merging features.")
     sys.stdout.flush()
@@ -0,0 +1,256 @@
+import io
+import gzip
+import struct
+import zlib
+
+_BGZF_HEADER=b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+_BGZF_EOF=b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+_BGZF_BLOCK=0xff00
+
+def _bgzfBlock(data, level=6):
+    """
+    Compresses up to 65280 bytes into one BGZF block.
+    """
+    c=zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated=c.compress(data)+c.flush()
+    return _BGZF_HEADER+struct.pack("<H", len(deflated)+25)+deflated+struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+class BgzfWriter(object):
+    """
+    Writes a BGZF file, ie. a gzip file made of independent blocks of at most 64 kb as used by tabix,
+    samtools and bgzip. The file can be read by any gzip reader.
+
+    :param file_path: /path/to/file.gz
+    :param level: compression level
+    """
+    def __init__(self, file_path, level=6):
+        self.handle=open(file_path, "wb")
+        self.level=level
+        self.buffer=bytearray()
+        self.blocks=[]
+        self.compressed=0
+        self.uncompressed=0
+
+    def _writeBlock(self, data):
+        block=_bgzfBlock(data, self.level)
+        self.blocks.append((self.compressed, self.uncompressed))
+        self.handle.write(block)
+        self.compressed=self.compressed+len(block)
+        self.uncompressed=self.uncompressed+len(data)
+
+    def write(self, data):
+        """
+        Writes str or bytes.
+        """
+        if isinstance(data, str):
+            data=data.encode("utf-8")
+        self.buffer.extend(data)
+        full=len(self.buffer)//_BGZF_BLOCK*_BGZF_BLOCK
+        if full > 0:
+            view=memoryview(self.buffer)
+            for i in range(0, full, _BGZF_BLOCK):
+                self._writeBlock(view[i:i+_BGZF_BLOCK])
+            view.release()
+            del self.buffer[:full]
+
+    def tell(self):
+        """
+        Returns the virtual offset of the next byte to be written, ie. the compressed offset of
+        the current block shifted by 16 bits plus the offset within the block.
+        """
+        return ( self.compressed << 16 ) | len(self.buffer)
+
+    def flush(self):
+        """
+        Closes the current block so that the next write starts a new block.
+        """
+        if len(self.buffer) > 0:
+            self._writeBlock(bytes(self.buffer))
+            self.buffer=bytearray()
+
+    def close(self):
+        self.flush()
+        self.handle.write(_BGZF_EOF)
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _compression(file_path, compression):
+    """
+    Resolves the compression to be used for an output file. With "infer", files ending in .gz, .bgz or .bgzf are BGZF compressed.
+    """
+    if compression == "infer":
+        if str(file_path).endswith((".gz", ".bgz", ".bgzf")):
+            return "bgzf"
+        return None
+    if compression not in [None, "gzip", "bgzf"]:
+        raise ValueError("compression must be one of 'infer', None, 'gzip' or 'bgzf'")
+    return compression
+
+def openOutput(file_path, compression="infer", buffer_size=4*1024*1024):
+    """
+    Opens a binary output file, optionally compressed.
+
+    :param file_path: /path/to/file
+    :param compression: None, 'gzip', 'bgzf' or 'infer' to use BGZF for files ending in .gz, .bgz or .bgzf
+    :param buffer_size: size of the write buffer in bytes
+
+    :returns: a file handle accepting bytes
+    """
+    compression=_compression(file_path, compression)
+    if compression == "bgzf":
+        return BgzfWriter(file_path)
+    if compression == "gzip":
+        return io.BufferedWriter(gzip.open(file_path, "wb"), buffer_size=buffer_size)
+    return open(file_path, "wb", buffering=buffer_size)
+
+class BgzfReader(object):
+    """
+    Reads a BGZF file with random access through virtual offsets.
+
+    :param file_path: /path/to/file.gz
+    """
+    def __init__(self, file_path):
+        self.handle=open(file_path, "rb")
+        self.block_offset=0
+        self.next_offset=0
+        self.block=b""
+        self.pos=0
+        self._loadBlock(0)
+
+    def _loadBlock(self, offset):
+        """
+        Reads and inflates the block starting at the compressed offset. Returns False at the end of the file.
+        """
+        self.handle.seek(offset)
+        block=_readBlock(self.handle)
+        self.block_offset=offset
+        self.pos=0
+        if block is None:
+            self.block=b""
+            self.next_offset=offset
+            return False
+        self.block=_inflateBlock(block)
+        self.next_offset=offset+len(block)
+        return True
+
+    def _nextBlock(self):
+        """
+        Moves to the next non empty block. Returns False at the end of the file.
+        """
+        while True:
+            if not self._loadBlock(self.next_offset):
+                return False
+            if len(self.block) > 0:
+                return True
+
+    def seek(self, voffset):
+        """
+        Moves to a virtual offset as returned by tell() or BgzfWriter.tell().
+        """
+        offset=voffset >> 16
+        if offset != self.block_offset or len(self.block) == 0:
+            self._loadBlock(offset)
+        self.pos=voffset & 0xffff
+
+    def tell(self):
+        """
+        Returns the virtual offset of the next byte to be read.
+        """
+        return ( self.block_offset << 16 ) | self.pos
+
+    def read(self, size=-1):
+        """
+        Reads size bytes or until the end of the file.
+        """
+        chunks=[]
+        while size != 0:
+            if self.pos >= len(self.block):
+                if not self._nextBlock():
+                    break
+            data=self.block[self.pos:] if size < 0 else self.block[self.pos:self.pos+size]
+            self.pos=self.pos+len(data)
+            if size > 0:
+                size=size-len(data)
+            chunks.append(data)
+        return b"".join(chunks)
+
+    def readline(self):
+        """
+        Reads one line including the newline character. Returns b"" at the end of the file.
+        """
+        chunks=[]
+        while True:
+            if self.pos >= len(self.block):
+                if not self._nextBlock():
+                    break
+            i=self.block.find(b"\n", self.pos)
+            if i < 0:
+                chunks.append(self.block[self.pos:])
+                self.pos=len(self.block)
+                continue
+            chunks.append(self.block[self.pos:i+1])
+            self.pos=i+1
+            break
+        return b"".join(chunks)
+
+    def __iter__(self):
+        while True:
+            line=self.readline()
+            if len(line) == 0:
+                return
+            yield line
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _readBlock(handle):
+    """
+    Reads one raw BGZF block from the current position of a binary file handle. Returns None at the end of the file.
+    """
+    header=handle.read(12)
+    if len(header) < 12:
+        return None
+    if header[:4] != b"\x1f\x8b\x08\x04":
+        raise ValueError("not a BGZF file")
+    xlen=struct.unpack("<H", header[10:12])[0]
+    extra=handle.read(xlen)
+    bsize=None
+    i=0
+    while i < xlen:
+        si1, si2, slen = struct.unpack("<BBH", extra[i:i+4])
+        if si1 == 66 and si2 == 67:
+            bsize=struct.unpack("<H", extra[i+4:i+6])[0]
+        i=i+4+slen
+    if bsize is None:
+        raise ValueError("not a BGZF file")
+    return header+extra+handle.read(bsize-xlen-11)
+
+def _inflateBlock(block):
+    """
+    Inflates a raw BGZF block as returned by _readBlock().
+    """
+    xlen=struct.unpack("<H", block[10:12])[0]
+    return zlib.decompress(block[12+xlen:-8], -15)
+
+def isBgzf(file_path):
+    """
+    Checks if a file is BGZF compressed.
+
+    :param file_path: /path/to/file
+
+    :returns: True or False
+    """
+    with open(file_path, "rb") as f:
+        header=f.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
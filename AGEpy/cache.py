@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+
+cache_dir=os.environ.get("AGEPY_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "AGEpy"))
+cache_max_size=20*1024**3
+
+_SEP="\x00"
+
+def _contentHash(path, block=1024*1024):
+    """
+    Hashes the size and the first, middle and last blocks of a file.
+    Reading three blocks keeps the hash cheap for multi-GB files.
+
+    :param path: /path/to/file
+    :param block: size of each hashed block in bytes
+
+    :returns: an hexadecimal md5 digest
+    """
+    size=os.path.getsize(path)
+    h=hashlib.md5(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in sorted(set([0, max(0, size//2-block//2), max(0, size-block)])):
+            f.seek(offset)
+            h.update(f.read(block))
+    return h.hexdigest()
+
+def _cacheKey(path, **options):
+    """
+    Generates a cache key for a file from its path, size, modification time and content hash
+    as well as from the options used to read it.
+
+    :param path: /path/to/file
+    :param options: options used to read the file
+
+    :returns: the key and a dictionary with the information used to generate it
+    """
+    path=os.path.realpath(path)
+    stat=os.stat(path)
+    info={"path":path, "size":stat.st_size, "mtime":stat.st_mtime, "hash":_contentHash(path), "options":options}
+    key=hashlib.sha1(json.dumps(info, sort_keys=True, default=str).encode()).hexdigest()
+    return key, info
+
+def _strings(values):
+    """
+    Encodes a list of strings as one NUL separated utf-8 buffer.
+    """
+    text=_SEP.join(values)
+    if text.count(_SEP) != max(len(values)-1, 0):
+        raise ValueError("strings to be cached can not contain NUL characters")
+    return np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+def _frameTOarrays(df):
+    """
+    Splits a dataframe into numpy arrays. Numeric columns are kept as they are, nullable numeric and boolean
+    columns are stored as values plus a mask of missing values and categorical and string columns are stored
+    as integer codes plus a buffer with the categories.
+
+    :param df: a Pandas dataframe
+
+    :returns: a dictionary of numpy arrays and a list describing each column
+    """
+    arrays={}
+    columns=[]
+    for i, c in enumerate(df.columns.tolist()):
+        col=df[c]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            kind="category"
+        elif col.dtype.kind in "biuf" and isinstance(col.dtype, pd.api.extensions.ExtensionDtype):
+            kind="masked"
+        elif col.dtype.kind in "biuf":
+            kind="array"
+        else:
+            kind="string"
+        if kind == "array":
+            arrays["c%i" %i]=col.to_numpy()
+        elif kind == "masked":
+            arrays["c%i" %i]=col.to_numpy(dtype=col.dtype.numpy_dtype, na_value=0)
+            arrays["c%i_mask" %i]=col.isna().to_numpy()
+        else:
+            cat=col if kind == "category" else col.astype("category")
+            arrays["c%i_codes" %i]=cat.cat.codes.to_numpy()
+            arrays["c%i_categories" %i]=_strings([ str(s) for s in cat.cat.categories ])
+        columns.append({"name":c, "kind":kind, "dtype":str(col.dtype)})
+    return arrays, columns
+
+def _arraysTOframe(arrays, columns):
+    """
+    Rebuilds a dataframe from the output of _frameTOarrays().
+    """
+    df=pd.DataFrame()
+    for i, c in enumerate(columns):
+        if c["kind"] == "array":
+            df[c["name"]]=arrays["c%i" %i]
+            continue
+        if c["kind"] == "masked":
+            col=pd.array(arrays["c%i" %i], dtype=c["dtype"])
+            col[arrays["c%i_mask" %i]]=pd.NA
+            df[c["name"]]=col
+            continue
+        categories=arrays["c%i_categories" %i].tobytes().decode("utf-8")
+        categories=categories.split(_SEP) if len(categories) > 0 else []
+        col=pd.Categorical.from_codes(arrays["c%i_codes" %i], categories=categories)
+        if c["kind"] == "string":
+            col=pd.Series(col).astype(object)
+            if c["dtype"] != "object":
+                col=col.astype(c["dtype"])
+        df[c["name"]]=col
+    return df
+
+def _entries(cache_folder):
+    """
+    Lists the metadata of all entries in a cache folder.
+    """
+    entries=[]
+    if not os.path.isdir(cache_folder):
+        return entries
+    for f in os.listdir(cache_folder):
+        if not f.endswith(".json"):
+            continue
+        meta_file=os.path.join(cache_folder, f)
+        data_file=meta_file[:-len(".json")]+".npz"
+        try:
+            with open(meta_file, "r") as m:
+                meta=json.load(m)
+            meta["key"]=f[:-len(".json")]
+            meta["bytes"]=os.path.getsize(data_file)
+            meta["last_access"]=os.path.getmtime(meta_file)
+        except (OSError, ValueError):
+            continue
+        entries.append(meta)
+    return entries
+
+def _removeEntry(cache_folder, key):
+    for ext in [".npz", ".json"]:
+        try:
+            os.remove(os.path.join(cache_folder, key+ext))
+        except OSError:
+            pass
+
+def readCache(key, cache_folder=None):
+    """
+    Reads a dataframe from the cache.
+
+    :param key: cache key as generated by _cacheKey()
+    :param cache_folder: /path/to/cache/folder. Defaults to AGEPY_CACHE or ~/.cache/AGEpy
+
+    :returns: a Pandas dataframe or None if the key is not cached
+    """
+    if cache_folder is None:
+        cache_folder=cache_dir
+    meta_file=os.path.join(cache_folder, key+".json")
+    data_file=os.path.join(cache_folder, key+".npz")
+    if not ( os.path.isfile(meta_file) and os.path.isfile(data_file) ):
+        return None
+    try:
+        with open(meta_file, "r") as m:
+            meta=json.load(m)
+        with np.load(data_file, allow_pickle=False) as arrays:
+            df=_arraysTOframe(arrays, meta["columns"])
+    except (OSError, ValueError, KeyError):
+        _removeEntry(cache_folder, key)
+        return None
+    os.utime(meta_file, None)
+    return df
+
+def writeCache(df, key, info, cache_folder=None, max_size=None):
+    """
+    Writes a dataframe into the cache and evicts least recently used entries
+    so that the cache folder does not grow over max_size.
+
+    :param df: a Pandas dataframe
+    :param key: cache key as generated by _cacheKey()
+    :param info: dictionary with the information used to generate the key
+    :param cache_folder: /path/to/cache/folder. Defaults to AGEPY_CACHE or ~/.cache/AGEpy
+    :param max_size: maximum size of the cache folder in bytes. Defaults to 20 GB.
+
+    :returns: nothing
+    """
+    if cache_folder is None:
+        cache_folder=cache_dir
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    arrays, columns = _frameTOarrays(df)
+    tmp=os.path.join(cache_folder, "%s.%i.tmp.npz" %(key, os.getpid()))
+    np.savez(tmp, **arrays)
+    os.replace(tmp, os.path.join(cache_folder, key+".npz"))
+    meta=dict(info)
+    meta["columns"]=columns
+    meta["rows"]=len(df)
+    meta["created"]=time.time()
+    tmp=os.path.join(cache_folder, "%s.%i.tmp" %(key, os.getpid()))
+    with open(tmp, "w") as m:
+        json.dump(meta, m, default=str)
+    os.replace(tmp, os.path.join(cache_folder, key+".json"))
+    evictCache(cache_folder=cache_folder, max_size=max_size, keep=[key])
+
+def cacheInfo(cache_folder=None):
+    """
+    Lists the entries in the cache.
+
+    :param cache_folder: /path/to/cache/folder. Defaults to AGEPY_CACHE or ~/.cache/AGEpy
+
+    :returns: a Pandas dataframe with one row per entry: 'key','path','size','mtime','hash','options','rows','bytes','created','last_access'
+    """
+    if cache_folder is None:
+        cache_folder=cache_dir
+    cols=['key','path','size','mtime','hash','options','rows','bytes','created','last_access']
+    entries=_entries(cache_folder)
+    df=pd.DataFrame(entries, columns=cols+["columns"])[cols]
+    df=df.sort_values(by=["last_access"], ascending=False)
+    df.reset_index(inplace=True, drop=True)
+    return df
+
+def evictCache(path=None, cache_folder=None, max_size=None, keep=[]):
+    """
+    Removes entries from the cache. If path is given all entries of this source file are removed,
+    otherwise least recently used entries are removed until the cache is not larger than max_size.
+
+    :param path: /path/to/source/file for which all cached entries should be removed
+    :param cache_folder: /path/to/cache/folder. Defaults to AGEPY_CACHE or ~/.cache/AGEpy
+    :param max_size: maximum size of the cache folder in bytes. Defaults to 20 GB. Use 0 to empty the cache.
+    :param keep: list of keys which should not be evicted
+
+    :returns: a list with the removed keys
+    """
+    if cache_folder is None:
+        cache_folder=cache_dir
+    if max_size is None:
+        max_size=cache_max_size
+    entries=_entries(cache_folder)
+    removed=[]
+    if path is not None:
+        path=os.path.realpath(path)
+        for e in entries:
+            if e["path"] == path:
+                _removeEntry(cache_folder, e["key"])
+                removed.append(e["key"])
+        return removed
+    entries=sorted(entries, key=lambda e: e["last_access"])
+    total=sum([ e["bytes"] for e in entries ])
+    for e in entries:
+        if total <= max_size:
+            break
+        if e["key"] in keep:
+            continue
+        _removeEntry(cache_folder, e["key"])
+        removed.append(e["key"])
+        total=total-e["bytes"]
+    return removed
@@ -0,0 +1,161 @@
+import re
+import numpy as np
+import pandas as pd
+
+# operation codes as in the BAM format: M=0, I=1, D=2, N=3, S=4, H=5, P=6, '='=7, X=8
+CIGAR_OPS="MIDNSHP=X"
+
+_CIGAR=re.compile(rb"(\d+)([MIDNSHP=X])|(\n)")
+_OP_CODES=np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(CIGAR_OPS.encode()):
+    _OP_CODES[_c]=_i
+
+_CONSUMES_REFERENCE=np.array([1,0,1,1,0,0,0,1,1], dtype=bool)
+_CONSUMES_QUERY=np.array([1,1,0,0,1,0,0,1,1], dtype=bool)
+_ALIGNED=np.array([1,0,0,0,0,0,0,1,1], dtype=bool)
+
+def _factorizeCIGAR(cigar):
+    """
+    Factorizes a CIGAR column. Categorical columns, as returned by readSAMchunks(), are not factorized again.
+
+    :returns: the code of each CIGAR string (-1 for missing) and the unique CIGAR strings
+    """
+    if isinstance(cigar, pd.Series) and isinstance(cigar.dtype, pd.CategoricalDtype):
+        return cigar.cat.codes.to_numpy().astype(np.int64), [ str(c) for c in cigar.cat.categories ]
+    codes, uniques = pd.factorize(np.asarray(cigar, dtype=object))
+    return codes.astype(np.int64), [ str(c) for c in uniques ]
+
+def _tokenizeCIGAR(strings):
+    """
+    Tokenizes CIGAR strings in one pass. The strings are joined into a single newline separated buffer
+    which is scanned once; the newline matches are used to recover the string each operation belongs to.
+
+    :returns: the string index, the operation code and the length of each operation and the offset and number of operations of each string
+    """
+    tokens=_CIGAR.findall("\n".join(strings).encode())
+    n=len(strings)
+    if len(tokens) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    tokens=np.array(tokens)
+    newlines=tokens[:,2] == b"\n"
+    group=np.cumsum(newlines)[~newlines]
+    tokens=tokens[~newlines]
+    ops=_OP_CODES[np.frombuffer(np.ascontiguousarray(tokens[:,1]).astype("S1").tobytes(), dtype=np.uint8)]
+    lengths=tokens[:,0].astype(np.int64)
+    counts=np.bincount(group, minlength=n)
+    offsets=np.cumsum(counts)-counts
+    return group, ops, lengths, offsets, counts
+
+def _expand(codes, offsets, counts):
+    """
+    Expands per unique string items to the rows of a factorized column.
+
+    :param codes: the code of each row, -1 for missing
+    :param offsets: the offset of the items of each unique string
+    :param counts: the number of items of each unique string
+
+    :returns: the row of each expanded item and its index in the unique items
+    """
+    valid=codes >= 0
+    n=np.where(valid, counts[np.maximum(codes, 0)], 0)
+    total=int(n.sum())
+    rows=np.repeat(np.arange(len(codes)), n)
+    first=np.cumsum(n)-n
+    items=np.arange(total)-np.repeat(first, n)+np.repeat(np.where(valid, offsets[np.maximum(codes, 0)], 0), n)
+    return rows, items
+
+def parseCIGAR(cigar):
+    """
+    Parses a column of CIGAR strings into flat arrays of operations. Each distinct CIGAR string is parsed
+    once with a single regular expression scan.
+
+    :param cigar: a Pandas series, eg. the CIGAR column of readSAMchunks(), or a list of CIGAR strings
+
+    :returns: a Pandas dataframe with one row per operation and the columns 'read' (the position of the read in cigar), 'op' (the operation code, ie. the index in 'MIDNSHP=X') and 'length'
+    """
+    codes, uniques = _factorizeCIGAR(cigar)
+    group, ops, lengths, offsets, counts = _tokenizeCIGAR(uniques)
+    rows, items = _expand(codes, offsets, counts)
+    return pd.DataFrame({"read":rows, "op":ops[items], "length":lengths[items]})
+
+def CIGARstats(cigar):
+    """
+    Computes per read alignment statistics from a column of CIGAR strings.
+
+    :param cigar: a Pandas series, eg. the CIGAR column of readSAMchunks(), or a list of CIGAR strings
+
+    :returns: a Pandas dataframe with one row per read and the columns 'reference_length' (M, D, N, = and X), 'query_length' (M, I, S, = and X), 'aligned_length' (M, = and X), 'soft_clip_left', 'soft_clip_right', 'hard_clip', 'insertions', 'deletions' and 'skipped' (N). The last reference position of a read is POS+reference_length-1.
+    """
+    codes, uniques = _factorizeCIGAR(cigar)
+    group, ops, lengths, offsets, counts = _tokenizeCIGAR(uniques)
+    n=len(uniques)
+
+    def total(mask):
+        return np.bincount(group[mask], weights=lengths[mask], minlength=n).astype(np.int64)
+
+    stats={"reference_length":total(_CONSUMES_REFERENCE[ops]) if len(ops) > 0 else np.zeros(n, dtype=np.int64),
+           "query_length":total(_CONSUMES_QUERY[ops]) if len(ops) > 0 else np.zeros(n, dtype=np.int64),
+           "aligned_length":total(_ALIGNED[ops]) if len(ops) > 0 else np.zeros(n, dtype=np.int64)}
+
+    # soft clips can only follow or precede hard clips at the ends of a read
+    has=counts > 0
+    left=np.where(has, offsets, 0)
+    right=np.where(has, offsets+counts-1, 0)
+    if len(ops) > 0:
+        left=np.where(( ops[left] == 5 ) & ( counts > 1 ), left+1, left)
+        right=np.where(( ops[right] == 5 ) & ( counts > 1 ), right-1, right)
+        stats["soft_clip_left"]=np.where(has & ( ops[left] == 4 ), lengths[left], 0)
+        stats["soft_clip_right"]=np.where(has & ( ops[right] == 4 ) & ( counts > 1 ), lengths[right], 0)
+    else:
+        stats["soft_clip_left"]=np.zeros(n, dtype=np.int64)
+        stats["soft_clip_right"]=np.zeros(n, dtype=np.int64)
+    for name, op in [("hard_clip",5), ("insertions",1), ("deletions",2), ("skipped",3)]:
+        stats[name]=total(ops == op) if len(ops) > 0 else np.zeros(n, dtype=np.int64)
+
+    valid=codes >= 0
+    index=cigar.index if isinstance(cigar, pd.Series) else None
+    df=pd.DataFrame({ k:np.where(valid, v[np.maximum(codes, 0)], 0) if n > 0 else np.zeros(len(codes), dtype=np.int64) for k, v in stats.items() }, index=index)
+    return df
+
+def _uniqueBlocks(group, ops, lengths, offsets, counts):
+    """
+    Computes the aligned blocks of unique CIGAR strings relative to the alignment start.
+
+    :returns: the relative 0-based start and end of each block and the offset and number of blocks of each string
+    """
+    n=len(counts)
+    if len(ops) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    reference=np.where(_CONSUMES_REFERENCE[ops], lengths, 0)
+    cs=np.cumsum(reference)
+    starts=cs-reference-( cs-reference )[offsets[group]]
+    aligned=_ALIGNED[ops] & ( lengths > 0 )
+    group=group[aligned]
+    starts=starts[aligned]
+    ends=starts+lengths[aligned]
+    # blocks only separated by insertions, soft clips or padding are merged
+    new=np.ones(len(starts), dtype=bool)
+    new[1:]=( group[1:] != group[:-1] ) | ( starts[1:] != ends[:-1] )
+    first=np.flatnonzero(new)
+    block_group=group[first]
+    block_starts=starts[first]
+    block_ends=np.maximum.reduceat(ends, first) if len(first) > 0 else ends
+    block_counts=np.bincount(block_group, minlength=n)
+    block_offsets=np.cumsum(block_counts)-block_counts
+    return block_starts, block_ends, block_offsets, block_counts
+
+def alignedBlocks(pos, cigar):
+    """
+    Computes the reference intervals covered by the aligned bases (M, = and X) of each read.
+    Blocks are separated by deletions (D) and skipped regions (N), eg. introns.
+
+    :param pos: a Pandas series or numpy array with the 1-based leftmost mapping positions, eg. the POS column of readSAMchunks()
+    :param cigar: a Pandas series, eg. the CIGAR column of readSAMchunks(), or a list of CIGAR strings
+
+    :returns: a Pandas dataframe with one row per block and the columns 'read' (the position of the read in cigar), 'start' (0-based) and 'end' (exclusive)
+    """
+    codes, uniques = _factorizeCIGAR(cigar)
+    block_starts, block_ends, block_offsets, block_counts = _uniqueBlocks(*_tokenizeCIGAR(uniques))
+    rows, items = _expand(codes, block_offsets, block_counts)
+    pos=np.asarray(pos).astype(np.int64)
+    return pd.DataFrame({"read":rows, "start":pos[rows]-1+block_starts[items], "end":pos[rows]-1+block_ends[items]})
@@ -0,0 +1,107 @@
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from .fasta import fetchFastaIntervals
+
+# A=0, C=1, G=2, T=3, any other base=4
+_CODES=np.full(256, 4, dtype=np.uint8)
+for _b, _c in zip(b"ACGTacgt", [0,1,2,3,0,1,2,3]):
+    _CODES[_b]=_c
+
+# largest number of k-mer counts held by one batch
+_KMER_CELLS=2**22
+
+def kmerNames(k):
+    """
+    Lists all k-mers in the order of their integer encoding (A=0, C=1, G=2, T=3, first base most significant).
+
+    :param k: k-mer length
+
+    :returns: a list of strings
+    """
+    return [ "".join(p) for p in itertools.product("ACGT", repeat=k) ]
+
+def _prefix(values):
+    """
+    Cumulative sum with a leading 0 so that the sum over [a, b) is prefix[b]-prefix[a].
+    """
+    return np.concatenate([[0], np.cumsum(values, dtype=np.int64)])
+
+def _composition(task):
+    """
+    Computes the composition of a batch of intervals.
+
+    :param task: a tuple with a bed dataframe, /path/to/file.fa and k
+
+    :returns: a numpy array with the base counts, the CpG count and the k-mer counts of each interval and a mask of missing intervals
+    """
+    bed, fasta, k = task
+    seqs=fetchFastaIntervals(bed, fasta)
+    missing=seqs.isnull().to_numpy()
+    seqs=seqs.where(~missing, "").tolist()
+    lengths=np.array([ len(s) for s in seqs ], dtype=np.int64)
+    codes=_CODES[np.frombuffer("".join(seqs).encode(), dtype=np.uint8)]
+    interval=np.repeat(np.arange(len(seqs), dtype=np.int64), lengths)
+
+    counts=np.zeros((len(seqs), 6+( 4**k if k else 0 )), dtype=np.int32)
+    counts[:,:5]=np.bincount(interval*5+codes, minlength=len(seqs)*5).reshape(len(seqs), 5)
+    pairs=( codes[:-1] == 1 ) & ( codes[1:] == 2 ) & ( interval[:-1] == interval[1:] )
+    counts[:,5]=np.bincount(interval[:-1][pairs], minlength=len(seqs))
+
+    if k and len(codes) >= k:
+        n=len(codes)-k+1
+        kmer=np.zeros(n, dtype=np.int64)
+        for j in range(k):
+            kmer=kmer*4+np.minimum(codes[j:j+n], 3)
+        no_n=_prefix(codes == 4)
+        valid=( interval[:n] == interval[k-1:] ) & ( no_n[k:] == no_n[:n] )
+        counts[:,6:]=np.bincount(interval[:n][valid]*4**k+kmer[valid], minlength=len(seqs)*4**k).reshape(len(seqs), 4**k)
+    return counts, missing
+
+def sequenceComposition(bed, fasta, k=None, n_jobs=1, chunksize=10000):
+    """
+    Computes the base composition, GC content, CpG observed/expected ratio and optionally the k-mer counts
+    of many intervals. Sequences are fetched with fetchFastaIntervals() and all statistics are computed
+    with bincounts and prefix sums over integer base and k-mer codes of the concatenated sequences of each batch.
+
+    :param bed: a Pandas dataframe in bed format eg. as returned by getPromotersBed() or GetBEDnarrowPeakgz(). The first three columns are used as chromosome, 0-based start and end. If a 'strand' column is present, intervals with '-' are reverse complemented.
+    :param fasta: /path/to/file.fa. The index is built and written to fasta+'.fai' if it does not exist, or only kept in memory if fasta+'.fai' cannot be written.
+    :param k: k-mer length. If None, k-mers are not counted. k-mers containing bases other than A, C, G or T are not counted.
+    :param n_jobs: number of processes to use
+    :param chunksize: number of intervals to be processed by one process at a time. Lowered for large k so that a batch holds at most 4**11 k-mer counts.
+
+    :returns: a Pandas dataframe indexed as bed with the columns 'length','A','C','G','T','N','GC content','CpG','CpG o/e' and one column per k-mer (for k=1 these are the 'A','C','G','T' columns). 'N' counts all bases other than A, C, G and T, 'GC content' is the GC fraction of the A, C, G and T bases and 'CpG o/e' is CpG*(A+C+G+T)/(C*G) as in Gardiner-Garden and Frommer, 1987. Intervals on sequences not present in the fasta file are NaN.
+    """
+    if k:
+        chunksize=max(1, min(chunksize, _KMER_CELLS//4**k))
+    tasks=[ (bed.iloc[i:i+chunksize], fasta, k) for i in range(0, len(bed), chunksize) ]
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results=list(pool.map(_composition, tasks))
+    else:
+        results=[ _composition(t) for t in tasks ]
+    if len(results) > 0:
+        counts=np.concatenate([ r[0] for r in results ])
+        missing=np.concatenate([ r[1] for r in results ])
+    else:
+        counts=np.zeros((0, 6+( 4**k if k else 0 )), dtype=np.int32)
+        missing=np.zeros(0, dtype=bool)
+
+    acgt=counts[:,:4].sum(axis=1, dtype=np.int64)
+    c=counts[:,1].astype(float)
+    g=counts[:,2].astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gc=np.where(acgt > 0, ( c+g )/acgt, np.nan)
+        oe=np.where(c*g > 0, counts[:,5]*acgt.astype(float)/( c*g ), np.nan)
+    df=pd.DataFrame(counts[:,:5], columns=['A','C','G','T','N'], index=bed.index)
+    df.insert(0, "length", counts[:,:5].sum(axis=1, dtype=np.int64))
+    df["GC content"]=gc
+    df["CpG"]=counts[:,5]
+    df["CpG o/e"]=oe
+    if k and k > 1:
+        df=pd.concat([df, pd.DataFrame(counts[:,6:], columns=kmerNames(k), index=bed.index)], axis=1)
+    if missing.any():
+        df=df.astype({ c:float for c in df.columns })
+        df.loc[missing,:]=np.nan
+    return df
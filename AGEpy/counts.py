@@ -0,0 +1,318 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from .sam import readSAMchunks, filterSAM, _flags, _libraryStrand
+from .cigar import alignedBlocks
+from .gtf import retrieve_GTF_field
+
+COUNT_STATUS=['Assigned','Unassigned_Unmapped','Unassigned_Filtered','Unassigned_MappingQuality','Unassigned_MultiMapping','Unassigned_NoFeatures','Unassigned_Ambiguity']
+
+def _expandRanges(first, n):
+    """
+    Expands ranges [first, first+n) into one flat array.
+
+    :returns: the index of the range of each item and the item
+    """
+    which=np.repeat(np.arange(len(first)), n)
+    starts=np.cumsum(n, dtype=np.int64)-n
+    return which, np.repeat(first, n)+np.arange(int(n.sum()))-np.repeat(starts, n)
+
+def _segments(starts, ends, features, n_features):
+    """
+    Splits the intervals of one sequence at all their boundaries into disjoint segments and lists the features covering each segment.
+
+    :param starts: 0-based starts of the intervals
+    :param ends: ends of the intervals
+    :param features: the feature code of each interval
+    :param n_features: the total number of features
+
+    :returns: the sorted segment boundaries, the offsets of the features of each segment and the features, and the number of bases of each feature
+    """
+    bounds=np.unique(np.concatenate([starts, ends]))
+    first=np.searchsorted(bounds, starts)
+    n=np.searchsorted(bounds, ends)-first
+    which, segment = _expandRanges(first, n)
+    pairs=np.unique(segment*n_features+features[which])
+    segment=pairs//n_features
+    features=pairs%n_features
+    offsets=np.concatenate([[0], np.cumsum(np.bincount(segment, minlength=len(bounds)))])
+    lengths=np.bincount(features, weights=bounds[np.minimum(segment+1, len(bounds)-1)]-bounds[segment], minlength=n_features)
+    return (bounds, offsets, features), lengths
+
+def _featureIndex(gtf, feature, attribute, stranded):
+    """
+    Builds a sorted segment index of the features of a GTF for each sequence, and strand if stranded.
+    Features are meta-features, ie. all intervals sharing the same attribute eg. all exons of a gene.
+
+    :returns: a list of feature names, the number of non-overlapping bases of each feature and a dictionary of (seqname, strand) and segment indexes
+    """
+    gtf=gtf[gtf['feature'] == feature]
+    if attribute in gtf.columns:
+        ids=gtf[attribute].to_numpy(dtype=object)
+    else:
+        ids=retrieve_GTF_field(attribute, gtf)[attribute].to_numpy(dtype=object)
+    codes, names = pd.factorize(ids)
+    valid=codes >= 0
+    codes=codes[valid].astype(np.int64)
+    seqname=gtf['seqname'].astype(str).to_numpy()[valid]
+    strand=gtf['strand'].astype(str).to_numpy()[valid]
+    starts=gtf['start'].to_numpy().astype(np.int64)[valid]-1
+    ends=gtf['end'].to_numpy().astype(np.int64)[valid]
+    n_features=len(names)
+
+    index={}
+    lengths=np.zeros(n_features)
+    for s in np.unique(seqname):
+        on=seqname == s
+        segments, l = _segments(starts[on], ends[on], codes[on], n_features)
+        lengths=lengths+l
+        if not stranded:
+            index[(s, 0)]=segments
+            continue
+        # features without strand are counted on both strands
+        for k, sign in [(1, "-"), (-1, "+")]:
+            keep=on & ( strand != sign )
+            if keep.any():
+                index[(s, k)]=_segments(starts[keep], ends[keep], codes[keep], n_features)[0]
+    return [ str(n) for n in names ], lengths.astype(np.int64), index
+
+# the segment indexes of a worker process, set once by _initWorker()
+_WORKER_INDEX=None
+
+def _initWorker(index):
+    """
+    Keeps the segment indexes in a worker process so that tasks only carry the key of their shard.
+    """
+    global _WORKER_INDEX
+    _WORKER_INDEX=index
+
+def _assignReads(task, index=None):
+    """
+    Assigns the reads of one sequence shard to features.
+
+    :param task: a tuple with the read of each block, the 0-based start and the end of each block, the weight of each read, the (seqname, strand) key of the shard, the number of features, the overlap policy and the minimum overlap
+    :param index: a dictionary of (seqname, strand) and segment indexes. Defaults to the indexes of the worker process.
+
+    :returns: the counts of each feature and the number of assigned, unassigned without features and ambiguous reads
+    """
+    read, start, end, weight, key, n_features, overlap, min_overlap = task
+    bounds, offsets, genes = ( _WORKER_INDEX if index is None else index )[key]
+    n_reads=len(weight)
+    first=np.maximum(np.searchsorted(bounds, start, side="right")-1, 0)
+    n=np.maximum(np.minimum(np.searchsorted(bounds, end), len(bounds)-1)-first, 0)
+    block, segment = _expandRanges(first, n)
+    bases=np.minimum(end[block], bounds[segment+1])-np.maximum(start[block], bounds[segment])
+    which, item = _expandRanges(offsets[segment], offsets[segment+1]-offsets[segment])
+    pairs=read[block[which]]*n_features+genes[item]
+    pairs, inverse = np.unique(pairs, return_inverse=True)
+    bases=np.bincount(inverse, weights=bases[which], minlength=len(pairs))
+    keep=bases >= max(min_overlap, 1)
+    pairs=pairs[keep]
+    bases=bases[keep]
+    pair_read=pairs//n_features
+    pair_gene=pairs%n_features
+
+    hits=np.bincount(pair_read, minlength=n_reads)
+    if overlap == "all":
+        assigned=np.ones(len(pairs), dtype=bool)
+    elif overlap == "largest":
+        largest=np.zeros(n_reads)
+        np.maximum.at(largest, pair_read, bases)
+        assigned=bases == largest[pair_read]
+        assigned=assigned & ( np.bincount(pair_read[assigned], minlength=n_reads)[pair_read] == 1 )
+    else:
+        assigned=hits[pair_read] == 1
+    counts=np.bincount(pair_gene[assigned], weights=weight[pair_read[assigned]], minlength=n_features)
+    n_assigned=len(np.unique(pair_read[assigned]))
+    n_none=int(( hits == 0 ).sum())
+    return counts, n_assigned, n_none, n_reads-n_assigned-n_none
+
+def _chunkTasks(chunk, index, n_features, stranded, multimapping, include_flags, exclude_flags, min_mapq, overlap, min_overlap, summary):
+    """
+    Filters a chunk of alignments, updates the summary with the unassigned reads and splits the rest into one task per sequence shard.
+    """
+    flags=_flags(chunk['FLAG'])
+    unmapped=( flags & 4 ) != 0
+    filtered=~unmapped & ~filterSAM(chunk, include_flags, exclude_flags, 0)
+    low=~unmapped & ~filtered & ( chunk['MAPQ'].to_numpy() < min_mapq )
+    nh=pd.to_numeric(chunk['NH']).fillna(1).to_numpy()
+    multi=~unmapped & ~filtered & ~low & ( nh > 1 ) & ( not multimapping )
+    keep=~( unmapped | filtered | low | multi )
+    summary['Unassigned_Unmapped']+=int(unmapped.sum())
+    summary['Unassigned_Filtered']+=int(filtered.sum())
+    summary['Unassigned_MappingQuality']+=int(low.sum())
+    summary['Unassigned_MultiMapping']+=int(multi.sum())
+
+    chunk=chunk[keep]
+    weight=1/np.maximum(nh[keep], 1) if multimapping == "fraction" else np.ones(len(chunk))
+    strand=_libraryStrand(chunk['FLAG'], stranded) if stranded else np.zeros(len(chunk), dtype=np.int8)
+    # category codes are int8 for few categories, too narrow for the shard key
+    seq=chunk['RNAME'].cat.codes.to_numpy().astype(np.int64)
+    names=chunk['RNAME'].cat.categories.astype(str)
+    blocks=alignedBlocks(chunk['POS'], chunk['CIGAR'])
+    block_read=blocks['read'].to_numpy()
+    block_key=seq[block_read]*3+strand[block_read]+1
+    order=np.argsort(block_key, kind="stable")
+    block_read=block_read[order]
+    block_start=blocks['start'].to_numpy()[order]
+    block_end=blocks['end'].to_numpy()[order]
+    block_key=block_key[order]
+    bounds=np.flatnonzero(block_key[1:] != block_key[:-1])+1
+
+    tasks=[]
+    in_shard=np.zeros(len(chunk), dtype=bool)
+    for b, e in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(block_read)]])):
+        if b == e:
+            continue
+        key=(names[seq[block_read[b]]], int(strand[block_read[b]]))
+        if key not in index:
+            continue
+        reads, local = np.unique(block_read[b:e], return_inverse=True)
+        in_shard[reads]=True
+        tasks.append((local.astype(np.int64), block_start[b:e], block_end[b:e], weight[reads], key, n_features, overlap, min_overlap))
+    summary['Unassigned_NoFeatures']+=int(( ~in_shard ).sum())
+    return tasks
+
+def countReads(SAMfiles, gtf, feature="exon", attribute="gene_id", stranded=0, multimapping=False, overlap="unique", min_overlap=1, include_flags=0, exclude_flags=0, min_mapq=0, names=None, summary=False, n_jobs=1, chunksize=200000):
+    """
+    Counts the reads of SAM files overlapping the features of a GTF as featureCounts. Alignments are streamed in chunks,
+    split into aligned blocks and assigned through a sorted index of the disjoint segments of the features of each sequence.
+    Each chunk is split into one shard per sequence, and strand, which are assigned in parallel if n_jobs > 1.
+    The index is sent once to each worker process and shards only refer to it by key.
+    Reads are counted individually, ie. both mates of a pair are counted.
+
+    :param SAMfiles: /path/to/file.sam or a list of /path/to/file.sam, one per sample. gzip or BGZF compressed files are read as well.
+    :param gtf: a GTF dataframe as returned by readGTF() or parseGTF()
+    :param feature: the feature to count reads on eg. 'exon'
+    :param attribute: the attribute grouping features into meta-features eg. 'gene_id' or 'transcript_id'
+    :param stranded: 0 for unstranded libraries, 1 if read 1 (or the single end read) is on the transcript strand and 2 if it is on the opposite strand
+    :param multimapping: False to not count reads with NH above 1, True to count each of their alignments and 'fraction' to count each alignment as 1/NH
+    :param overlap: 'unique' to count only reads overlapping one meta-feature, 'all' to count reads for all the meta-features they overlap and 'largest' to count reads for the meta-feature with the largest overlap
+    :param min_overlap: minimum number of overlapping bases for a read to be assigned to a meta-feature
+    :param include_flags: only alignments with all these bits set are counted
+    :param exclude_flags: alignments with any of these bits set are not counted. Unmapped reads are never counted.
+    :param min_mapq: minimum mapping quality
+    :param names: a list of sample names. Defaults to the file names without extension.
+    :param summary: logical, if True, a summary of the assigned and unassigned reads of each sample is returned as well
+    :param n_jobs: number of processes to use
+    :param chunksize: number of alignments to be read at a time
+
+    :returns: a Pandas dataframe with the columns attribute, 'length' (the number of non-overlapping bases of the meta-feature) and one column of counts per sample, and a Pandas dataframe with the number of reads per assignment status and sample if summary=True. Use MAcounts() to plot it with MA() and countsMatrix() for QC_plots.
+    """
+    if isinstance(SAMfiles, str):
+        SAMfiles=[SAMfiles]
+    if names is None:
+        names=[ os.path.basename(f).split(".")[0] for f in SAMfiles ]
+    if overlap not in ["unique","all","largest"]:
+        raise ValueError("overlap must be 'unique', 'all' or 'largest'")
+    if multimapping not in [False, True, "fraction"]:
+        raise ValueError("multimapping must be False, True or 'fraction'")
+    features, lengths, index = _featureIndex(gtf, feature, attribute, stranded)
+    n_features=len(features)
+
+    pool=ProcessPoolExecutor(max_workers=n_jobs, initializer=_initWorker, initargs=(index,)) if n_jobs > 1 else None
+    counts={}
+    stats={}
+    try:
+        for name, SAMfile in zip(names, SAMfiles):
+            total=np.zeros(n_features)
+            status={ s:0 for s in COUNT_STATUS }
+
+            def collect(result):
+                c, assigned, none, ambiguous = result
+                status['Assigned']+=assigned
+                status['Unassigned_NoFeatures']+=none
+                status['Unassigned_Ambiguity']+=ambiguous
+                return c
+
+            pending=[]
+            for chunk in readSAMchunks(SAMfile, chunksize=chunksize, tags=["NH"]):
+                tasks=_chunkTasks(chunk, index, n_features, stranded, multimapping, include_flags, exclude_flags, min_mapq, overlap, min_overlap, status)
+                if pool is None:
+                    for t in tasks:
+                        total=total+collect(_assignReads(t, index))
+                    continue
+                pending.extend([ pool.submit(_assignReads, t) for t in tasks ])
+                while len(pending) > 4*n_jobs:
+                    total=total+collect(pending.pop(0).result())
+            for p in pending:
+                total=total+collect(p.result())
+            counts[name]=total if multimapping == "fraction" else np.round(total).astype(np.int64)
+            stats[name]=status
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    df=pd.DataFrame({attribute:features, "length":lengths})
+    for name in names:
+        df[name]=counts[name]
+    if summary:
+        return df, pd.DataFrame(stats).loc[COUNT_STATUS]
+    return df
+
+def _sampleColumns(counts):
+    """
+    Returns the sample columns of a counts table as returned by countReads(), ie. the columns after 'length'.
+    """
+    columns=counts.columns.tolist()
+    return columns[columns.index("length")+1:]
+
+def normalizeCounts(counts):
+    """
+    Normalizes the counts of each sample by its size factor, the median ratio of its counts to the
+    geometric mean counts of each meta-feature as in DESeq (Anders and Huber, 2010). Only meta-features
+    with counts in all samples are used; if there are none, samples are scaled by their total counts.
+
+    :param counts: a Pandas dataframe as returned by countReads()
+
+    :returns: a copy of counts with normalized counts in the sample columns
+    """
+    samples=_sampleColumns(counts)
+    values=counts[samples].to_numpy(dtype=float)
+    expressed=( values > 0 ).all(axis=1)
+    if expressed.any():
+        logs=np.log(values[expressed])
+        factors=np.exp(np.median(logs-logs.mean(axis=1, keepdims=True), axis=0))
+    else:
+        totals=values.sum(axis=0)
+        factors=np.ones(len(samples))
+        if ( totals > 0 ).any():
+            factors[totals > 0]=totals[totals > 0]/totals[totals > 0].mean()
+    df=counts.copy()
+    df[samples]=values/factors
+    return df
+
+def MAcounts(counts, pairs, normalize=True):
+    """
+    Prepares a counts table for MA(): counts are normalized with normalizeCounts() and the 'log2(B/A)'
+    column MA() plots is added for each pair of samples [A, B]. Pass the pair as c to MA() and 'Genes' as
+    title for gene_id counts or 'Transcripts' for transcript_id counts.
+
+    :param counts: a Pandas dataframe as returned by countReads()
+    :param pairs: a pair of samples [A, B] or a list of pairs
+    :param normalize: logical, if False, raw counts are used
+
+    :returns: a Pandas dataframe
+    """
+    if isinstance(pairs[0], str):
+        pairs=[pairs]
+    df=normalizeCounts(counts) if normalize else counts.copy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for a, b in pairs:
+            df["log2(%s/%s)" %( str(b), str(a) )]=np.log2(df[b].to_numpy(dtype=float)/df[a].to_numpy(dtype=float))
+    return df
+
+def countsMatrix(counts, normalize=True):
+    """
+    Reshapes a counts table into the layout of the all_res_counts.xlsx table read by QC_plots:
+    one row per meta-feature indexed by its id and one column per sample.
+
+    :param counts: a Pandas dataframe as returned by countReads()
+    :param normalize: logical, if True, counts are normalized with normalizeCounts()
+
+    :returns: a Pandas dataframe. Write it with to_excel() as all_res_counts.xlsx in the differential expression folder given to QC_plots.
+    """
+    if normalize:
+        counts=normalizeCounts(counts)
+    return counts.set_index(counts.columns[0])[_sampleColumns(counts)]
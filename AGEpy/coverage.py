@@ -0,0 +1,136 @@
+import numpy as np
+from .sam import readSAMchunks, filterSAM, SAMsequences, _sortedByCoordinate, _flags
+from .cigar import alignedBlocks
+from .bgzf import openOutput
+
+def _strandMask(sam, strand):
+    """
+    Selects alignments on the forward ('+') or reverse ('-') strand. Any other value selects all alignments.
+    """
+    if strand == "+":
+        return ( _flags(sam['FLAG']) & 16 ) == 0
+    if strand == "-":
+        return ( _flags(sam['FLAG']) & 16 ) != 0
+    return np.ones(len(sam), dtype=bool)
+
+def _depthArrays(SAMfile, strand=None, include_flags=0, exclude_flags=1796, min_mapq=0, seqnames=None, chunksize=200000):
+    """
+    Accumulates the depth of each reference sequence in a difference array updated with np.add.at for each chunk
+    of aligned blocks. For coordinate sorted files each sequence is finished and released as soon as the next one starts,
+    otherwise all sequences are kept until the end of the file.
+
+    :returns: a generator of sequence names and numpy int32 depth arrays
+    """
+    head, chunks = readSAMchunks(SAMfile, chunksize=chunksize, header=True)
+    lengths=SAMsequences(head)
+    by_coordinate=_sortedByCoordinate(head)
+    diffs={}
+    finished=set()
+
+    def finish(name):
+        diff=diffs.pop(name)
+        np.cumsum(diff, out=diff)
+        finished.add(name)
+        return name, diff[:lengths.get(name, len(diff)-1)]
+
+    for chunk in chunks:
+        keep=filterSAM(chunk, include_flags, exclude_flags, min_mapq) & _strandMask(chunk, strand)
+        chunk=chunk[keep]
+        if len(chunk) == 0:
+            continue
+        blocks=alignedBlocks(chunk['POS'], chunk['CIGAR'])
+        rname=chunk['RNAME'].astype(str).to_numpy()[blocks['read'].to_numpy()]
+        if len(rname) == 0:
+            continue
+        starts=blocks['start'].to_numpy()
+        ends=blocks['end'].to_numpy()
+        order=np.argsort(rname, kind="stable")
+        rname=rname[order]
+        starts=starts[order]
+        ends=ends[order]
+        bounds=np.flatnonzero(rname[1:] != rname[:-1])+1
+        for b, e in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(rname)]])):
+            name=rname[b]
+            if seqnames is not None and name not in seqnames:
+                continue
+            if name in finished:
+                raise ValueError("%s is not sorted by coordinate: %s is not contiguous" %(SAMfile, name))
+            s=np.maximum(starts[b:e], 0)
+            t=ends[b:e]
+            diff=diffs.get(name)
+            size=max(lengths.get(name, 0), int(t.max()))+1
+            if diff is None:
+                diff=np.zeros(size, dtype=np.int32)
+            elif size > len(diff):
+                diff=np.concatenate([diff, np.zeros(size-len(diff), dtype=np.int32)])
+            np.add.at(diff, s, 1)
+            np.add.at(diff, t, -1)
+            diffs[name]=diff
+        if by_coordinate:
+            last=str(chunk['RNAME'].iloc[-1])
+            for name in [ n for n in diffs if n != last ]:
+                yield finish(name)
+
+    for name in [ n for n in lengths if n in diffs ]+[ n for n in diffs if n not in lengths ]:
+        yield finish(name)
+
+def SAMcoverage(SAMfile, strand=None, include_flags=0, exclude_flags=1796, min_mapq=0, seqnames=None, chunksize=200000):
+    """
+    Computes the per base depth of coverage of the aligned bases (M, = and X) of a SAM file.
+    Deletions and skipped regions (N) are not counted.
+
+    :param SAMfile: /path/to/file.sam. gzip or BGZF compressed files are read as well.
+    :param strand: '+' or '-' to count only alignments on the forward or reverse strand. None counts all alignments.
+    :param include_flags: only alignments with all these bits set are counted
+    :param exclude_flags: alignments with any of these bits set are not counted. Defaults to unmapped, secondary, QC fail and duplicate alignments as samtools depth.
+    :param min_mapq: minimum mapping quality
+    :param seqnames: a list of reference sequences to compute the coverage for. If None, all sequences are used.
+    :param chunksize: number of alignments to be read at a time
+
+    :returns: a dictionary of reference sequence names and numpy int32 arrays with the depth at each 0-based position. Sequences without alignments are not reported.
+    """
+    if seqnames is not None:
+        seqnames=set([ str(s) for s in seqnames ])
+    return dict(_depthArrays(SAMfile, strand, include_flags, exclude_flags, min_mapq, seqnames, chunksize))
+
+def _runs(depth):
+    """
+    Run length encodes a depth array.
+
+    :returns: the 0-based starts, the ends and the values of the runs with a value other than 0
+    """
+    if len(depth) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=depth.dtype)
+    change=np.flatnonzero(depth[1:] != depth[:-1])+1
+    starts=np.concatenate([[0], change])
+    ends=np.concatenate([change, [len(depth)]])
+    values=depth[starts]
+    keep=values != 0
+    return starts[keep], ends[keep], values[keep]
+
+def SAMtoBedGraph(SAMfile, output_file, strand=None, include_flags=0, exclude_flags=1796, min_mapq=0, chunksize=200000, compression="infer"):
+    """
+    Writes the depth of coverage of a SAM file into a bedGraph file with one line per run of equal depth.
+    For coordinate sorted files only the depth array of the current reference sequence is kept in memory.
+
+    :param SAMfile: /path/to/file.sam. gzip or BGZF compressed files are read as well.
+    :param output_file: /path/to/file.bedGraph
+    :param strand: '+' or '-' to count only alignments on the forward or reverse strand. None counts all alignments.
+    :param include_flags: only alignments with all these bits set are counted
+    :param exclude_flags: alignments with any of these bits set are not counted. Defaults to unmapped, secondary, QC fail and duplicate alignments as samtools depth.
+    :param min_mapq: minimum mapping quality
+    :param chunksize: number of alignments to be read at a time
+    :param compression: None, 'gzip', 'bgzf' or 'infer' to write BGZF for files ending in .gz, .bgz or .bgzf
+
+    :returns: the number of lines written
+    """
+    n=0
+    with openOutput(output_file, compression=compression) as f:
+        for name, depth in _depthArrays(SAMfile, strand, include_flags, exclude_flags, min_mapq, None, chunksize):
+            starts, ends, values = _runs(depth)
+            del depth
+            for i in range(0, len(starts), 1000000):
+                text=map("\t".join, zip([name]*len(starts[i:i+1000000]), starts[i:i+1000000].astype(str), ends[i:i+1000000].astype(str), values[i:i+1000000].astype(str)))
+                f.write(( "\n".join(text)+"\n" ).encode())
+            n=n+len(starts)
+    return n
@@ -106,9 +106,7 @@ def id_nameDAVID(df,GTF=None,name_id=None):
     :returns: a pandas dataframe with a gene name column added to it.
     """
     if name_id is None:
-        gene_name=retrieve_GTF_field('gene_name',GTF)
-        gene_id=retrieve_GTF_field('gene_id', GTF)
-        GTF=pd.concat([gene_name,gene_id],axis=1)
+        GTF=retrieve_GTF_field(['gene_name','gene_id'],GTF)
     else:
         GTF=name_id.copy()
     df['Gene_names']="genes"
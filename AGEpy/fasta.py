@@ -1,36 +1,185 @@
+import os
+import mmap
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from .bgzf import openOutput, BgzfWriter, _compression
+
+
+def _buildFai(fasta):
+    """
+    Builds the faidx index of a multifasta file in memory. See indexFasta().
+
+    :returns: a Pandas dataframe with the columns 'name','length','offset','linebases','linewidth'
+    """
+    records=[]
+    with open(fasta, "rb") as f:
+        mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(fasta) > 0 else b""
+        data=np.frombuffer(mm, dtype=np.uint8)
+        size=len(mm)
+        p=mm.find(b">")
+        while p >= 0:
+            h=mm.find(b"\n", p)
+            h=size if h < 0 else h
+            name=bytes(mm[p+1:h]).split()
+            name=name[0].decode() if len(name) > 0 else ""
+            start=min(h+1, size)
+            q=mm.find(b"\n>", h)
+            end=size if q < 0 else q+1
+            while end-start >= 2 and mm[end-2:end] == b"\n\n":
+                end=end-1
+            # empty sequences are left out of the index, as by samtools faidx
+            if end > start:
+                first=mm.find(b"\n", start, end)
+                linewidth=(first if first >= 0 else end)-start+1
+                linebases=linewidth-1-( 1 if first > start and mm[first-1:first] == b"\r" else 0 )
+                full=(end-start)//linewidth
+                last=(end-start)-full*linewidth
+                newlines=full+( 1 if last > 0 and mm[end-1:end] == b"\n" else 0 )
+                if np.count_nonzero(data[start:end] == 10) != newlines or \
+                    not np.all(data[start+linewidth-1:start+full*linewidth:linewidth] == 10):
+                    raise ValueError("%s: lines of %s have different lengths" %(fasta, name))
+                length=full*linebases
+                if last > 0:
+                    length=length+last-( linewidth-linebases if mm[end-1:end] == b"\n" else 0 )
+                if length > 0:
+                    records.append([name, length, start, linebases, linewidth])
+            p=q+1 if q >= 0 else -1
+        del data
+        if not isinstance(mm, bytes):
+            mm.close()
+    return pd.DataFrame(records, columns=['name','length','offset','linebases','linewidth'])
+
+def indexFasta(fasta, index_path=None):
+    """
+    Builds a samtools faidx compatible index (.fai) of a multifasta file. For each sequence the index holds
+    its length, the byte offset of its first base, the number of bases per line and the number of bytes per line.
+
+    :param fasta: /path/to/file.fa. All lines of a sequence but the last must have the same length.
+    :param index_path: /path/to/file.fa.fai to be written. Defaults to fasta+'.fai'
+
+    :returns: a Pandas dataframe with the columns 'name','length','offset','linebases','linewidth'
+    """
+    fai=_buildFai(fasta)
+    if index_path is None:
+        index_path=fasta+".fai"
+    fai.to_csv(index_path, sep="\t", header=None, index=None)
+    return fai
+
+def readFai(fasta):
+    """
+    Reads the faidx index of a multifasta file, building it if it does not exist or is older than the fasta file.
+    A built index is written to fasta+'.fai' if possible and otherwise only kept in memory, eg. for read-only reference folders.
+
+    :param fasta: /path/to/file.fa
+
+    :returns: a Pandas dataframe with the columns 'name','length','offset','linebases','linewidth'
+    """
+    index_path=fasta+".fai"
+    if ( not os.path.isfile(index_path) ) or os.path.getmtime(index_path) < os.path.getmtime(fasta):
+        fai=_buildFai(fasta)
+        try:
+            fai.to_csv(index_path, sep="\t", header=None, index=None)
+        except OSError:
+            pass
+        return fai
+    fai=pd.read_csv(index_path, sep="\t", header=None, usecols=[0,1,2,3,4], dtype={0:str})
+    fai.columns=['name','length','offset','linebases','linewidth']
+    return fai
+
+def _openFasta(fasta):
+    """
+    Memory maps a multifasta file and reads its faidx index.
+
+    :returns: the memory map and a dictionary with the (length, offset, linebases, linewidth) of each sequence
+    """
+    fai=readFai(fasta)
+    index=dict(zip(fai["name"], zip(fai["length"], fai["offset"], fai["linebases"], fai["linewidth"])))
+    with open(fasta, "rb") as f:
+        mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, index
+
+def _fetch(mm, entry, start, end):
+    """
+    Reads the bases [start, end) (0-based) of a sequence from a memory mapped multifasta file.
+
+    :returns: the bases as bytes
+    """
+    length, offset, linebases, linewidth = entry
+    start=max(0, start)
+    end=min(length, end)
+    if end <= start:
+        return b""
+    first=offset+(start//linebases)*linewidth+start%linebases
+    last=offset+((end-1)//linebases)*linewidth+(end-1)%linebases+1
+    seq=mm[first:last]
+    if linewidth > linebases:
+        seq=seq.replace(b"\n", b"").replace(b"\r", b"")
+    return seq
+
+def parseRegion(region):
+    """
+    Parses a region string 'name', 'name:start' or 'name:start-end' with 1-based, inclusive coordinates.
+
+    :param region: region string eg. '2:82113224-82113284'
+
+    :returns: the name and the 0-based start and end (exclusive) of the region. End is None if not given.
+    """
+    name, sep, coords = region.rpartition(":")
+    if len(sep) == 0 or len(name) == 0:
+        return region, 0, None
+    coords=coords.replace(",", "")
+    try:
+        if "-" in coords:
+            start, end = coords.split("-")
+            return name, int(start)-1, int(end)
+        return name, int(coords)-1, None
+    except ValueError:
+        return region, 0, None
+
+def fetchFasta(fasta, region, start=None, end=None):
+    """
+    Retrieves a sequence or part of it from a multifasta file through its faidx index, without reading the rest of the file.
+    The index is built and written to fasta+'.fai' if it does not exist, or only kept in memory if fasta+'.fai' cannot be written.
+
+    :param fasta: /path/to/file.fa
+    :param region: the name of the sequence eg. '2' or a region eg. '2:82113225-82113284' (1-based, inclusive)
+    :param start: 1-based start of the region. Overwrites the start given in region.
+    :param end: 1-based, inclusive end of the region. Overwrites the end given in region.
+
+    :returns: a string with the sequence of interest or None if the sequence is not present in the file
+    """
+    mm, index = _openFasta(fasta)
+    try:
+        if region in index:
+            name, s, e = region, 0, None
+        else:
+            name, s, e = parseRegion(region)
+        if name not in index:
+            return None
+        if start is not None:
+            s=int(start)-1
+        if end is not None:
+            e=int(end)
+        if e is None:
+            e=index[name][0]
+        return _fetch(mm, index[name], s, e).decode()
+    finally:
+        mm.close()
 
 def getFasta(opened_file, sequence_name):
     """
-    Retrieves a sequence from an opened multifasta file
+    Retrieves a sequence from an opened multifasta file.
+    The sequence is read through the faidx index of the file, see fetchFasta().
 
     :param opened_file: an opened multifasta file eg. opened_file=open("/path/to/file.fa",'r+')
     :param sequence_name: the name of the sequence to be retrieved eg. for '>2 dna:chromosome chromosome:GRCm38:2:1:182113224:1 REF' use: sequence_name=str(2)
 
     returns: a string with the sequence of interest
     """
-
-    lines = opened_file.readlines()
-    seq=str("")
-    for i in range(0, len(lines)):
-        line = lines[i]
-        if line[0] == ">":
-            fChr=line.split(" ")[0].split("\n")[0]
-            fChr=fChr[1:]
-            if fChr == sequence_name:
-                s=i
-                code=['N','A','C','T','G']
-                firstbase=lines[s+1][0]
-                while firstbase in code:
-                    s=s + 1
-                    seq=seq+lines[s]
-                    firstbase=lines[s+1][0]
-
-    if len(seq)==0:
+    seq=fetchFasta(opened_file.name, str(sequence_name))
+    if seq is not None and len(seq) == 0:
         seq=None
-    else:
-        seq=seq.split("\n")
-        seq="".join(seq)
-
     return seq
 
 def writeFasta(sequence, sequence_name, output_file):
@@ -43,17 +192,108 @@ def writeFasta(sequence, sequence_name, output_file):
 
     :returns: nothing
     """
-    i=0
-    f=open(output_file,'w')
-    f.write(">"+str(sequence_name)+"\n")
-    while i <= len(sequence):
-        f.write(sequence[i:i+60]+"\n")
-        i=i+60
-    f.close()
+    writeFastaRecords([(sequence_name, sequence)], output_file)
+
+def _wrap(seq, width=60):
+    """
+    Wraps a sequence into lines of width bases in one numpy step.
+
+    :param seq: the sequence as bytes
+    :param width: number of bases per line
+
+    :returns: bytes with a newline after each line
+    """
+    full=len(seq)//width*width
+    lines=np.frombuffer(seq, dtype=np.uint8, count=full).reshape(-1, width)
+    lines=np.hstack([lines, np.full((len(lines), 1), 10, dtype=np.uint8)]).tobytes()
+    if full < len(seq):
+        lines=lines+seq[full:]+b"\n"
+    return lines
+
+def _writeSequence(f, sequence, width=60):
+    """
+    Writes a sequence given as a string, bytes or an iterable of strings or bytes into an opened binary file, wrapped to width bases per line.
+
+    :returns: the number of bases written
+    """
+    if isinstance(sequence, (str, bytes)):
+        sequence=[sequence]
+    rest=b""
+    length=0
+    for chunk in sequence:
+        if isinstance(chunk, str):
+            chunk=chunk.encode()
+        length=length+len(chunk)
+        chunk=rest+chunk
+        full=len(chunk)//width*width
+        f.write(_wrap(chunk[:full], width))
+        rest=chunk[full:]
+    if len(rest) > 0:
+        f.write(_wrap(rest, width))
+    return length
+
+def rewriteFastaRecords(records, fasta_in, fasta_out, width=60, buffer_size=16*1024*1024):
+    """
+    Rewrites several sequences of a multifasta file in one pass while keeping the sequence headers.
+    The file is streamed: untouched records are copied block by block and only header lines are parsed.
+
+    :param records: a dictionary of sequence names and the sequences to be written instead. Sequences can be strings, bytes or iterables of strings or bytes eg. generators reading from another file.
+    :param fasta_in: /path/to/original.fa
+    :param fasta_out: /path/to/destination.fa
+    :param width: number of bases per line in the rewritten sequences
+    :param buffer_size: number of bytes to be read at a time
+
+    :returns: a list with the names of the rewritten sequences
+    """
+    rewritten=[]
+    skipping=False
+    line_start=True
+    carry=b""
+    with open(fasta_in, "rb") as fin, open(fasta_out, "wb", buffering=buffer_size) as fout:
+        while True:
+            chunk=fin.read(buffer_size)
+            if len(chunk) == 0:
+                break
+            data=carry+chunk if len(carry) > 0 else chunk
+            carry=b""
+            pos=0
+            while pos < len(data):
+                if line_start and data[pos:pos+1] == b">":
+                    nl=data.find(b"\n", pos)
+                    if nl < 0:
+                        carry=data[pos:]
+                        break
+                    header=data[pos:nl+1]
+                    fout.write(header)
+                    name=header[1:].split()
+                    name=name[0].decode() if len(name) > 0 else ""
+                    skipping=name in records
+                    if skipping:
+                        _writeSequence(fout, records[name], width)
+                        rewritten.append(name)
+                    pos=nl+1
+                    continue
+                nxt=data.find(b"\n>", pos)
+                end=len(data) if nxt < 0 else nxt+1
+                if not skipping:
+                    fout.write(data[pos:end])
+                line_start=data[end-1:end] == b"\n"
+                pos=end
+        if len(carry) > 0:
+            fout.write(carry)
+            if not carry.endswith(b"\n"):
+                fout.write(b"\n")
+            name=carry[1:].split()
+            name=name[0].decode() if len(name) > 0 else ""
+            if name in records:
+                _writeSequence(fout, records[name], width)
+                rewritten.append(name)
+    return rewritten
 
 def rewriteFasta(sequence, sequence_name, fasta_in, fasta_out):
     """
     Rewrites a specific sequence in a multifasta file while keeping the sequence header.
+    The file is streamed, see rewriteFastaRecords().
 
     :param sequence: a string with the sequence to be written
     :param sequence_name: the name of the sequence to be retrieved eg. for '>2 dna:chromosome chromosome:GRCm38:2:1:182113224:1 REF' use: sequence_name=str(2)
@@ -62,31 +302,138 @@ def rewriteFasta(sequence, sequence_name, fasta_in, fasta_out):
 
     :returns: nothing
     """
-    f=open(fasta_in, 'r+')
-    f2=open(fasta_out,'w')
-    lines = f.readlines()
-    i=0
-    while i < len(lines):
-        line = lines[i]
-        if line[0] == ">":
-            f2.write(line)
-            fChr=line.split(" ")[0]
-            fChr=fChr[1:]
-            if fChr == sequence_name:
-                code=['N','A','C','T','G']
-                firstbase=lines[i+1][0]
-                while firstbase in code:
-                    i=i+1
-                    firstbase=lines[i][0]
-                s=0
-                while s <= len(sequence):
-                    f2.write(sequence[s:s+60]+"\n")
-                    s=s+60
-            else:
-                i=i+1
+    rewriteFastaRecords({str(sequence_name):sequence}, fasta_in, fasta_out)
+
+def writeFastaRecords(records, output_file, width=60, compression="infer", index=False, buffer_size=16*1024*1024):
+    """
+    Writes many fasta sequences into a file through one large write buffer.
+
+    :param records: a dictionary of sequence names and sequences or an iterable of (name, sequence) tuples. Sequences can be strings, bytes or iterables of strings or bytes.
+    :param output_file: /path/to/file.fa to be written
+    :param width: number of bases per line
+    :param compression: None, 'gzip', 'bgzf' or 'infer' to write BGZF for files ending in .gz, .bgz or .bgzf
+    :param index: logical, if True, a faidx index is written to output_file+'.fai' in the same pass. For BGZF output the block index needed by samtools is written to output_file+'.gzi' as well. Not available for gzip output.
+    :param buffer_size: size of the write buffer in bytes
+
+    :returns: nothing
+    """
+    if isinstance(records, dict):
+        records=records.items()
+    if index and _compression(output_file, compression) == "gzip":
+        raise ValueError("a faidx index can only be written for plain text or BGZF output")
+    fai=[]
+    offset=0
+    with openOutput(output_file, compression=compression, buffer_size=buffer_size) as f:
+        for name, sequence in records:
+            header=( ">"+str(name)+"\n" ).encode()
+            f.write(header)
+            offset=offset+len(header)
+            length=_writeSequence(f, sequence, width)
+            linebases=min(width, length)
+            # empty sequences are left out of the index, as by samtools faidx
+            if length > 0:
+                fai.append([str(name).split()[0] if len(str(name).split()) > 0 else "", length, offset, linebases, linebases+1])
+            offset=offset+length+( length+width-1 )//width
+        blocks=f.blocks if isinstance(f, BgzfWriter) else None
+    if index:
+        fai=pd.DataFrame(fai, columns=['name','length','offset','linebases','linewidth'])
+        fai.to_csv(output_file+".fai", sep="\t", header=None, index=None)
+        if blocks is not None:
+            blocks=blocks[1:]
+            gzi=np.array(blocks, dtype="<u8").reshape(-1)
+            with open(output_file+".gzi", "wb") as g:
+                g.write(np.array([len(blocks)], dtype="<u8").tobytes()+gzi.tobytes())
+
+_COMPLEMENT=bytes.maketrans(b"ACGTUNRYKMSWBDHVacgtunrykmswbdhv", b"TGCAANYRMKSWVHDBtgcaanyrmkswvhdb")
+
+def reverseComplement(sequence):
+    """
+    Reverse complements a DNA sequence. IUPAC ambiguity codes are complemented and the case is kept.
+
+    :param sequence: a string or bytes
+
+    :returns: the reverse complement as string or bytes
+    """
+    text=isinstance(sequence, str)
+    if text:
+        sequence=sequence.encode()
+    rc=np.frombuffer(sequence.translate(_COMPLEMENT), dtype=np.uint8)[::-1].tobytes()
+    return rc.decode() if text else rc
+
+def _fetchIntervals(task):
+    """
+    Fetches a sorted batch of intervals of one sequence from a multifasta file. The covered region is read at once
+    when the intervals are dense and the minus strand intervals are reverse complemented together in one buffer.
+
+    :param task: a tuple with /path/to/file.fa, the sequence name and the arrays of 0-based starts, ends and minus strand flags
+
+    :returns: a list with the sequences as strings
+    """
+    fasta, name, starts, ends, minus = task
+    mm, index = _openFasta(fasta)
+    try:
+        entry=index[name]
+        starts=np.clip(starts, 0, entry[0])
+        ends=np.clip(ends, starts, entry[0])
+        span_start=int(starts.min())
+        span_end=int(ends.max())
+        if ( ends-starts ).sum()*8 >= span_end-span_start:
+            span=_fetch(mm, entry, span_start, span_end)
+            seqs=[ span[s-span_start:e-span_start] for s, e in zip(starts.tolist(), ends.tolist()) ]
         else:
-            f2.write(line)
-            i=i+1
+            seqs=[ _fetch(mm, entry, s, e) for s, e in zip(starts.tolist(), ends.tolist()) ]
+    finally:
+        mm.close()
+    rev=np.flatnonzero(minus)
+    if len(rev) > 0:
+        lengths=( ends-starts )[rev]
+        buf=reverseComplement(b"".join([ seqs[i] for i in rev ]))
+        cuts=len(buf)-np.cumsum(lengths)
+        for i, c, l in zip(rev.tolist(), cuts.tolist(), lengths.tolist()):
+            seqs[i]=buf[c:c+l]
+    return [ s.decode() for s in seqs ]
+
+def fetchFastaIntervals(bed, fasta, n_jobs=1, chunksize=100000):
+    """
+    Retrieves the sequences of many intervals from a multifasta file through its faidx index.
+    Intervals are sorted and grouped by sequence so that each sequence is read once and in order,
+    intervals on the minus strand are reverse complemented.
+
+    :param bed: a Pandas dataframe in bed format eg. as returned by getPromotersBed() or GetBEDnarrowPeakgz(). The first three columns are used as chromosome, 0-based start and end. If a 'strand' column is present, intervals with '-' are reverse complemented.
+    :param fasta: /path/to/file.fa. The index is built and written to fasta+'.fai' if it does not exist, or only kept in memory if fasta+'.fai' cannot be written.
+    :param n_jobs: number of processes to use
+    :param chunksize: maximum number of intervals to be fetched by one process at a time
 
-    f2.close
-    f.close
+    :returns: a Pandas series with the sequences indexed as bed. Intervals on sequences not present in the fasta file are None.
+    """
+    chrom=bed.iloc[:,0].astype(str).to_numpy()
+    starts=bed.iloc[:,1].astype(np.int64).to_numpy()
+    ends=bed.iloc[:,2].astype(np.int64).to_numpy()
+    if "strand" in bed.columns:
+        minus=( bed["strand"].astype(str) == "-" ).to_numpy()
+    else:
+        minus=np.zeros(len(bed), dtype=bool)
+
+    names=set(readFai(fasta)["name"].tolist())
+    sequences=np.full(len(bed), None, dtype=object)
+    order=np.lexsort((starts, chrom))
+    order=order[np.isin(chrom[order], list(names))]
+    sorted_chrom=chrom[order]
+    bounds=np.flatnonzero(sorted_chrom[1:] != sorted_chrom[:-1])+1
+    bounds=np.concatenate([[0], bounds, [len(order)]]) if len(order) > 0 else np.array([0])
+    tasks=[]
+    positions=[]
+    for b, e in zip(bounds[:-1], bounds[1:]):
+        for c in range(b, e, chunksize):
+            idx=order[c:min(c+chunksize, e)]
+            tasks.append((fasta, chrom[idx[0]], starts[idx], ends[idx], minus[idx]))
+            positions.append(idx)
+
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results=list(pool.map(_fetchIntervals, tasks))
+    else:
+        results=[ _fetchIntervals(t) for t in tasks ]
+    for idx, seqs in zip(positions, results):
+        sequences[idx]=seqs
+    return pd.Series(sequences, index=bed.index, name="sequence", dtype=object)
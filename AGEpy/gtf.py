@@ -1,51 +1,221 @@
-import sys
+import os
+import io
+import re
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
 from collections import OrderedDict
-try:
-    import pybedtools
-except:
-    print("pybedtools could not be imported")
-    sys.stdout.flush()
-import csv
+from .cache import _cacheKey, readCache, writeCache, cache_dir
+from .bgzf import openOutput, isBgzf
+from .tabix import tabixIndex, tabixQuery
 
-def readGTF(infile):
+GTF_COLUMNS=['seqname','source','feature','start','end','score','strand','frame','attribute']
+_GTF_CATEGORIES=['seqname','source','feature','strand','frame']
+
+_GTF_DTYPES={ c:"category" for c in _GTF_CATEGORIES }
+_GTF_DTYPES.update({'start':np.int64,'end':np.int64,'score':str,'attribute':str})
+
+def _readGTF(infile, features, seqnames, columns, chunksize):
+    """
+    Reads a GTF file in chunks applying the features and seqnames filters to each chunk.
+    See readGTF().
+    """
+    usecols=list(columns)
+    if features is not None:
+        usecols.append('feature')
+    if seqnames is not None:
+        usecols.append('seqname')
+    usecols=[ c for c in GTF_COLUMNS if c in usecols ]
+
+    reader=pd.read_csv(infile, sep='\t', comment="#", header=None, names=GTF_COLUMNS, usecols=usecols, dtype=_GTF_DTYPES, chunksize=chunksize)
+    chunks=[]
+    for chunk in reader:
+        if features is not None:
+            chunk=chunk[chunk['feature'].isin(features)]
+        if seqnames is not None:
+            chunk=chunk[chunk['seqname'].isin(seqnames)]
+        chunks.append(chunk[columns])
+
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=columns).astype({ c:_GTF_DTYPES[c] for c in columns })
+
+    df=pd.concat(chunks, ignore_index=True)
+    for c in _GTF_CATEGORIES:
+        if c in columns:
+            df[c]=union_categoricals([ chunk[c] for chunk in chunks ]).remove_unused_categories()
+    del chunks
+    for c in ['start','end']:
+        if c in columns and len(df) > 0 and df[c].max() < np.iinfo(np.int32).max:
+            df[c]=df[c].astype(np.int32)
+    return df
+
+def _GTFfilters(features, seqnames, columns):
+    """
+    Normalizes the filters of readGTF().
+    """
+    if columns is None:
+        columns=GTF_COLUMNS
+    else:
+        columns=[ c for c in GTF_COLUMNS if c in columns ]
+    if features is not None:
+        features=sorted(set([ str(s) for s in features ]))
+    if seqnames is not None:
+        seqnames=sorted(set([ str(s) for s in seqnames ]))
+    return features, seqnames, columns
+
+def _GTFcacheFolder(cache):
+    """
+    Resolves the cache argument of readGTF() into a cache folder or None if caching is disabled.
+    """
+    if cache is None:
+        return os.environ.get("AGEPY_CACHE")
+    if cache is True:
+        return cache_dir
+    if cache is False:
+        return None
+    return cache
+
+def readGTF(infile, features=None, seqnames=None, columns=None, chunksize=1000000, parse=False, cache=None):
     """
     Reads a GTF file and labels the respective columns in agreement with GTF file standards:
     'seqname','source','feature','start','end','score','strand','frame','attribute'.
-
-    :param infile: path/to/file.gtf
+    The file is read in chunks and filters are applied to each chunk so that only the kept rows are held in memory.
+    'start' and 'end' are returned as integers and 'seqname','source','feature','strand','frame' as categoricals.
+
+    :param infile: path/to/file.gtf or a file object
+    :param features: a list of features to keep eg. ['transcript','exon']. If None, all features are kept.
+    :param seqnames: a list of seqnames to keep eg. ['1','X']. If None, all seqnames are kept.
+    :param columns: a list of columns to keep. If None, all columns are kept.
+    :param chunksize: number of lines to be read at a time
+    :param parse: logical, if True, returns the GTF parsed with parseGTF()
+    :param cache: True to use the default cache folder, /path/to/cache/folder or False. If None, the cache folder set in the AGEPY_CACHE environment variable is used, if any.
+        Cached GTFs are keyed by path, size, modification time and content of the file as well as by the filters used. File objects are never cached.
     :returns: a Pandas dataframe of the respective GTF
 
     """
-    df=pd.read_table(infile, sep='\t', comment="#", header=None, dtype=str)
-    df.columns=['seqname','source','feature','start','end','score','strand','frame','attribute']
-    #df = df.astype(str) # from DTC
+    features, seqnames, columns = _GTFfilters(features, seqnames, columns)
+
+    cache_folder=_GTFcacheFolder(cache)
+    # only files given by path can be keyed
+    if not isinstance(infile, (str, os.PathLike)):
+        cache_folder=None
+    if cache_folder is not None:
+        key, info = _cacheKey(infile, kind="gtf", features=features, seqnames=seqnames, columns=columns, parse=parse)
+        df=readCache(key, cache_folder=cache_folder)
+        if df is not None:
+            return df
+
+    df=_readGTF(infile, features, seqnames, columns, chunksize)
+    if parse:
+        df=parseGTF(df)
+
+    if cache_folder is not None:
+        writeCache(df, key, info, cache_folder=cache_folder)
     return df
 
+def warmGTFcache(infile, features=None, seqnames=None, columns=None, parse=False, cache=True):
+    """
+    Reads a GTF file into the cache so that the next readGTF() call with the same arguments is read from the cache.
+
+    :param infile: path/to/file.gtf
+    :param features: a list of features to keep. See readGTF().
+    :param seqnames: a list of seqnames to keep. See readGTF().
+    :param columns: a list of columns to keep. See readGTF().
+    :param parse: logical, if True, the GTF is cached parsed with parseGTF()
+    :param cache: True to use the default cache folder or /path/to/cache/folder
+
+    :returns: the cache key of the GTF
+    """
+    readGTF(infile, features=features, seqnames=seqnames, columns=columns, parse=parse, cache=cache)
+    features, seqnames, columns = _GTFfilters(features, seqnames, columns)
+    key, info = _cacheKey(infile, kind="gtf", features=features, seqnames=seqnames, columns=columns, parse=parse)
+    return key
+
+_GTF_ATTRIBUTE=re.compile(r'([^\s;"]+) +"?([^";\n]*)"?|(\n)')
+
+def _tokenizeGTF(attribute, fields=None, block=100000):
+    """
+    Tokenizes a GTF attribute column. Rows are joined into newline separated blocks of at most
+    block rows which are scanned by a compiled regular expression; the newline matches are used
+    to recover the row each key/value pair belongs to. Only one block is held as Python tuples
+    at a time.
+
+    :param attribute: a Pandas series with the attribute section of a GTF
+    :param fields: a list of attributes to keep. If None, all attributes are kept.
+    :param block: number of rows tokenized at a time
+
+    :returns: a numpy array of row indexes, a numpy array of keys and a numpy array of values
+    """
+    attribute=attribute.fillna("").astype(str).tolist()
+    out_rows, out_keys, out_values = [], [], []
+    for start in range(0, len(attribute), block):
+        tokens=_GTF_ATTRIBUTE.findall("\n".join(attribute[start:start+block]))
+        if len(tokens) == 0:
+            continue
+        tokens=np.array(tokens,dtype=object)
+        newlines=tokens[:,2] == "\n"
+        rows=np.cumsum(newlines)[~newlines]+start
+        tokens=tokens[~newlines]
+        if fields is not None:
+            keep=pd.Index(fields).get_indexer(tokens[:,0]) >= 0
+            rows=rows[keep]
+            tokens=tokens[keep]
+        out_rows.append(rows)
+        out_keys.append(tokens[:,0])
+        out_values.append(tokens[:,1])
+        del tokens
+    if len(out_rows) == 0:
+        return np.array([],dtype=np.int64), np.array([],dtype=object), np.array([],dtype=object)
+    return np.concatenate(out_rows), np.concatenate(out_keys), np.concatenate(out_values)
+
+def _attributesFrame(attribute, fields=None):
+    """
+    Builds one column per attribute out of a GTF attribute column.
+    If an attribute is present more than once in the same row the last value is kept.
+
+    :param attribute: a Pandas series with the attribute section of a GTF
+    :param fields: a list of attributes to build columns for. If None, all attributes found are used.
+
+    :returns: a Pandas dataframe with one column per attribute, in order of first appearance or in the order of fields
+    """
+    n=len(attribute)
+    rows, keys, values = _tokenizeGTF(attribute, fields=fields)
+    if fields is None:
+        codes, uniques = pd.factorize(keys)
+    else:
+        uniques=list(fields)
+        codes=pd.Index(uniques).get_indexer(keys)
+        keep=codes >= 0
+        codes=codes[keep]
+        rows=rows[keep]
+        values=values[keep]
+    order=np.argsort(codes, kind="stable")
+    codes=codes[order]
+    rows=rows[order]
+    values=values[order]
+    bounds=np.searchsorted(codes, np.arange(len(uniques)+1))
+    columns=OrderedDict()
+    for i, field in enumerate(uniques):
+        r=rows[bounds[i]:bounds[i+1]]
+        v=values[bounds[i]:bounds[i+1]]
+        last=np.ones(len(r),dtype=bool)
+        last[:-1]=r[1:] != r[:-1]
+        col=np.full(n, np.nan, dtype=object)
+        col[r[last]]=v[last]
+        columns[field]=col
+    return pd.DataFrame(columns, index=attribute.index)
+
 def retrieve_GTF_field(field,gtf):
     """
     Returns a field of choice from the attribute column of the GTF
 
-    :param field: field to be retrieved
-    :returns: a Pandas dataframe with one columns containing the field of choice
-
-    """
-    inGTF=gtf.copy()
-    def splits(x):
-        l=x.split(";")
-        l=[ s.split(" ") for s in l]
-        res=np.nan
-        for s in l:
-            if field in s:
-                if '"' in s[-1]:
-                    res=s[-1][1:-1]
-                else:
-                    res=s[-1]
-        return res
+    :param field: field to be retrieved or a list of fields to be retrieved all in one scan of the attribute column
+    :returns: a Pandas dataframe with one column per field of choice
 
-    inGTF[field]=inGTF['attribute'].apply(lambda x: splits(x))
-    return inGTF[[field]]
+    """
+    if isinstance(field, str):
+        field=[field]
+    return _attributesFrame(gtf['attribute'], fields=field)
 
 def attributesGTF(inGTF):
     """
@@ -55,66 +225,113 @@ def attributesGTF(inGTF):
     :returns: a list of attributes present in the attribute section
 
     """
-    df=pd.DataFrame(inGTF['attribute'].str.split(";").tolist())
-    desc=[]
-    for i in df.columns.tolist():
-        val=df[[i]].dropna()
-        val=pd.DataFrame(val[i].str.split(' "').tolist())[0]
-        val=list(set(val))
-        for v in val:
-            if len(v) > 0:
-                l=v.split(" ")
-                if len(l)>1:
-                    l=l[1]
-                else:
-                    l=l[0]
-                desc.append(l)
-    desc=list(set(desc))
-    finaldesc=[]
-    for d in desc:
-        if len(d) > 0:
-            finaldesc.append(d)
-    return finaldesc
+    rows, keys, values = _tokenizeGTF(inGTF['attribute'])
+    return pd.unique(keys).tolist()
 
 def parseGTF(inGTF):
     """
-    Reads an extracts all attributes in the attributes section of a GTF and constructs a new dataframe wiht one collumn per attribute instead of the attributes column
+    Reads an extracts all attributes in the attributes section of a GTF and constructs a new dataframe wiht one collumn per attribute instead of the attributes column.
+    The attribute column is tokenized only once for all attributes.
 
     :param inGTF: GTF dataframe to be parsed
     :returns: a dataframe of the orignal input GTF with attributes parsed.
 
     """
-
-    desc=attributesGTF(inGTF)
-    ref=inGTF.copy()
-    ref.reset_index(inplace=True, drop=True)
-    df=ref.drop(['attribute'],axis=1).copy()
-    for d in desc:
-        field=retrieve_GTF_field(d,ref)
-        df=pd.concat([df,field],axis=1)
+    ref=inGTF.reset_index(drop=True)
+    df=ref.drop(['attribute'],axis=1)
+    fields=_attributesFrame(ref['attribute'])
+    df=pd.concat([df,fields],axis=1)
     return df
 
-def writeGTF(inGTF,file_path):
+def _textColumn(values):
+    """
+    Returns a column as a numpy object array of strings and a mask of its missing values.
+    """
+    values=np.asarray(values, dtype=object)
+    missing=pd.isnull(values)
+    values=np.where(missing, "", values).astype(str).astype(object)
+    return values, missing
+
+def _attributesColumn(df, fields):
+    """
+    Serializes the attribute columns of a parsed GTF back into one attribute column.
+    Missing values are left out.
+
+    :param df: a parsed GTF dataframe
+    :param fields: the columns to be written into the attribute column
+
+    :returns: a numpy array of strings
+    """
+    attribute=np.full(len(df), "", dtype=object)
+    for c in fields:
+        values, missing = _textColumn(df[c])
+        attribute=attribute+np.where(missing, "", c+' "'+values+'"; ')
+    return np.array([ s[:-1] for s in attribute ], dtype=object)
+
+def writeGTF(inGTF,file_path,compression="infer",chunksize=100000):
     """
     Write a GTF dataframe into a file
 
     :param inGTF: GTF dataframe to be written. It should either have 9 columns with the last one being the "attributes" section or more than 9 columns where all columns after the 8th will be colapsed into one.
     :param file_path: path/to/the/file.gtf
+    :param compression: None, 'gzip', 'bgzf' or 'infer' to write BGZF for files ending in .gz, .bgz or .bgzf
+    :param chunksize: number of rows to be serialized and written at a time
     :returns: nothing
     """
     cols=inGTF.columns.tolist()
-    if len(cols) == 9:
-        if 'attribute' in cols:
-            df=inGTF
-    else:
-        df=inGTF[cols[:8]]
-        df['attribute']=""
-        for c in cols[8:]:
-            if c == cols[len(cols)-1]:
-                df['attribute']=df['attribute']+c+' "'+inGTF[c].astype(str)+'";'
+    fields=None
+    if not ( len(cols) == 9 and 'attribute' in cols ):
+        fields=cols[8:]
+    with openOutput(file_path, compression=compression) as f:
+        for i in range(0, len(inGTF), chunksize):
+            chunk=inGTF.iloc[i:i+chunksize]
+            lines=_textColumn(chunk[cols[0]])[0]
+            for c in cols[1:8]:
+                lines=lines+"\t"+_textColumn(chunk[c])[0]
+            if fields is None:
+                lines=lines+"\t"+_textColumn(chunk['attribute'])[0]
             else:
-                df['attribute']=df['attribute']+c+' "'+inGTF[c].astype(str)+'"; '
-    df.to_csv(file_path, sep="\t",header=None,index=None,quoting=csv.QUOTE_NONE)
+                lines=lines+"\t"+_attributesColumn(chunk, fields)
+            f.write(( "\n".join(lines.tolist())+"\n" ).encode("utf-8"))
+
+def indexGTF(file_path, output=None):
+    """
+    Builds a tabix index for a GTF file so that regions can be retrieved with queryGTF().
+    BGZF compressed GTFs sorted by seqname and start are indexed as they are, otherwise the GTF is
+    sorted and written BGZF compressed first.
+
+    :param file_path: /path/to/file.gtf or /path/to/file.gtf.gz
+    :param output: /path/to/sorted.gtf.gz to be written if file_path is not BGZF compressed. Defaults to file_path+'.gz' for uncompressed GTFs and is required for gzip compressed GTFs.
+
+    :returns: the path to the indexed GTF. The index is written to the same path plus '.tbi'
+    """
+    if not isBgzf(file_path):
+        if output is None:
+            if file_path.endswith(".gz"):
+                raise ValueError("%s is gzip but not BGZF compressed: recompress it with bgzip or give an output path for the sorted BGZF GTF" %file_path)
+            output=file_path+".gz"
+        gtf=readGTF(file_path, cache=False)
+        order=np.lexsort((gtf["start"].to_numpy(), gtf["seqname"].astype(str).to_numpy()))
+        writeGTF(gtf.iloc[order], output, compression="bgzf")
+        file_path=output
+    tabixIndex(file_path, col_seq=1, col_beg=4, col_end=5, meta="#")
+    return file_path
+
+def queryGTF(file_path, seqname, start, end):
+    """
+    Retrieves the GTF records overlapping a region from a GTF indexed with indexGTF() without reading the rest of the file.
+
+    :param file_path: /path/to/file.gtf.gz with an index in /path/to/file.gtf.gz.tbi
+    :param seqname: seqname of the region eg. '2'
+    :param start: 1-based start of the region
+    :param end: 1-based, inclusive end of the region
+
+    :returns: a Pandas dataframe of the overlapping GTF records as returned by readGTF()
+    """
+    lines=tabixQuery(file_path, seqname, start, end)
+    if len(lines) == 0:
+        return pd.DataFrame(columns=GTF_COLUMNS).astype(_GTF_DTYPES)
+    return _readGTF(io.BytesIO(b"\n".join(lines)+b"\n"), None, None, GTF_COLUMNS, len(lines))
 
 def GTFtoBED(inGTF,name):
     """
@@ -139,58 +356,190 @@ def GTFtoBED(inGTF,name):
 
 def MAPGenoToTrans(parsedGTF,feature):
     """
-    Gets all positions of all bases in an exon
+    Gets all positions of all bases of the features of each transcript, in transcript order.
+    The positions are computed from the interval map of intervalsGenoToTrans(), which should be used
+    directly with GetTransPosition() or GenoToTransPositions() to avoid storing every base.
 
-    :param df: a Pandas dataframe with 'start','end', and 'strand' information for each entry.
-                df must contain 'seqname','feature','start','end','strand','frame','gene_id',
-                'transcript_id','exon_id','exon_number']
+    :param parsedGTF: a parsed GTF dataframe with 'seqname','feature','start','end','strand' and 'transcript_id' columns
     :param feature: feature upon wich to generate the map, eg. 'exon' or 'transcript'
 
-    :returns: a string with the comma separated positions of all bases in the exon
+    :returns: a dictionary with a string of the comma separated positions of all bases of each transcript eg. {ENST23923910:'234,235,236,1021,..'}
     """
-    GenTransMap=parsedGTF[parsedGTF["feature"]==feature]
-    def getExonsPositions(df):
-        start=int(df["start"])
-        stop=int(df["end"])
-        strand=df["strand"]
-        r=range(start,stop+1)
-        if strand=="-":
-            r.sort(reverse=True)
-        r=[ str(s) for s in r]
-        return ",".join(r)
-
-    GenTransMap["feature_bases"]=GenTransMap.apply(getExonsPositions, axis=1)
-    GenTransMap=GenTransMap.sort_values(by=["transcript_id","exon_number"],ascending=True)
-    def CombineExons(df):
-        return pd.Series(dict( feature_bases = ','.join(df['feature_bases']) ) )
-    GenTransMap=GenTransMap.groupby("transcript_id").apply(CombineExons)
-    GenTransMap=GenTransMap.to_dict().get("feature_bases")
-
-    return GenTransMap
+    tmap=intervalsGenoToTrans(parsedGTF,feature)
+    order=np.lexsort((tmap["before"], tmap["tx"]))
+    tx=tmap["tx"][order]
+    start=tmap["start"][order]
+    end=tmap["end"][order]
+    length=end-start+1
+    rows=np.repeat(np.arange(len(order)), length)
+    offset=np.arange(len(rows))-np.repeat(np.cumsum(length)-length, length)
+    bases=np.where(tmap["minus"][tx[rows]], end[rows]-offset, start[rows]+offset).astype(str)
+    bounds=np.searchsorted(tx[rows], np.arange(len(tmap["transcript_id"])+1))
+    return { t:",".join(bases[bounds[k]:bounds[k+1]]) for k, t in enumerate(tmap["transcript_id"]) }
+
+def _isIntervalMap(dic):
+    """
+    Tells an interval map as returned by intervalsGenoToTrans() from a dictionary of bases as returned by MAPGenoToTrans().
+    """
+    return isinstance(dic.get("tx"), np.ndarray)
 
 def GetTransPosition(df,field,dic,refCol="transcript_id"):
     """
-    Maps a genome position to transcript positon"
+    Maps genome positions to transcript positons.
+    With an interval map, passing the whole dataframe maps all its positions in one batch with GenoToTransPositions().
 
-    :param df: a Pandas dataframe
+    :param df: a Pandas dataframe or one of its rows
     :param field: the head of the column containing the genomic position
-    :param dic: a dictionary containing for each transcript the respective bases eg. {ENST23923910:'234,235,236,1021,..'}
+    :param dic: an interval map as returned by intervalsGenoToTrans() or a dictionary containing for each transcript the respective bases as returned by MAPGenoToTrans() eg. {ENST23923910:'234,235,236,1021,..'}
     :param refCol: header of the reference column with IDs, eg. 'transcript_id'
 
-    :returns: position on transcript
+    :returns: position on transcript, NaN for positions outside of the transcript. A numpy array of positions if df is a dataframe.
     """
+    if not _isIntervalMap(dic):
+        if isinstance(df, pd.DataFrame):
+            return np.array([ GetTransPosition(row, field, dic, refCol) for _, row in df.iterrows() ], dtype=float)
+        try:
+            gen=str(int(df[field]))
+            bases=dic.get(df[refCol]).split(",")
+            return bases.index(gen)+1
+        except (AttributeError, TypeError, ValueError):
+            return np.nan
+    if isinstance(df, pd.DataFrame):
+        positions=pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=float)
+        valid=~np.isnan(positions)
+        res=np.full(len(df), np.nan)
+        res[valid]=GenoToTransPositions(dic, df[refCol].to_numpy(dtype=object)[valid], positions[valid])
+        return res
     try:
-        gen=str(int(df[field]))
-        transid=df[refCol]
-        bases=dic.get(transid).split(",")
-        bases=bases.index(str(gen))+1
-    except:
-        bases=np.nan
-    return bases
+        return GenoToTransPositions(dic, [df[refCol]], [int(df[field])])[0]
+    except (TypeError, ValueError):
+        return np.nan
+
+def intervalsGenoToTrans(parsedGTF,feature="exon"):
+    """
+    Builds an interval map between genome and transcript coordinates. For each transcript the
+    start and end of its features are stored together with the cumulative transcript length before
+    each feature, so that memory grows with the number of features and not with the number of bases.
+
+    :param parsedGTF: a parsed GTF dataframe with 'seqname','feature','start','end','strand' and 'transcript_id' columns
+    :param feature: feature upon wich to generate the map, eg. 'exon'
+
+    :returns: a dictionary of numpy arrays to be used with GenoToTransPositions() and TransToGenoPositions():
+        'transcript_id', 'seqname', 'minus' (one value per transcript) and 'tx', 'start', 'end', 'before' (one value per feature,
+        sorted by transcript and start, 'before' being the transcript length upstream of the feature)
+    """
+    df=parsedGTF[parsedGTF["feature"]==feature]
+    df=df[df["transcript_id"].notnull()]
+    tx, transcript_ids = pd.factorize(df["transcript_id"].astype(str), sort=True)
+    start=df["start"].to_numpy().astype(np.int64)
+    end=df["end"].to_numpy().astype(np.int64)
+    minus=( df["strand"].astype(str) == "-" ).to_numpy()
+    seqname=df["seqname"].astype(str).to_numpy()
+
+    order=np.lexsort((start, tx))
+    tx=tx[order]
+    start=start[order]
+    end=end[order]
+    minus=minus[order]
+    seqname=seqname[order]
+
+    length=end-start+1
+    first=np.searchsorted(tx, np.arange(len(transcript_ids)))
+    cumlen=np.cumsum(length)
+    ascending=cumlen-length-np.repeat(np.append(0,cumlen)[first], np.diff(np.append(first, len(tx))))
+    total=np.add.reduceat(length, first) if len(tx) > 0 else np.array([], dtype=np.int64)
+    before=np.where(minus, total[tx]-ascending-length, ascending)
+
+    return { "transcript_id":np.asarray(transcript_ids, dtype=object), "seqname":seqname[first], "minus":minus[first],
+             "tx":tx, "start":start, "end":end, "before":before }
+
+def _lookupTranscripts(tmap, transcript_ids):
+    """
+    Returns the index of each transcript id in an interval map or -1 for unknown transcripts.
+    """
+    return pd.Index(tmap["transcript_id"]).get_indexer(np.asarray(transcript_ids, dtype=object).astype(str))
+
+def GenoToTransPositions(tmap, transcript_ids, positions):
+    """
+    Maps genome positions to transcript positions in one batch.
+
+    :param tmap: an interval map as returned by intervalsGenoToTrans()
+    :param transcript_ids: an array of transcript ids, one per position
+    :param positions: an array of 1-based genome positions
+
+    :returns: a numpy array with the 1-based transcript positions, NaN for positions outside of the transcript features
+    """
+    t=_lookupTranscripts(tmap, transcript_ids)
+    positions=np.asarray(positions, dtype=np.int64)
+    res=np.full(len(positions), np.nan)
+    if len(tmap["tx"]) == 0:
+        return res
+    span=max(tmap["end"].max(), positions.max() if len(positions) > 0 else 0)+1
+    keys=tmap["tx"]*span+tmap["start"]
+    i=np.searchsorted(keys, t*span+positions, side="right")-1
+    i=np.clip(i, 0, len(keys)-1)
+    ok=( t >= 0 ) & ( tmap["tx"][i] == t ) & ( positions >= tmap["start"][i] ) & ( positions <= tmap["end"][i] )
+    i=i[ok]
+    p=positions[ok]
+    res[ok]=np.where(tmap["minus"][tmap["tx"][i]], tmap["end"][i]-p, p-tmap["start"][i])+tmap["before"][i]+1
+    return res
+
+def TransToGenoPositions(tmap, transcript_ids, positions):
+    """
+    Maps transcript positions to genome positions in one batch.
+
+    :param tmap: an interval map as returned by intervalsGenoToTrans()
+    :param transcript_ids: an array of transcript ids, one per position
+    :param positions: an array of 1-based transcript positions
+
+    :returns: a numpy array with the 1-based genome positions, NaN for positions outside of the transcripts
+    """
+    t=_lookupTranscripts(tmap, transcript_ids)
+    positions=np.asarray(positions, dtype=np.int64)
+    res=np.full(len(positions), np.nan)
+    if len(tmap["tx"]) == 0:
+        return res
+    length=tmap["end"]-tmap["start"]+1
+    span=max((tmap["before"]+length).max(), positions.max() if len(positions) > 0 else 0)+1
+    keys=tmap["tx"]*span+tmap["before"]
+    order=np.argsort(keys, kind="stable")
+    keys=keys[order]
+    i=np.searchsorted(keys, t*span+positions-1, side="right")-1
+    i=order[np.clip(i, 0, len(keys)-1)]
+    offset=positions-1-tmap["before"][i]
+    ok=( t >= 0 ) & ( tmap["tx"][i] == t ) & ( positions >= 1 ) & ( offset < length[i] )
+    i=i[ok]
+    offset=offset[ok]
+    res[ok]=np.where(tmap["minus"][tmap["tx"][i]], tmap["end"][i]-offset, tmap["start"][i]+offset)
+    return res
+
+def _mergeIntervals(group, start, end):
+    """
+    Merges overlapping and book-ended intervals within groups in one sweep over sorted arrays.
+
+    :param group: integer group codes, intervals are only merged within the same group
+    :param start: numpy array with interval starts
+    :param end: numpy array with interval ends
+
+    :returns: the index of the first interval of each merged interval, and the starts and ends of the merged intervals
+    """
+    order=np.lexsort((start, group))
+    group=group[order]
+    start=start[order]
+    end=end[order]
+    if len(order) == 0:
+        return order, start, end
+    span=int(end.max())+1
+    runmax=np.maximum.accumulate(end+group*span)-group*span
+    new=np.ones(len(order), dtype=bool)
+    new[1:]=( group[1:] != group[:-1] ) | ( start[1:] > runmax[:-1] )
+    first=np.flatnonzero(new)
+    return order[first], np.minimum.reduceat(start, first), np.maximum.reduceat(end, first)
 
 def getPromotersBed(gtf,fa,upstream=2000,downstream=200):
     """
     Reads a gtf file and returns a bed file for the promoter coordinates.
+    Overlapping promoters of the same gene are merged.
     
     :param gtf: path/to/file.gtf. Must be an ensembl gtf.
     :param fa: path/to/fasta.fa. Must be an ensembl fasta file.
@@ -201,74 +550,46 @@ def getPromotersBed(gtf,fa,upstream=2000,downstream=200):
     """
     chrsizes={}
     with open(fa, "r") as f:
-        for line in f.readlines():
+        for line in f:
             if line[0] == ">":
                 l=line.split(" ")
                 seqname=l[0][1:]
                 size=int(l[2].split(":")[-2])
                 chrsizes[seqname]=size
-    gtf=readGTF(gtf)
-    gtf=gtf[gtf["feature"]=="transcript"]
-    gtf.reset_index(inplace=True, drop=True)
-
-    gtf["gene_id"]=retrieve_GTF_field(field="gene_id",gtf=gtf)
-    gtf["gene_name"]=retrieve_GTF_field(field="gene_name",gtf=gtf)
-
-    def getcoord(df):
-        seqname=df["seqname"]
-        strand=df["strand"]
-        if strand == "+":
-            tss=int(df["start"])
-            promoter_start=tss-upstream
-            promoter_end=tss+downstream
-        else:
-            tss=int(df["end"])
-            promoter_start=tss-downstream
-            promoter_end=tss+upstream
-
-        if promoter_start < 0:
-            promoter_start=0
-        if promoter_end > chrsizes[seqname]:
-            promoter_end=chrsizes[seqname]
-
-        return str(promoter_start)+","+str(promoter_end)
-
-    gtf["promoter"]=gtf.apply(getcoord, axis=1)
-    gtf["start"]=gtf["promoter"].apply(lambda x: int(x.split(",")[0]) )
-    gtf["end"]=gtf["promoter"].apply(lambda x: int(x.split(",")[1]) )
-    
-    gtf["id, name"]=gtf["gene_id"]+", "+gtf["gene_name"]
-    gtf_=gtf.drop(["source","feature","attribute","promoter","gene_id","gene_name"],axis=1)
-    gtf_=gtf_.drop_duplicates()
-    gtf_counts=gtf_[["id, name"]]
-    gtf_counts["#"]=1
-    gtf_counts=gtf_counts.groupby(["id, name"]).sum()
-    beds=gtf_[["seqname","start","end","id, name","score","strand"]]
-    beds.columns=['chrom', 'start', 'stop', 'name', 'score', 'strand']
-    beds=beds[beds["name"].isin( gtf_counts[gtf_counts["#"]==1].index.tolist() )]
-    genes=[ s for s in list(set(gtf_counts[gtf_counts["#"]>1].index.tolist())) if str(s).lower() != "nan" ]
-
-    for gene_id in genes:
-        tmp=gtf[gtf["id, name"]==gene_id]
-        strand=tmp["strand"].tolist()[0]
-        bed=GTFtoBED(inGTF=tmp,name="id, name")
-        bed = pybedtools.BedTool.from_dataframe(bed)
-        bed=bed.sort()
-        bed=bed.merge()
-        bed = pd.read_table(bed.fn, names=['chrom', 'start', 'stop' ])
-        bed["name"]=gene_id
-        bed["score"]="."
-        bed["strand"]=strand
-        beds=pd.concat([beds,bed])
-    
-    beds = pybedtools.BedTool.from_dataframe(beds)
-    beds = beds.sort()
-    beds = pd.read_table(beds.fn, names=['chrom', 'start', 'stop', 'name', 'score', 'strand'])
-    
+    gtf=readGTF(gtf, features=["transcript"])
+    fields=retrieve_GTF_field(field=["gene_id","gene_name"],gtf=gtf)
+
+    seqname=gtf["seqname"].astype(str).to_numpy()
+    minus=( gtf["strand"].astype(str) == "-" ).to_numpy()
+    sizes=pd.Series(seqname).map(chrsizes)
+    if sizes.isnull().any():
+        raise KeyError(sorted(set(seqname[sizes.isnull().to_numpy()])))
+    tss=np.where(minus, gtf["end"].to_numpy(), gtf["start"].to_numpy()).astype(np.int64)
+    promoter_start=np.maximum(np.where(minus, tss-downstream, tss-upstream), 0)
+    promoter_end=np.minimum(np.where(minus, tss+upstream, tss+downstream), sizes.to_numpy().astype(np.int64))
+
+    proms=pd.DataFrame({"chrom":seqname, "start":promoter_start, "stop":promoter_end,
+                        "name":( fields["gene_id"]+", "+fields["gene_name"] ).to_numpy(),
+                        "score":gtf["score"].astype(str).to_numpy(), "strand":gtf["strand"].astype(str).to_numpy(),
+                        "frame":gtf["frame"].astype(str).to_numpy()})
+    proms=proms[proms["name"].notnull()]
+
+    counts=proms.drop_duplicates()["name"].value_counts()
+    single=proms["name"].isin(counts[counts == 1].index)
+    beds=proms[single].drop_duplicates()
+
+    multi=proms[~single]
+    group=pd.factorize(multi["name"]+"\t"+multi["chrom"])[0]
+    first, start, stop = _mergeIntervals(group, multi["start"].to_numpy(), multi["stop"].to_numpy())
+    strand=multi.drop_duplicates(["name"]).set_index("name")["strand"]
+    merged=pd.DataFrame({"chrom":multi["chrom"].to_numpy()[first], "start":start, "stop":stop,
+                         "name":multi["name"].to_numpy()[first], "score":"."})
+    merged["strand"]=merged["name"].map(strand).to_numpy()
+
+    beds=pd.concat([beds[['chrom', 'start', 'stop', 'name', 'score', 'strand']], merged], ignore_index=True)
+    order=np.lexsort((beds["start"].to_numpy(), beds["chrom"].to_numpy().astype(str)))
+    beds=beds.iloc[order]
     beds.reset_index(inplace=True, drop=True)
-    beds["i"]=beds.index.tolist()
-    beds["i"]=beds["i"].astype(str)
-    beds["name"]=beds["i"]+": "+beds["name"]
-    beds=beds.drop(["i"],axis=1)
+    beds["name"]=beds.index.astype(str)+": "+beds["name"]
 
     return beds
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+# sequences are laid out one after the other on a single axis, this far apart
+_SEQUENCE_SPAN=2**40
+
+def _strandColumn(bed):
+    """
+    Returns the strand column of a bed dataframe: the 'strand' column or else the 6th column.
+    """
+    if 'strand' in bed.columns:
+        return bed['strand']
+    if bed.shape[1] < 6:
+        raise ValueError("strand aware overlaps require a 'strand' column or at least 6 columns")
+    return bed.iloc[:,5]
+
+def _axis(bed, codes):
+    """
+    Places the intervals of a bed dataframe on a single axis with all sequences one after the other.
+    """
+    offset=codes.astype(np.int64)*_SEQUENCE_SPAN
+    return offset+bed.iloc[:,1].astype(np.int64).to_numpy(), offset+bed.iloc[:,2].astype(np.int64).to_numpy()
+
+def overlapIndex(a, b, how="wo", strand=None):
+    """
+    Finds the overlapping intervals of two bed dataframes as bedtools intersect -wo or -loj. Intervals of all sequences
+    are placed on one axis and the intervals of b are split into classes of similar lengths; within each class the
+    intervals of b overlapping each interval of a are found with two searchsorted calls on the sorted starts.
+
+    :param a: a Pandas dataframe in bed format. The first three columns are used as chromosome, 0-based start and end.
+    :param b: a Pandas dataframe in bed format. The first three columns are used as chromosome, 0-based start and end.
+    :param how: 'wo' to report all overlapping pairs, 'loj' to report as well each interval of a without overlaps, paired with -1
+    :param strand: None to ignore strands, 'same' to require the same strand as bedtools -s and 'opposite' to require opposite strands as bedtools -S. Strands are taken from the 'strand' column or else from the 6th column; with strand set, intervals with a strand other than '+' or '-' overlap nothing.
+
+    :returns: numpy arrays with the positions in a and in b of each overlapping pair and the number of overlapping bases, sorted by position in a and b
+    """
+    if how not in ["wo","loj"]:
+        raise ValueError("how must be 'wo' or 'loj'")
+    a_keys=a.iloc[:,0].astype(str).to_numpy(dtype=object)
+    b_keys=b.iloc[:,0].astype(str).to_numpy(dtype=object)
+    if strand is not None:
+        if strand == "same":
+            a_map={"+":"+","-":"-"}
+        elif strand == "opposite":
+            a_map={"+":"-","-":"+"}
+        else:
+            raise ValueError("strand must be None, 'same' or 'opposite'")
+        # intervals without strand match no strand, not even each other, as in bedtools
+        a_strand=_strandColumn(a).astype(str).map(a_map).fillna("\ta").to_numpy(dtype=object)
+        b_strand=_strandColumn(b).astype(str).map({"+":"+","-":"-"}).fillna("\tb").to_numpy(dtype=object)
+        a_keys=a_keys+"\t"+a_strand
+        b_keys=b_keys+"\t"+b_strand
+    codes=pd.factorize(np.concatenate([a_keys, b_keys]))[0]
+    a_start, a_end = _axis(a, codes[:len(a)])
+    b_start, b_end = _axis(b, codes[len(a):])
+
+    lengths=np.maximum(b_end-b_start, 1)
+    classes=np.floor(np.log2(lengths)).astype(np.int64)
+    pairs_a, pairs_b = [], []
+    for c in np.unique(classes):
+        members=np.flatnonzero(classes == c)
+        members=members[np.argsort(b_start[members], kind="stable")]
+        starts=b_start[members]
+        longest=int(( b_end[members]-starts ).max())
+        first=np.searchsorted(starts, a_start-longest, side="right")
+        n=np.maximum(np.searchsorted(starts, a_end, side="left")-first, 0)
+        total=int(n.sum())
+        i=np.repeat(np.arange(len(a)), n)
+        j=members[np.repeat(first, n)+np.arange(total)-np.repeat(np.cumsum(n)-n, n)]
+        keep=( b_end[j] > a_start[i] ) & ( b_start[j] < a_end[i] )
+        pairs_a.append(i[keep])
+        pairs_b.append(j[keep])
+    ai=np.concatenate(pairs_a) if len(pairs_a) > 0 else np.zeros(0, dtype=np.int64)
+    bj=np.concatenate(pairs_b) if len(pairs_b) > 0 else np.zeros(0, dtype=np.int64)
+    overlap=np.minimum(a_end[ai], b_end[bj])-np.maximum(a_start[ai], b_start[bj])
+    keep=overlap > 0
+    ai, bj, overlap = ai[keep], bj[keep], overlap[keep]
+
+    if how == "loj":
+        missing=np.setdiff1d(np.arange(len(a)), ai)
+        ai=np.concatenate([ai, missing])
+        bj=np.concatenate([bj, np.full(len(missing), -1)])
+        overlap=np.concatenate([overlap, np.zeros(len(missing), dtype=np.int64)])
+    order=np.lexsort((bj, ai))
+    return ai[order], bj[order], overlap[order]
+
+def intersectBED(a, b, how="wo", strand=None, suffix="_b"):
+    """
+    Intersects two bed dataframes in memory as bedtools intersect -wo or -loj, without writing or parsing any files.
+
+    :param a: a Pandas dataframe in bed format. The first three columns are used as chromosome, 0-based start and end.
+    :param b: a Pandas dataframe in bed format. The first three columns are used as chromosome, 0-based start and end.
+    :param how: 'wo' to report all overlapping pairs, 'loj' to report as well each interval of a without overlaps
+    :param strand: None to ignore strands, 'same' to require the same strand and 'opposite' to require opposite strands. See overlapIndex().
+    :param suffix: suffix added to the columns of b also present in a
+
+    :returns: a Pandas dataframe with the columns of a, the columns of b and 'overlap', the number of overlapping bases. Columns of b are missing values for intervals of a without overlaps.
+    """
+    ai, bj, overlap = overlapIndex(a, b, how=how, strand=strand)
+    left=a.iloc[ai].reset_index(drop=True)
+    right=b.reset_index(drop=True).reindex(bj).reset_index(drop=True)
+    right.columns=[ str(c)+suffix if c in a.columns else c for c in right.columns ]
+    df=pd.concat([left, right], axis=1)
+    df["overlap"]=overlap
+    return df
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+from .sam import readSAMchunks, filterSAM, SAMsequences, _libraryStrand
+from .cigar import _factorizeCIGAR, _tokenizeCIGAR, _expand, _CONSUMES_REFERENCE
+from .gtf import retrieve_GTF_field
+
+_STRANDS=np.array(['-','.','+'], dtype=object)
+
+def _uniqueIntrons(group, ops, lengths, offsets, counts):
+    """
+    Computes the skipped regions (N) of unique CIGAR strings relative to the alignment start.
+
+    :returns: the relative 0-based start and the length of each skipped region and the offset and number of skipped regions of each string
+    """
+    n=len(counts)
+    if len(ops) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    reference=np.where(_CONSUMES_REFERENCE[ops], lengths, 0)
+    cs=np.cumsum(reference)
+    starts=cs-reference-( cs-reference )[offsets[group]]
+    skipped=( ops == 3 ) & ( lengths > 0 )
+    intron_counts=np.bincount(group[skipped], minlength=n)
+    intron_offsets=np.cumsum(intron_counts)-intron_counts
+    return starts[skipped], lengths[skipped], intron_offsets, intron_counts
+
+def spliceJunctions(pos, cigar):
+    """
+    Extracts the splice junctions, ie. the skipped regions (N), of each read.
+    Each distinct CIGAR string is parsed once and its junctions are shifted to the position of each read.
+
+    :param pos: a Pandas series or numpy array with the 1-based leftmost mapping positions, eg. the POS column of readSAMchunks()
+    :param cigar: a Pandas series, eg. the CIGAR column of readSAMchunks(), or a list of CIGAR strings
+
+    :returns: a Pandas dataframe with one row per junction and the columns 'read' (the position of the read in cigar), 'start' and 'end' (the 1-based first and last intronic bases). The donor is 'start' for junctions on the forward strand and 'end' for junctions on the reverse strand.
+    """
+    codes, uniques = _factorizeCIGAR(cigar)
+    starts, lengths, offsets, counts = _uniqueIntrons(*_tokenizeCIGAR(uniques))
+    rows, items = _expand(codes, offsets, counts)
+    pos=np.asarray(pos).astype(np.int64)
+    start=pos[rows]+starts[items]
+    return pd.DataFrame({"read":rows, "start":start, "end":start+lengths[items]-1})
+
+def _reduceJunctions(seq, start, end, strand, unique):
+    """
+    Counts junctions by sorting on sequence, start, end and strand and reducing over runs of equal keys.
+
+    :returns: the keys of each distinct junction and its number of uniquely and multi mapped reads
+    """
+    if len(seq) == 0:
+        return seq, start, end, strand, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    order=np.lexsort((strand, end, start, seq))
+    seq, start, end, strand, unique = seq[order], start[order], end[order], strand[order], unique[order]
+    new=np.ones(len(seq), dtype=bool)
+    new[1:]=( seq[1:] != seq[:-1] ) | ( start[1:] != start[:-1] ) | ( end[1:] != end[:-1] ) | ( strand[1:] != strand[:-1] )
+    first=np.flatnonzero(new)
+    unique_reads=np.add.reduceat(unique[:,0], first)
+    multi_reads=np.add.reduceat(unique[:,1], first)
+    return seq[first], start[first], end[first], strand[first], unique_reads, multi_reads
+
+def _mergeJunctions(reduced, rank):
+    """
+    Reduces the junctions of several chunks, each as returned by _reduceJunctions() with its seqnames, into one.
+
+    :param reduced: a list of (seqnames, start, end, strand, unique, multi) tuples
+    :param rank: a dictionary with the order of each seqname. Seqnames not in rank are placed last.
+
+    :returns: a (seqnames, start, end, strand, unique, multi) tuple of the distinct junctions, sorted by position
+    """
+    names=np.concatenate([ r[0] for r in reduced ]).astype(object)
+    uniques, inverse = np.unique(names, return_inverse=True)
+    seq_rank=np.array([ rank.get(s, len(rank)+i) for i, s in enumerate(uniques) ], dtype=np.int64)
+    seq, start, end, strand, u, m = _reduceJunctions(seq_rank[inverse],
+                                                     np.concatenate([ r[1] for r in reduced ]),
+                                                     np.concatenate([ r[2] for r in reduced ]),
+                                                     np.concatenate([ r[3] for r in reduced ]),
+                                                     np.column_stack([ np.concatenate([ r[4] for r in reduced ]), np.concatenate([ r[5] for r in reduced ]) ]))
+    seqnames=dict(zip(seq_rank, uniques))
+    return np.array([ seqnames[s] for s in seq ], dtype=object), start, end, strand, u, m
+
+def countJunctions(SAMfile, stranded=0, include_flags=0, exclude_flags=1796, min_mapq=0, gtf=None, chunksize=200000, merge_every=16):
+    """
+    Counts the reads supporting each splice junction of a SAM file. Each chunk of alignments is reduced
+    to its distinct junctions as it is read and the junctions of merge_every chunks are reduced together
+    so that memory is bound by the number of junctions.
+
+    :param SAMfile: /path/to/file.sam. gzip or BGZF compressed files are read as well.
+    :param stranded: 0 to take the strand from the XS field (junctions without XS are '.'), 1 if read 1 (or the single end read) is on the transcript strand and 2 if it is on the opposite strand
+    :param include_flags: only alignments with all these bits set are counted
+    :param exclude_flags: alignments with any of these bits set are not counted. Defaults to unmapped, secondary, QC fail and duplicate alignments.
+    :param min_mapq: minimum mapping quality
+    :param gtf: a GTF dataframe as returned by readGTF() to annotate the junctions with annotateJunctions(). If None, junctions are not annotated.
+    :param chunksize: number of alignments to be read at a time
+    :param merge_every: number of reduced chunks kept before they are merged
+
+    :returns: a Pandas dataframe with the columns 'seqname', 'start' and 'end' (the 1-based first and last intronic bases), 'strand', 'unique' (reads with NH:i:1 or no NH field) and 'multi' (reads with NH above 1) sorted by position
+    """
+    head, chunks = readSAMchunks(SAMfile, chunksize=chunksize, header=True, tags=["XS","NH"])
+    rank={ s:i for i, s in enumerate(SAMsequences(head)) }
+    reduced=[]
+    for chunk in chunks:
+        chunk=chunk[filterSAM(chunk, include_flags, exclude_flags, min_mapq)]
+        if len(chunk) == 0:
+            continue
+        junctions=spliceJunctions(chunk['POS'], chunk['CIGAR'])
+        if len(junctions) == 0:
+            continue
+        rows=junctions['read'].to_numpy()
+        if stranded:
+            strand=_libraryStrand(chunk['FLAG'], stranded)
+        else:
+            xs=chunk['XS'].to_numpy(dtype=object)
+            strand=np.where(xs == "+", 1, np.where(xs == "-", -1, 0)).astype(np.int8)
+        nh=pd.to_numeric(chunk['NH']).fillna(1).to_numpy()
+        unique=np.column_stack([nh <= 1, nh > 1]).astype(np.int64)
+        seq=chunk['RNAME'].cat.codes.to_numpy()
+        seq, start, end, strand, u, m = _reduceJunctions(seq[rows], junctions['start'].to_numpy(), junctions['end'].to_numpy(), strand[rows], unique[rows])
+        reduced.append((chunk['RNAME'].cat.categories.astype(str).to_numpy()[seq], start, end, strand, u, m))
+        if len(reduced) >= merge_every:
+            reduced=[_mergeJunctions(reduced, rank)]
+
+    if len(reduced) == 0:
+        df=pd.DataFrame({"seqname":pd.Series(dtype=str), "start":pd.Series(dtype=np.int64), "end":pd.Series(dtype=np.int64), "strand":pd.Series(dtype=str), "unique":pd.Series(dtype=np.int64), "multi":pd.Series(dtype=np.int64)})
+    else:
+        seqnames, start, end, strand, u, m = _mergeJunctions(reduced, rank)
+        df=pd.DataFrame({"seqname":seqnames, "start":start, "end":end, "strand":_STRANDS[strand+1], "unique":u, "multi":m})
+    if gtf is not None:
+        df=annotateJunctions(df, gtf)
+    return df
+
+def GTFintrons(gtf):
+    """
+    Computes the introns of each transcript of a GTF as the gaps between its consecutive exons.
+
+    :param gtf: a GTF dataframe as returned by readGTF() or parseGTF(). Only 'exon' features are used.
+
+    :returns: a Pandas dataframe of the distinct introns with the columns 'seqname', 'start' and 'end' (the 1-based first and last intronic bases) and 'strand'
+    """
+    exons=gtf[gtf['feature'] == 'exon']
+    if 'transcript_id' in exons.columns:
+        transcripts=exons['transcript_id'].to_numpy(dtype=object)
+    else:
+        transcripts=retrieve_GTF_field('transcript_id', exons)['transcript_id'].to_numpy(dtype=object)
+    transcripts=pd.factorize(transcripts)[0]
+    start=exons['start'].to_numpy().astype(np.int64)
+    end=exons['end'].to_numpy().astype(np.int64)
+    order=np.lexsort((start, transcripts))
+    transcripts, start, end = transcripts[order], start[order], end[order]
+    keep=( transcripts[1:] == transcripts[:-1] ) & ( transcripts[1:] >= 0 ) & ( end[:-1]+1 <= start[1:]-1 )
+    introns=pd.DataFrame({"seqname":exons['seqname'].astype(str).to_numpy()[order][:-1][keep],
+                          "start":end[:-1][keep]+1,
+                          "end":start[1:][keep]-1,
+                          "strand":exons['strand'].astype(str).to_numpy()[order][:-1][keep]})
+    return introns.drop_duplicates().reset_index(drop=True)
+
+def annotateJunctions(junctions, gtf):
+    """
+    Annotates splice junctions as known or novel against the introns of the transcripts of a GTF.
+    Junctions without strand ('.') are matched on either strand.
+
+    :param junctions: a Pandas dataframe with the columns 'seqname', 'start', 'end' and 'strand' eg. as returned by countJunctions()
+    :param gtf: a GTF dataframe as returned by readGTF() or parseGTF()
+
+    :returns: the junctions dataframe with the columns 'known' (the junction is an annotated intron), 'known_start' and 'known_end' (the 1-based first or last intronic base is an annotated splice site)
+    """
+    introns=GTFintrons(gtf)
+    seqname=junctions['seqname'].astype(str).to_numpy()
+    strand=junctions['strand'].astype(str).to_numpy()
+    unstranded=strand == "."
+    df=junctions.copy()
+
+    def isin(columns):
+        query=[seqname]+[ junctions[c].to_numpy() for c in columns ]
+        stranded=pd.MultiIndex.from_arrays(query+[strand]).isin(pd.MultiIndex.from_arrays([ introns[c] for c in ['seqname']+columns+['strand'] ]))
+        either=pd.MultiIndex.from_arrays(query).isin(pd.MultiIndex.from_arrays([ introns[c] for c in ['seqname']+columns ]))
+        return np.where(unstranded, either, stranded)
+
+    df['known']=isin(['start','end'])
+    df['known_start']=isin(['start'])
+    df['known_end']=isin(['end'])
+    return df
@@ -1,84 +1,350 @@
+import io
+import re
+import csv
+import gzip
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
+from .bgzf import openOutput
 
-def readSAM(SAMfile,header=False):
+SAM_COLUMNS=['QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL']
+_SAM_CATEGORIES=['RNAME','CIGAR','RNEXT']
+
+_SAM_DTYPES={ c:"category" for c in _SAM_CATEGORIES }
+_SAM_DTYPES.update({'QNAME':str,'FLAG':np.uint16,'POS':np.int32,'MAPQ':np.uint8,'PNEXT':np.int32,'TLEN':np.int32,'SEQ':str,'QUAL':str})
+
+def _openSAM(SAMfile):
+    """
+    Opens a plain text or gzip/BGZF compressed SAM file for binary reading.
+    """
+    with open(SAMfile, "rb") as f:
+        magic=f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(SAMfile, "rb")
+    return open(SAMfile, "rb")
+
+def _readSAMheader(f):
+    """
+    Reads the header lines at the beginning of an opened SAM file.
+
+    :returns: a list with the header lines and the first bytes after the header
+    """
+    head=[]
+    while True:
+        line=f.readline()
+        if not line.startswith(b"@"):
+            return head, line
+        head.append(line.decode())
+
+def _SAMblocks(f, first, chunksize, block_size=16*1024*1024):
+    """
+    Reads an opened SAM file in blocks of complete lines.
+
+    :returns: a generator of bytes with chunksize lines each, the last one possibly shorter
+    """
+    blocks=[first]
+    count=first.count(b"\n")
+    done=False
+    while True:
+        while not done and count < chunksize:
+            block=f.read(block_size)
+            if len(block) == 0:
+                done=True
+                if not blocks[-1].endswith(b"\n") and sum([ len(b) for b in blocks ]) > 0:
+                    blocks.append(b"\n")
+                    count=count+1
+                break
+            blocks.append(block)
+            count=count+block.count(b"\n")
+        buf=b"".join(blocks)
+        if count < chunksize:
+            if len(buf) > 0:
+                yield buf
+            return
+        cut=np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)[chunksize-1]+1
+        yield buf[:cut]
+        blocks=[buf[cut:]]
+        count=count-chunksize
+
+# types of the standard optional fields of the SAM tags specification
+_SAM_TAG_TYPES={ 'AM':'i','AS':'i','BC':'Z','BQ':'Z','BZ':'Z','CB':'Z','CC':'Z','CG':'B','CM':'i','CO':'Z','CP':'i','CQ':'Z',
+                 'CR':'Z','CS':'Z','CT':'Z','CY':'Z','E2':'Z','FI':'i','FS':'Z','FZ':'B','H0':'i','H1':'i','H2':'i','HI':'i',
+                 'IH':'i','LB':'Z','MC':'Z','MD':'Z','MI':'Z','ML':'B','MM':'Z','MN':'i','MQ':'i','NH':'i','NM':'i','OA':'Z',
+                 'OC':'Z','OP':'i','OQ':'Z','OX':'Z','PG':'Z','PQ':'i','PT':'Z','PU':'Z','Q2':'Z','QT':'Z','QX':'Z','R2':'Z',
+                 'RG':'Z','RX':'Z','SA':'Z','SM':'i','TC':'i','TS':'A','U2':'Z','UQ':'i' }
+
+def _SAMtagTypes(tags):
+    """
+    Reads the names and types of the requested optional fields. Fields are given as 'NH' or with their type as 'XS:A'.
+    Fields without type take the type of the SAM tags specification, other fields are strings.
+
+    :returns: a dictionary of field names and types
     """
-    Reads and parses a sam file.
+    types={}
+    for t in tags:
+        name, sep, kind = t.partition(":")
+        types[name]=kind if sep else _SAM_TAG_TYPES.get(name, 'Z')
+        if types[name] not in ['A','i','f','Z','H','B']:
+            raise ValueError("%s is not a SAM optional field type" %t)
+    return types
+
+def _SAMtagsPattern(tags):
+    """
+    Compiles a regular expression matching the requested optional fields at the start of a field, or a newline.
+    """
+    names=b"|".join([ re.escape(t.encode()) for t in _SAMtagTypes(tags) ])
+    return re.compile(b"\\n|(?<![^\\t\\n])("+names+b"):[AifZHB]:([^\\t\\n]*)")
+
+def _SAMtagColumn(kind, n):
+    """
+    Allocates an empty column for an optional field of the given type.
+    """
+    if kind == "i":
+        return pd.arrays.IntegerArray(np.zeros(n, dtype=np.int64), np.ones(n, dtype=bool))
+    if kind == "f":
+        return np.full(n, np.nan)
+    # an object series is not inferred as a string column whether it has values or not
+    return pd.Series(np.full(n, None, dtype=object), dtype=object)
+
+def _SAMtagsFrame(tags, names, pattern=None):
+    """
+    Extracts optional fields into typed columns. The raw fields of all alignments are joined into one newline
+    separated buffer which is scanned once for the requested fields only; the newline matches are used to
+    recover the alignment each field belongs to. Other fields are not decoded.
+
+    :param tags: a sequence with the optional fields of each alignment as tab separated bytes
+    :param names: a list of the fields to be extracted eg. ['NH','NM','XS:A'], see _SAMtagTypes()
+    :param pattern: a pattern as returned by _SAMtagsPattern(names)
+
+    :returns: a dictionary of columns with the type of each field whether it is present or not: 'i' fields are nullable integers, 'f' fields floats and 'A', 'Z', 'H' and 'B' fields strings
+    """
+    if pattern is None:
+        pattern=_SAMtagsPattern(names)
+    types=_SAMtagTypes(names)
+    n=len(tags)
+    columns={ t:_SAMtagColumn(kind, n) for t, kind in types.items() }
+    matches=pattern.findall(b"\n".join(tags))
+    # only newlines
+    if n == 0 or len(matches) == n-1:
+        return columns
+    found_names, values = zip(*matches)
+    found_names=np.array(found_names, dtype="S2")
+    values=np.array(values, dtype=object)
+    newlines=found_names == b""
+    rows=np.cumsum(newlines)[~newlines]
+    found_names=found_names[~newlines]
+    values=values[~newlines]
+    for t, kind in types.items():
+        found=found_names == t.encode()
+        if not found.any():
+            continue
+        r=rows[found]
+        # fixed width bytes sized by the values of this field only
+        v=np.array(values[found].tolist(), dtype=bytes)
+        if kind == "i":
+            data=np.zeros(n, dtype=np.int64)
+            data[r]=v.astype(np.int64)
+            mask=np.ones(n, dtype=bool)
+            mask[r]=False
+            columns[t]=pd.arrays.IntegerArray(data, mask)
+        elif kind == "f":
+            columns[t][r]=v.astype(np.float64)
+        else:
+            columns[t].iloc[r]=v.astype(str)
+    return columns
+
+def _parseSAMchunk(buf, offset=0, tags=None, pattern=None):
+    """
+    Parses a block of complete SAM lines. The 11 mandatory fields are cut out of the block with numpy
+    and parsed by the pandas C parser, the optional fields of each line are kept as raw bytes.
+
+    :param buf: bytes with complete SAM lines
+    :param offset: index of the first line
+    :param tags: a list of optional fields to be extracted into typed columns, see _SAMtagsFrame()
+    :param pattern: a pattern as returned by _SAMtagsPattern(tags)
+
+    :returns: a Pandas dataframe with the columns 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL','TAGS' and one column per requested optional field
+    """
+    data=np.frombuffer(buf, dtype=np.uint8)
+    ends=np.flatnonzero(data == 10)
+    tabs=np.flatnonzero(data == 9)
+    starts=np.concatenate([[0], ends[:-1]+1])
+    # blank lines are skipped, as by read_csv
+    keep=ends > starts
+    starts=starts[keep]
+    ends=ends[keep]
+    first=np.searchsorted(tabs, starts)
+    ntabs=np.searchsorted(tabs, ends)-first
+    has_tags=ntabs > 10
+    cut=ends.copy()
+    cut[has_tags]=tabs[first[has_tags]+10]
+    if has_tags.any():
+        core=b"\n".join([ buf[s:c] for s, c in zip(starts.tolist(), cut.tolist()) ])+b"\n"
+    else:
+        core=buf
+    sam=pd.read_csv(io.BytesIO(core), sep="\t", header=None, names=SAM_COLUMNS, dtype=_SAM_DTYPES,
+                    quoting=csv.QUOTE_NONE, na_filter=False, engine="c")
+    raw=np.empty(len(ends), dtype=object)
+    raw[:]=[ buf[c+1:e] for c, e in zip(cut.tolist(), ends.tolist()) ]
+    sam["TAGS"]=raw
+    if tags is not None and len(tags) > 0:
+        for t, values in _SAMtagsFrame(raw, tags, pattern).items():
+            sam[t]=values
+    sam.index=pd.RangeIndex(offset, offset+len(sam))
+    return sam
+
+def readSAMchunks(SAMfile, chunksize=200000, header=False, tags=None):
+    """
+    Reads a SAM file in chunks without loading it into memory. The header is read in the same pass.
+
+    :param SAMfile: /path/to/file.sam. gzip or BGZF compressed files are read as well.
+    :param chunksize: number of alignments per chunk
+    :param header: logical, if True, the header lines are returned together with the chunks
+    :param tags: a list of optional fields to be extracted into typed columns eg. ['NH','NM','XS:A']. Fields are typed as in the SAM tags specification or by the type given after the name; other fields are strings. Fields of type 'i' become nullable integer columns, 'f' float columns and 'A', 'Z', 'H' and 'B' string columns, in every chunk. Alignments without the field are missing values.
+
+    :returns: a generator of Pandas dataframes with the columns 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL','TAGS' plus one column per requested optional field and a list of the header lines if header=True. FLAG, POS, MAPQ, PNEXT and TLEN are numeric, RNAME, CIGAR and RNEXT are categorical and TAGS holds the optional fields of each alignment as raw bytes.
+    """
+    f=_openSAM(SAMfile)
+    head, first = _readSAMheader(f)
+    pattern=_SAMtagsPattern(tags) if tags else None
+
+    def chunks():
+        offset=0
+        try:
+            for buf in _SAMblocks(f, first, chunksize):
+                sam=_parseSAMchunk(buf, offset, tags, pattern)
+                if len(sam) == 0:
+                    continue
+                offset=offset+len(sam)
+                yield sam
+        finally:
+            f.close()
+
+    if header:
+        return head, chunks()
+    return chunks()
+
+def _concatSAM(chunks, tags=None):
+    """
+    Concatenates SAM chunks keeping the categorical columns.
+    """
+    chunks=list(chunks)
+    if len(chunks) == 0:
+        sam=pd.DataFrame(columns=SAM_COLUMNS+['TAGS']).astype({ c:_SAM_DTYPES[c] for c in SAM_COLUMNS })
+        for t, values in _SAMtagsFrame([], tags or []).items():
+            sam[t]=values
+        return sam
+    sam=pd.concat(chunks, ignore_index=True)
+    for c in _SAM_CATEGORIES:
+        sam[c]=union_categoricals([ chunk[c] for chunk in chunks ]).remove_unused_categories()
+    return sam
+
+def readSAM(SAMfile,header=False,tags=None):
+    """
+    Reads and parses a sam file. The file is read in one pass through readSAMchunks().
 
     :param SAMfile: /path/to/file.sam
     :param header: logical, if True, reads the header information
+    :param tags: a list of optional fields to be extracted into typed columns eg. ['NH','NM','AS'], see readSAMchunks()
 
-    :returns: a pandas dataframe with the respective SAM columns: 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL' and a list of the headers if header=True
+    :returns: a pandas dataframe with the respective SAM columns: 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL' plus one column per requested optional field and a list of the headers if header=True. Optional fields are appended to 'QUAL' separated by tabs.
 
     """
-    if header==True:
-        f=open(SAMfile,"r+")
-        head=[]
-        for line in f.readlines():
-            if line[0]=="@":
-                head.append(line)
-            else:
-                continue
-        f.close()
-
-    sam=pd.read_table(SAMfile,sep="this_gives_one_column",comment="@",header=None)
-    sam=pd.DataFrame(sam[0].str.split("\t").tolist())
-    acols=[0,1,2,3,4,5,6,7,8,9]
-    sam_=sam[acols]
-    samcols=sam.columns.tolist()
-    bcols=[ s for s in samcols if s not in acols ]
-    sam_[10]=sam[bcols[0]]
-    if len(bcols) > 1:
-        for c in bcols[1:]:
-            sam_[10]=sam_[10].astype(str)
-            sam[c]=sam[c].astype(str)
-            sam_[10]=sam_[10]+"\t"+sam[c]
-
-    sam_.columns=['QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL']
+    head, chunks = readSAMchunks(SAMfile, header=True, tags=tags)
+    sam_=_concatSAM(chunks, tags)
+    raw=sam_.pop('TAGS')
+    with_tags=np.array([ len(t) > 0 for t in raw ], dtype=bool)
+    if with_tags.any():
+        qual=sam_['QUAL'].to_numpy(dtype=object)
+        qual[with_tags]=qual[with_tags]+"\t"+np.array([ t.decode() for t in raw[with_tags] ], dtype=object)
+        sam_['QUAL']=qual
 
     if header==True:
         return sam_, head
     else:
         return sam_
 
-def writeSAM(sam,SAMfile,header=None):
+def _SAMtextColumn(col):
     """
-    Writes a pandas dataframe with the respective SAM columns: 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL' into a sam file
-
-    :param sam: pandas dataframe to be writen
-    :param SAMfile: /path/to/file.sam
-
-    :returns: nothing
+    Returns a SAM column as a numpy object array of strings. Missing values are written as '*'.
+    Categories and repeated integers are converted to strings once.
+    """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        categories=np.asarray(list(col.cat.categories.astype(str))+["*"], dtype=object)
+        return categories[col.cat.codes.to_numpy()]
+    values=col.to_numpy()
+    if values.dtype.kind in "iu":
+        unique, inverse = np.unique(values, return_inverse=True)
+        if len(unique)*4 < len(values):
+            return np.asarray(unique.astype(str), dtype=object)[inverse]
+        return np.array(list(map(str, values.tolist())), dtype=object)
+    if values.dtype.kind == "f":
+        missing=np.isnan(values)
+        text=np.array(list(map(str, np.where(missing, 0, values).astype(np.int64).tolist())), dtype=object)
+        text[missing]="*"
+        return text
+    values=col.to_numpy(dtype=object)
+    missing=pd.isnull(values)
+    if missing.any():
+        values=np.where(missing, "*", values)
+    return np.array(list(map(str, values)), dtype=object)
+
+def _SAMlines(sam):
     """
-    def toNone(x):
-        if x=="None":
-            x=np.nan
-        return x
+    Serializes a SAM dataframe into SAM lines.
 
-    sam.reset_index(inplace=True,drop=True)
-    QUAL=pd.DataFrame(sam['QUAL'].str.split("\t").tolist())
-    cols=QUAL.columns.tolist()
+    :param sam: a Pandas dataframe with the columns 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL' and optionally 'TAGS'
 
-    for c in cols:
-        QUAL[c]=QUAL[c].apply(lambda x: toNone(x))
+    :returns: a list of strings
+    """
+    cols=[ _SAMtextColumn(sam[c]) for c in SAM_COLUMNS ]
+    if 'TAGS' in sam.columns and len(sam) > 0:
+        raw=sam['TAGS'].tolist()
+        if isinstance(raw[0], bytes):
+            raw=b"\n".join([ b"" if t is None else t for t in raw ]).decode().split("\n")
+        tags=np.asarray(raw, dtype=object)
+        tags[pd.isnull(tags)]=""
+        with_tags=tags != ""
+        cols[-1]=cols[-1].copy()
+        cols[-1][with_tags]=cols[-1][with_tags]+"\t"+tags[with_tags]
+    return list(map("\t".join, zip(*cols)))
+
+def writeSAMchunks(chunks, SAMfile, header=None, compression="infer", buffer_size=16*1024*1024):
+    """
+    Writes SAM dataframes, eg. the chunks of readSAMchunks(), into one sam file through a large write buffer.
 
-    sam=sam.drop(['QUAL'],axis=1)
-    sam=pd.concat([sam,QUAL],axis=1)
-    sam=sam.astype(str)
-    sam=sam.as_matrix()
+    :param chunks: an iterable of Pandas dataframes with the columns 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL' and optionally 'TAGS'. Other columns are not written.
+    :param SAMfile: /path/to/file.sam
+    :param header: a list of header lines as returned by readSAMchunks(header=True)
+    :param compression: None, 'gzip', 'bgzf' or 'infer' to write BGZF for files ending in .gz, .bgz or .bgzf
+    :param buffer_size: size of the write buffer in bytes
 
-    tfile=open(SAMfile, "w+")
+    :returns: the number of alignments written
+    """
+    n=0
+    with openOutput(SAMfile, compression=compression, buffer_size=buffer_size) as f:
+        if header is not None:
+            f.write("".join([ l if l.endswith("\n") else l+"\n" for l in header ]).encode())
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            f.write(( "\n".join(_SAMlines(chunk))+"\n" ).encode())
+            n=n+len(chunk)
+    return n
 
-    if header != None:
-        for l in header:
-            tfile.write(l)
+def writeSAM(sam,SAMfile,header=None,compression="infer",chunksize=100000):
+    """
+    Writes a pandas dataframe with the respective SAM columns: 'QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL' into a sam file
 
-    for l in sam:
-        l=[ s for s in l if s not in ['nan'] ]
-        l="\t".join(l)
-        tfile.write(l+"\n")
+    :param sam: pandas dataframe to be writen. Optional fields can be appended to 'QUAL' separated by tabs, as done by readSAM(), or be given as raw bytes or strings in a 'TAGS' column, as done by readSAMchunks().
+    :param SAMfile: /path/to/file.sam
+    :param header: a list of header lines as returned by readSAM(header=True)
+    :param compression: None, 'gzip', 'bgzf' or 'infer' to write BGZF for files ending in .gz, .bgz or .bgzf
+    :param chunksize: number of alignments to be serialized and written at a time
 
-    tfile.close()
+    :returns: nothing
+    """
+    writeSAMchunks(( sam.iloc[i:i+chunksize] for i in range(0, len(sam), chunksize) ), SAMfile, header=header, compression=compression)
 
 def SAMflags(x):
     """
@@ -163,3 +429,135 @@ def SAMflags(x):
     flags.append(l)
 
     return flags
+
+SAM_FLAGS=[(1,'paired'),(2,'proper_pair'),(4,'unmapped'),(8,'mate_unmapped'),(16,'reverse'),(32,'mate_reverse'),
+           (64,'first'),(128,'second'),(256,'secondary'),(512,'qcfail'),(1024,'duplicate'),(2048,'supplementary')]
+
+def _flags(flags):
+    """
+    Returns SAM flags as a numpy integer array.
+    """
+    return np.asarray(flags).astype(np.uint16, copy=False)
+
+def SAMflagsTable(flags):
+    """
+    Decodes a column of SAM flags into one boolean column per bit.
+
+    :param flags: a Pandas series or numpy array of flags eg. the FLAG column of readSAMchunks()
+
+    :returns: a Pandas dataframe with the columns 'paired','proper_pair','unmapped','mate_unmapped','reverse','mate_reverse','first','second','secondary','qcfail','duplicate','supplementary'
+    """
+    values=_flags(flags)
+    bits=( values[:,None] & np.array([ b for b, name in SAM_FLAGS ], dtype=np.uint16) ) != 0
+    index=flags.index if isinstance(flags, pd.Series) else None
+    return pd.DataFrame(bits, columns=[ name for b, name in SAM_FLAGS ], index=index)
+
+def isPrimary(flags):
+    """
+    Primary alignments, ie. neither secondary (256) nor supplementary (2048).
+
+    :param flags: a Pandas series or numpy array of SAM flags
+
+    :returns: a numpy boolean array
+    """
+    return ( _flags(flags) & 2304 ) == 0
+
+def isMapped(flags):
+    """
+    Mapped reads, ie. without the unmapped bit (4).
+
+    :param flags: a Pandas series or numpy array of SAM flags
+
+    :returns: a numpy boolean array
+    """
+    return ( _flags(flags) & 4 ) == 0
+
+def isProperPair(flags):
+    """
+    Reads mapped in proper pair (2).
+
+    :param flags: a Pandas series or numpy array of SAM flags
+
+    :returns: a numpy boolean array
+    """
+    return ( _flags(flags) & 2 ) != 0
+
+def isDuplicate(flags):
+    """
+    PCR or optical duplicates (1024).
+
+    :param flags: a Pandas series or numpy array of SAM flags
+
+    :returns: a numpy boolean array
+    """
+    return ( _flags(flags) & 1024 ) != 0
+
+def isSupplementary(flags):
+    """
+    Supplementary alignments (2048).
+
+    :param flags: a Pandas series or numpy array of SAM flags
+
+    :returns: a numpy boolean array
+    """
+    return ( _flags(flags) & 2048 ) != 0
+
+def filterSAM(sam, include_flags=0, exclude_flags=0, min_mapq=0):
+    """
+    Selects alignments by flags and mapping quality as samtools view -f, -F and -q.
+
+    :param sam: a Pandas dataframe with the columns 'FLAG' and 'MAPQ' eg. a chunk of readSAMchunks()
+    :param include_flags: only alignments with all these bits set are kept
+    :param exclude_flags: alignments with any of these bits set are removed
+    :param min_mapq: minimum mapping quality
+
+    :returns: a numpy boolean array
+    """
+    flags=_flags(sam['FLAG'])
+    keep=( flags & include_flags ) == include_flags
+    if exclude_flags:
+        keep=keep & ( ( flags & exclude_flags ) == 0 )
+    if min_mapq:
+        keep=keep & ( sam['MAPQ'].to_numpy() >= min_mapq )
+    return keep
+
+def SAMsequences(header):
+    """
+    Reads the reference sequences of a SAM header.
+
+    :param header: a list of header lines as returned by readSAMchunks(header=True)
+
+    :returns: a dictionary of sequence names and lengths in the order of the header
+    """
+    sequences={}
+    for line in header:
+        if not line.startswith("@SQ"):
+            continue
+        fields=dict([ f.split(":", 1) for f in line.rstrip("\n").split("\t")[1:] if ":" in f ])
+        sequences[fields["SN"]]=int(fields["LN"])
+    return sequences
+
+def _sortedByCoordinate(header):
+    """
+    Checks if a SAM header declares the alignments as sorted by coordinate.
+    """
+    for line in header:
+        if line.startswith("@HD"):
+            return "SO:coordinate" in line.rstrip("\n").split("\t")
+    return False
+
+def _libraryStrand(flags, stranded):
+    """
+    Infers the strand of the transcript an alignment comes from in a stranded library.
+
+    :param flags: a Pandas series or numpy array of SAM flags
+    :param stranded: 1 if read 1 (or the single end read) is on the transcript strand, 2 if it is on the opposite strand
+
+    :returns: a numpy int8 array with 1 for the forward and -1 for the reverse strand
+    """
+    flags=_flags(flags)
+    reverse=( flags & 16 ) != 0
+    reverse=reverse ^ ( ( flags & 129 ) == 129 )
+    if stranded == 2:
+        reverse=~reverse
+    return np.where(reverse, -1, 1).astype(np.int8)
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from .sam import readSAMchunks, SAM_FLAGS, _flags
+from .cigar import CIGARstats
+
+def _median(hist):
+    """
+    Median of the values of a histogram with one bin per integer value.
+    """
+    total=hist.sum()
+    if total == 0:
+        return np.nan
+    cs=np.cumsum(hist)
+    return ( np.searchsorted(cs, ( total-1 )//2+1)+np.searchsorted(cs, total//2+1) )/2.0
+
+def _mean(hist):
+    """
+    Mean of the values of a histogram with one bin per integer value.
+    """
+    total=hist.sum()
+    if total == 0:
+        return np.nan
+    return float(( hist*np.arange(len(hist)) ).sum()/total)
+
+class SAMstats(object):
+    """
+    Collects alignment QC statistics from chunks of alignments in fixed size histograms.
+    Collectors of different chunks, files or processes can be merged.
+
+    :param max_insert: largest insert size (TLEN) with its own bin. Larger insert sizes are counted in the last bin.
+    :param max_clip: largest number of soft clipped bases of a read with its own bin. Larger values are counted in the last bin.
+
+    :returns: a collector with the attributes 'records' (number of alignments), 'flags' (number of alignments with each flag of SAM_FLAGS),
+        'mapq' (MAPQ histogram), 'insert_size' (TLEN histogram of proper pairs), 'soft_clip' (histogram of soft clipped bases per read),
+        'query_bases', 'clipped_bases' and 'seqnames' (a dictionary of reference sequences and number of reads).
+        Histograms, base counts and seqnames count primary mapped reads only.
+    """
+    def __init__(self, max_insert=1000, max_clip=250):
+        self.max_insert=max_insert
+        self.max_clip=max_clip
+        self.records=0
+        self.flags=np.zeros(len(SAM_FLAGS), dtype=np.int64)
+        self.primary=0
+        self.mapped=0
+        self.proper_pairs=0
+        self.mapq=np.zeros(256, dtype=np.int64)
+        self.insert_size=np.zeros(max_insert+2, dtype=np.int64)
+        self.soft_clip=np.zeros(max_clip+2, dtype=np.int64)
+        self.query_bases=0
+        self.clipped_bases=0
+        self.seqnames={}
+
+    def update(self, sam):
+        """
+        Adds a chunk of alignments to the statistics.
+
+        :param sam: a Pandas dataframe with the columns 'FLAG', 'RNAME', 'MAPQ', 'CIGAR' and 'TLEN' eg. a chunk of readSAMchunks()
+
+        :returns: the collector
+        """
+        flags=_flags(sam['FLAG'])
+        self.records+=len(flags)
+        for i, (bit, name) in enumerate(SAM_FLAGS):
+            self.flags[i]+=int(np.count_nonzero(flags & bit))
+        primary=( flags & 2304 ) == 0
+        mapped=primary & ( ( flags & 4 ) == 0 )
+        self.primary+=int(primary.sum())
+        self.mapped+=int(mapped.sum())
+        proper=mapped & ( ( flags & 3 ) == 3 )
+        self.proper_pairs+=int(proper.sum())
+
+        self.mapq+=np.bincount(sam['MAPQ'].to_numpy()[mapped].astype(np.int64), minlength=256)
+        tlen=sam['TLEN'].to_numpy()[proper].astype(np.int64)
+        tlen=tlen[tlen > 0]
+        self.insert_size+=np.bincount(np.minimum(tlen, self.max_insert+1), minlength=self.max_insert+2)
+
+        stats=CIGARstats(sam['CIGAR'][mapped])
+        clipped=( stats['soft_clip_left']+stats['soft_clip_right'] ).to_numpy()
+        self.soft_clip+=np.bincount(np.minimum(clipped, self.max_clip+1), minlength=self.max_clip+2)
+        self.query_bases+=int(stats['query_length'].sum())
+        self.clipped_bases+=int(clipped.sum())
+
+        rname=sam['RNAME'][mapped]
+        if isinstance(rname.dtype, pd.CategoricalDtype):
+            counts=np.bincount(rname.cat.codes.to_numpy()[rname.cat.codes.to_numpy() >= 0], minlength=len(rname.cat.categories))
+            counts=zip(rname.cat.categories.astype(str), counts)
+        else:
+            counts=rname.astype(str).value_counts().items()
+        for name, n in counts:
+            if n > 0:
+                self.seqnames[name]=self.seqnames.get(name, 0)+int(n)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the statistics of another collector.
+
+        :param other: a SAMstats collector with the same max_insert and max_clip
+
+        :returns: the collector
+        """
+        if ( other.max_insert, other.max_clip ) != ( self.max_insert, self.max_clip ):
+            raise ValueError("collectors with different histogram sizes can not be merged")
+        for attr in ['records','flags','primary','mapped','proper_pairs','mapq','insert_size','soft_clip','query_bases','clipped_bases']:
+            setattr(self, attr, getattr(self, attr)+getattr(other, attr))
+        for name, n in other.seqnames.items():
+            self.seqnames[name]=self.seqnames.get(name, 0)+n
+        return self
+
+    def summary(self):
+        """
+        Summarizes the statistics.
+
+        :returns: a Pandas series with the number of alignments, primary alignments, mapped primary alignments and mapping rate,
+            the number of alignments with each flag, the proper pair rate, the mean and median MAPQ and insert size, the fraction of
+            soft clipped reads and the fraction of soft clipped query bases
+        """
+        report=[('records', self.records), ('primary', self.primary), ('mapped', self.mapped),
+                ('mapping rate', self.mapped/float(self.primary) if self.primary else np.nan)]
+        report+=list(zip([ name for bit, name in SAM_FLAGS ], self.flags.tolist()))
+        report+=[('proper pair rate', self.proper_pairs/float(self.mapped) if self.mapped else np.nan),
+                 ('mean MAPQ', _mean(self.mapq)), ('median MAPQ', _median(self.mapq)),
+                 ('mean insert size', _mean(self.insert_size[:-1])), ('median insert size', _median(self.insert_size[:-1])),
+                 ('insert size > %i' %self.max_insert, int(self.insert_size[-1])),
+                 ('soft clipped reads', 1-self.soft_clip[0]/float(self.mapped) if self.mapped else np.nan),
+                 ('soft clip rate', self.clipped_bases/float(self.query_bases) if self.query_bases else np.nan)]
+        return pd.Series(dict(report), dtype=object)
+
+def _SAMqcFile(task):
+    """
+    Collects the statistics of one SAM file.
+    """
+    SAMfile, max_insert, max_clip, chunksize = task
+    stats=SAMstats(max_insert=max_insert, max_clip=max_clip)
+    for chunk in readSAMchunks(SAMfile, chunksize=chunksize):
+        stats.update(chunk)
+    return stats
+
+def SAMqc(SAMfiles, max_insert=1000, max_clip=250, n_jobs=1, chunksize=200000):
+    """
+    Collects alignment QC statistics from SAM files in a single streaming pass over each file.
+    Files, eg. the lanes or shards of a run, are processed in parallel and their statistics merged.
+
+    :param SAMfiles: /path/to/file.sam or a list of /path/to/file.sam. gzip or BGZF compressed files are read as well.
+    :param max_insert: largest insert size (TLEN) with its own bin
+    :param max_clip: largest number of soft clipped bases of a read with its own bin
+    :param n_jobs: number of processes to use
+    :param chunksize: number of alignments to be read at a time
+
+    :returns: a SAMstats collector. Use its summary() for a report.
+    """
+    if isinstance(SAMfiles, str):
+        SAMfiles=[SAMfiles]
+    tasks=[ (f, max_insert, max_clip, chunksize) for f in SAMfiles ]
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results=list(pool.map(_SAMqcFile, tasks))
+    else:
+        results=[ _SAMqcFile(t) for t in tasks ]
+    stats=SAMstats(max_insert=max_insert, max_clip=max_clip)
+    for r in results:
+        stats.merge(r)
+    return stats
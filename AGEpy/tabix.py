@@ -0,0 +1,212 @@
+import gzip
+import struct
+from .bgzf import BgzfReader, BgzfWriter
+
+_TBX_UCSC=0x10000
+
+def _reg2bin(beg, end):
+    """
+    Computes the smallest bin of the UCSC/tabix binning scheme containing the 0-based, half open interval [beg, end).
+    """
+    end=end-1
+    if beg >> 14 == end >> 14:
+        return ((1 << 15)-1)//7+(beg >> 14)
+    if beg >> 17 == end >> 17:
+        return ((1 << 12)-1)//7+(beg >> 17)
+    if beg >> 20 == end >> 20:
+        return ((1 << 9)-1)//7+(beg >> 20)
+    if beg >> 23 == end >> 23:
+        return ((1 << 6)-1)//7+(beg >> 23)
+    if beg >> 26 == end >> 26:
+        return ((1 << 3)-1)//7+(beg >> 26)
+    return 0
+
+def _linesWithOffsets(reader):
+    """
+    Iterates over the lines of a BGZF file yielding the virtual offsets of the start and end of each line together with the line.
+    """
+    reader.seek(0)
+    carry=[]
+    carry_start=None
+    while reader.pos < len(reader.block) or reader._nextBlock():
+        block=reader.block
+        base=reader.block_offset << 16
+        start=reader.pos
+        while True:
+            i=block.find(b"\n", start)
+            if i < 0:
+                if carry_start is None:
+                    carry_start=base | start
+                carry.append(block[start:])
+                break
+            if carry_start is None:
+                yield base | start, base | (i+1), block[start:i]
+            else:
+                carry.append(block[start:i])
+                yield carry_start, base | (i+1), b"".join(carry)
+                carry=[]
+                carry_start=None
+            start=i+1
+        reader.pos=len(block)
+    if carry_start is not None and len(b"".join(carry)) > 0:
+        yield carry_start, reader.tell(), b"".join(carry)
+
+def _parseRecord(line, conf):
+    """
+    Returns the sequence name and the 0-based, half open start and end of a tab separated record.
+    """
+    fields=line.split(b"\t")
+    seqname=fields[conf["col_seq"]-1].decode()
+    beg=int(fields[conf["col_beg"]-1])
+    end=int(fields[conf["col_end"]-1]) if conf["col_end"] > 0 else beg
+    if not conf["zero_based"]:
+        beg=beg-1
+    if end <= beg:
+        end=beg+1
+    return seqname, beg, end
+
+def tabixIndex(file_path, col_seq=1, col_beg=4, col_end=5, meta="#", skip=0, zero_based=False, index_path=None):
+    """
+    Builds a tabix index (.tbi) for a BGZF compressed, tab separated file sorted by sequence name and start.
+    The index holds, for each sequence, the binning index and the linear index of 16 kb windows
+    with the virtual file offsets of the records, and can be used by tabix and htslib as well.
+
+    :param file_path: /path/to/file.gz
+    :param col_seq: column with the sequence name (1-based)
+    :param col_beg: column with the start position (1-based)
+    :param col_end: column with the end position (1-based)
+    :param meta: lines starting with this character are skipped
+    :param skip: number of lines to skip at the beginning of the file
+    :param zero_based: logical, True for 0-based, half open coordinates as in BED files
+    :param index_path: /path/to/file.gz.tbi. Defaults to file_path+'.tbi'
+
+    :returns: the index as read by readTabixIndex()
+    """
+    conf={"col_seq":col_seq, "col_beg":col_beg, "col_end":col_end, "zero_based":zero_based}
+    names=[]
+    refs=[]
+    last_beg=-1
+    with BgzfReader(file_path) as reader:
+        for n, (voffset, vend, line) in enumerate(_linesWithOffsets(reader)):
+            if n < skip or len(line) == 0 or line.startswith(meta.encode()):
+                continue
+            seqname, beg, end = _parseRecord(line, conf)
+            if len(names) == 0 or seqname != names[-1]:
+                if seqname in names:
+                    raise ValueError("%s is not sorted: %s is not contiguous" %(file_path, seqname))
+                names.append(seqname)
+                refs.append({"bins":{}, "linear":[]})
+                last_beg=-1
+            if beg < last_beg:
+                raise ValueError("%s is not sorted: %s:%i comes after %s:%i" %(file_path, seqname, beg+1, seqname, last_beg+1))
+            last_beg=beg
+            ref=refs[-1]
+            chunks=ref["bins"].setdefault(_reg2bin(beg, end), [])
+            if len(chunks) > 0 and chunks[-1][1] == voffset:
+                chunks[-1][1]=vend
+            else:
+                chunks.append([voffset, vend])
+            linear=ref["linear"]
+            last_window=(end-1) >> 14
+            if last_window >= len(linear):
+                linear.extend([None]*(last_window+1-len(linear)))
+            for w in range(beg >> 14, last_window+1):
+                if linear[w] is None:
+                    linear[w]=voffset
+
+    for ref in refs:
+        linear=ref["linear"]
+        first=[ s for s in linear if s is not None ][0]
+        for w in range(len(linear)):
+            if linear[w] is None:
+                linear[w]=first
+            first=linear[w]
+
+    if index_path is None:
+        index_path=file_path+".tbi"
+    nm=b"".join([ s.encode()+b"\x00" for s in names ])
+    with BgzfWriter(index_path) as f:
+        f.write(b"TBI\x01")
+        f.write(struct.pack("<iiiiiiii", len(names), _TBX_UCSC if zero_based else 0, col_seq, col_beg, col_end, ord(meta), skip, len(nm)))
+        f.write(nm)
+        for ref in refs:
+            f.write(struct.pack("<i", len(ref["bins"])))
+            for b in sorted(ref["bins"]):
+                chunks=ref["bins"][b]
+                f.write(struct.pack("<Ii", b, len(chunks)))
+                for c in chunks:
+                    f.write(struct.pack("<QQ", c[0], c[1]))
+            f.write(struct.pack("<i", len(ref["linear"])))
+            f.write(struct.pack("<%iQ" %len(ref["linear"]), *ref["linear"]))
+
+    return readTabixIndex(index_path)
+
+def readTabixIndex(index_path):
+    """
+    Reads a tabix index (.tbi).
+
+    :param index_path: /path/to/file.gz.tbi
+
+    :returns: a dictionary with the index configuration ('col_seq','col_beg','col_end','meta','skip','zero_based'),
+        the sequence 'names' and for each sequence name the linear index of virtual offsets in 'linear'
+    """
+    with gzip.open(index_path, "rb") as f:
+        data=f.read()
+    if data[:4] != b"TBI\x01":
+        raise ValueError("%s is not a tabix index" %index_path)
+    n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack("<iiiiiiii", data[4:36])
+    names=[ s.decode() for s in data[36:36+l_nm].split(b"\x00")[:-1] ]
+    pos=36+l_nm
+    linear={}
+    for name in names:
+        n_bin=struct.unpack("<i", data[pos:pos+4])[0]
+        pos=pos+4
+        for b in range(n_bin):
+            n_chunk=struct.unpack("<i", data[pos+4:pos+8])[0]
+            pos=pos+8+16*n_chunk
+        n_intv=struct.unpack("<i", data[pos:pos+4])[0]
+        linear[name]=struct.unpack("<%iQ" %n_intv, data[pos+4:pos+4+8*n_intv])
+        pos=pos+4+8*n_intv
+    return {"col_seq":col_seq, "col_beg":col_beg, "col_end":col_end, "meta":chr(meta), "skip":skip,
+            "zero_based":bool(fmt & _TBX_UCSC), "names":names, "linear":linear}
+
+def tabixQuery(file_path, seqname, start, end, index=None):
+    """
+    Retrieves the records of an indexed BGZF file overlapping a region without reading the rest of the file.
+
+    :param file_path: /path/to/file.gz with an index in /path/to/file.gz.tbi
+    :param seqname: sequence name
+    :param start: 1-based start of the region
+    :param end: 1-based, inclusive end of the region
+    :param index: an index as returned by readTabixIndex(). If None, it is read from file_path+'.tbi'
+
+    :returns: a list with the overlapping lines as bytes
+    """
+    if index is None:
+        index=readTabixIndex(file_path+".tbi")
+    seqname=str(seqname)
+    linear=index["linear"].get(seqname)
+    beg=max(int(start)-1, 0)
+    end=int(end)
+    if linear is None or len(linear) == 0 or end <= beg:
+        return []
+    window=min(beg >> 14, len(linear)-1)
+    records=[]
+    found=False
+    with BgzfReader(file_path) as reader:
+        reader.seek(linear[window])
+        for line in reader:
+            line=line.rstrip(b"\n")
+            if len(line) == 0 or line.startswith(index["meta"].encode()):
+                continue
+            s, b, e = _parseRecord(line, index)
+            if s != seqname:
+                if found:
+                    break
+                continue
+            found=True
+            if b >= end:
+                break
+            if e > beg:
+                records.append(line)
+    return records
@@ -0,0 +1,204 @@
+import os
+import mmap
+import shutil
+import struct
+import numpy as np
+from .fasta import readFai, _openFasta, _fetch, parseRegion
+
+_TWOBIT_SIGNATURE=0x1A412743
+
+# bases are packed as T=0, C=1, A=2, G=3, any other base is stored as T and listed in the N blocks
+_ENCODE=np.zeros(256, dtype=np.uint8)
+for _b, _c in zip(b"TCAGtcag", [0,1,2,3,0,1,2,3]):
+    _ENCODE[_b]=_c
+_IS_N=np.ones(256, dtype=bool)
+_IS_N[list(b"TCAGtcag")]=False
+_DECODE=np.frombuffer(b"TCAG", dtype=np.uint8)
+_SHIFTS=np.array([6,4,2,0], dtype=np.uint8)
+
+def _runs(mask):
+    """
+    Finds the runs of True values in a boolean array.
+
+    :returns: the starts and the sizes of the runs as uint32 arrays
+    """
+    edges=np.flatnonzero(np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8)))
+    starts=edges[::2]
+    return starts.astype(np.uint32), ( edges[1::2]-starts ).astype(np.uint32)
+
+def _packRecord(seq):
+    """
+    Encodes a sequence given as bytes into a .2bit record.
+
+    :returns: the record as bytes
+    """
+    arr=np.frombuffer(seq, dtype=np.uint8)
+    n_starts, n_sizes = _runs(_IS_N[arr])
+    m_starts, m_sizes = _runs(arr >= 97)
+    codes=_ENCODE[arr]
+    if len(codes)%4 > 0:
+        codes=np.concatenate([codes, np.zeros(4-len(codes)%4, dtype=np.uint8)])
+    packed=np.bitwise_or.reduce(codes.reshape(-1, 4) << _SHIFTS, axis=1).astype(np.uint8)
+    return b"".join([struct.pack("<II", len(arr), len(n_starts)), n_starts.astype("<u4").tobytes(), n_sizes.astype("<u4").tobytes(),
+                     struct.pack("<I", len(m_starts)), m_starts.astype("<u4").tobytes(), m_sizes.astype("<u4").tobytes(),
+                     struct.pack("<I", 0), packed.tobytes()])
+
+def fastaTO2bit(fasta, output_file):
+    """
+    Converts a multifasta file into the UCSC .2bit format: bases are packed 4 per byte
+    and runs of N and of soft masked (lower case) bases are kept in block tables.
+    A mammalian genome takes about a quarter of its fasta size and the file can be read by
+    UCSC tools (twoBitToFa, twoBitInfo) as well as by TwoBitReader.
+
+    :param fasta: /path/to/file.fa. The faidx index is built and written to fasta+'.fai' if it does not exist, or only kept in memory if fasta+'.fai' cannot be written.
+    :param output_file: /path/to/file.2bit to be written
+
+    :returns: a Pandas dataframe with the columns 'name','length' of the converted sequences
+    """
+    fai=readFai(fasta)
+    mm, index = _openFasta(fasta)
+    tmp=output_file+".%i.tmp" %os.getpid()
+    sizes=[]
+    try:
+        with open(tmp, "wb") as f:
+            for name in fai["name"].tolist():
+                entry=index[name]
+                record=_packRecord(_fetch(mm, entry, 0, entry[0]))
+                f.write(record)
+                sizes.append(len(record))
+    finally:
+        mm.close()
+    names=[ n.encode() for n in fai["name"].tolist() ]
+    for n in names:
+        if len(n) > 255:
+            os.remove(tmp)
+            raise ValueError("sequence names in .2bit files can not be longer than 255 characters: %s" %n.decode())
+    # version 1 uses 64 bit offsets for files larger than 4 GB
+    version=0
+    index_size=16+sum([ 1+len(n)+4 for n in names ])
+    if index_size+sum(sizes) > 0xffffffff:
+        version=1
+        index_size=16+sum([ 1+len(n)+8 for n in names ])
+    offsets=index_size+np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64) if len(sizes) > 0 else []
+    with open(output_file, "wb") as f:
+        f.write(struct.pack("<IIII", _TWOBIT_SIGNATURE, version, len(names), 0))
+        for n, o in zip(names, offsets):
+            f.write(struct.pack("<B", len(n))+n+struct.pack("<Q" if version == 1 else "<I", int(o)))
+        with open(tmp, "rb") as t:
+            shutil.copyfileobj(t, f, 16*1024*1024)
+    os.remove(tmp)
+    return fai[["name","length"]]
+
+class TwoBitReader(object):
+    """
+    Reads sequences from a .2bit file through a memory map. Only the bytes of the requested regions are read and
+    all processes reading the same file share one copy of it in the page cache. Readers can be passed to worker
+    processes, they reopen the file on unpickling.
+
+    :param file_path: /path/to/file.2bit
+
+    :returns: a reader with a 'lengths' dictionary of sequence names and lengths
+    """
+    def __init__(self, file_path):
+        self.file_path=file_path
+        with open(file_path, "rb") as f:
+            self.mm=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, version, count, reserved = struct.unpack("<IIII", self.mm[:16])
+        if signature != _TWOBIT_SIGNATURE:
+            raise ValueError("%s is not a .2bit file" %file_path)
+        offset_format="<Q" if version == 1 else "<I"
+        offset_size=struct.calcsize(offset_format)
+        self.offsets={}
+        self.lengths={}
+        self.records={}
+        pos=16
+        for i in range(count):
+            l=self.mm[pos]
+            name=self.mm[pos+1:pos+1+l].decode()
+            pos=pos+1+l
+            offset=struct.unpack(offset_format, self.mm[pos:pos+offset_size])[0]
+            pos=pos+offset_size
+            self.offsets[name]=offset
+            self.lengths[name]=struct.unpack("<I", self.mm[offset:offset+4])[0]
+
+    def _record(self, name):
+        """
+        Reads the N and mask block tables of a sequence.
+
+        :returns: the N block starts and ends, the mask block starts and ends and the offset of the packed bases
+        """
+        if name not in self.records:
+            pos=self.offsets[name]+4
+            blocks=[]
+            for i in range(2):
+                count=struct.unpack("<I", self.mm[pos:pos+4])[0]
+                starts=np.frombuffer(self.mm, dtype="<u4", count=count, offset=pos+4).astype(np.int64)
+                sizes=np.frombuffer(self.mm, dtype="<u4", count=count, offset=pos+4+4*count).astype(np.int64)
+                blocks.append((starts, starts+sizes))
+                pos=pos+4+8*count
+            self.records[name]=(blocks[0], blocks[1], pos+4)
+        return self.records[name]
+
+    def fetch(self, region, start=None, end=None, as_array=False, mask=True):
+        """
+        Retrieves a sequence or part of it.
+
+        :param region: the name of the sequence eg. '2' or a region eg. '2:82113225-82113284' (1-based, inclusive)
+        :param start: 1-based start of the region. Overwrites the start given in region.
+        :param end: 1-based, inclusive end of the region. Overwrites the end given in region.
+        :param as_array: logical, if True, a numpy uint8 array of ASCII codes is returned instead of a string
+        :param mask: logical, if False, soft masked bases are returned in upper case
+
+        :returns: the sequence of interest or None if the sequence is not present in the file
+        """
+        if region in self.lengths:
+            name, s, e = region, 0, None
+        else:
+            name, s, e = parseRegion(region)
+        if name not in self.lengths:
+            return None
+        if start is not None:
+            s=int(start)-1
+        if end is not None:
+            e=int(end)
+        length=self.lengths[name]
+        s=max(0, s)
+        e=length if e is None else min(length, e)
+        e=max(s, e)
+        (n_starts, n_ends), (m_starts, m_ends), dna = self._record(name)
+        packed=np.frombuffer(self.mm, dtype=np.uint8, count=(e+3)//4-s//4, offset=dna+s//4)
+        codes=( packed[:,None] >> _SHIFTS ) & 3
+        seq=_DECODE[codes.reshape(-1)[s%4:s%4+e-s]]
+        for starts, ends, masked in [(n_starts, n_ends, False), (m_starts, m_ends, True)]:
+            if masked and not mask:
+                continue
+            first=np.searchsorted(ends, s, side="right")
+            last=np.searchsorted(starts, e, side="left")
+            if last <= first:
+                continue
+            cover=np.zeros(e-s+1, dtype=np.int32)
+            np.add.at(cover, np.clip(starts[first:last], s, e)-s, 1)
+            np.add.at(cover, np.clip(ends[first:last], s, e)-s, -1)
+            cover=np.cumsum(cover[:-1]) > 0
+            if masked:
+                seq[cover]=seq[cover] | 32
+            else:
+                seq[cover]=78
+        if as_array:
+            return seq
+        return seq.tobytes().decode()
+
+    def close(self):
+        self.mm.close()
+
+    def __getstate__(self):
+        return {"file_path":self.file_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["file_path"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -22,10 +22,10 @@ setup(name = 'AGEpy',
       author_email = 'bioinformatics@age.mpg.de',
       license = 'MIT',
       packages = [ 'AGEpy' ],
-      install_requires = [ 'Pandas>=0.15.2', 'numpy>=1.9.2','requests>=2.20.0', \
+      install_requires = [ 'Pandas>=1.0.0', 'numpy>=1.9.2','requests>=2.20.0', \
       'suds', 'zeep', 'openpyxl','xlrd', 'biomart', 'matplotlib','pybedtools', \
       'xlsxwriter','wand','paramiko','ipaddress', 'seaborn', \
       'scipy', 'scikit-learn', 'statsmodels'],
       zip_safe = False,
-      scripts=['bin/obo2tsv','bin/aDiff','bin/abed','bin/david', 'bin/blasto', 'bin/QC_plots', 'bin/genomes']
+      scripts=['bin/obo2tsv','bin/aDiff','bin/abed','bin/david', 'bin/blasto', 'bin/QC_plots', 'bin/genomes', 'bin/gtfindex']
       )
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pysam
+from AGEpy.bam import readBAMchunks, readBAMindex, fetchBAM
+
+HEADER="@HD\tVN:1.6\tSO:unsorted\n@SQ\tSN:chr1\tLN:200000\n@SQ\tSN:chr2\tLN:100000\n@SQ\tSN:chr3\tLN:1000\n"
+
+def _write(tmp_path, n=3000):
+    rng=np.random.default_rng(0)
+    lines=[]
+    for i in range(n):
+        flag=int(rng.choice([0,16,99,147,256,1024,2048,4]))
+        cigar=str(rng.choice(["30M","10M500N20M","5S25M","3M1I26M","10M4D20M","30M5H"]))
+        a=pysam.AlignedSegment()
+        a.cigarstring=cigar
+        length=a.infer_query_length()
+        seq="".join(rng.choice(list("ACGTN"), length))
+        qual="".join(rng.choice(list("#5<FI"), length)) if rng.random() < 0.8 else "*"
+        tags=[]
+        if rng.random() < 0.8:
+            tags.append("NH:i:%i" %rng.integers(1, 4))
+        if rng.random() < 0.5:
+            tags.append("XS:A:%s" %rng.choice(["+","-"]))
+        if rng.random() < 0.3:
+            tags.append("AS:i:%i" %rng.integers(-70000, 70000))
+        if rng.random() < 0.3:
+            tags.append("MD:Z:%i" %rng.integers(0, 30))
+        if rng.random() < 0.2:
+            tags.append("ZB:B:s,%s" %",".join([ str(v) for v in rng.integers(-300, 300, 3) ]))
+        if rng.random() < 0.2:
+            tags.append("ZH:H:%s" %rng.choice(["1AE301","00FF"]))
+        if flag & 4:
+            fields=["u%i" %i, str(flag), "*", "0", "0", "*", "*", "0", "0", seq if seq else "*", qual]
+        else:
+            rname=str(rng.choice(["chr1","chr1","chr2"]))
+            fields=["r%i" %i, str(flag), rname, str(rng.integers(1, 190000 if rname == "chr1" else 90000)), str(rng.integers(0, 61)),
+                    cigar, str(rng.choice(["=","chr2"])), str(rng.integers(1, 90000)), str(rng.integers(-500, 500)), seq, qual]
+        lines.append("\t".join(fields+tags)+"\n")
+    sam=tmp_path/"sample.sam"
+    sam.write_text(HEADER+"".join(lines))
+    bam=str(tmp_path/"sample.bam")
+    pysam.sort("-o", bam, str(sam))
+    pysam.index(bam)
+    return bam
+
+def _rows(sam):
+    return [ [ str(v) for v in row[:11] ]+( row[11].decode().split("\t") if len(row[11]) > 0 else [] ) for row in sam.itertuples(index=False) ]
+
+def _pysamRows(alignments):
+    return [ a.to_string().split("\t") for a in alignments ]
+
+def test_readBAMchunks_matches_pysam(tmp_path):
+    bam=_write(tmp_path)
+    with pysam.AlignmentFile(bam, "rb") as f:
+        reference=_pysamRows(f)
+        header=str(f.header)
+    for chunksize, n_threads in [(200000,1),(333,1),(100,2)]:
+        head, chunks = readBAMchunks(bam, chunksize=chunksize, header=True, tags=["NH","AS"], n_threads=n_threads)
+        assert "".join(head) == header
+        chunks=list(chunks)
+        assert max([ len(c) for c in chunks ]) <= chunksize
+        sam=pd.concat(chunks)
+        assert sam.index.tolist() == list(range(len(reference)))
+        assert _rows(sam) == reference
+        assert sam["NH"].dtype == "Int64"
+        nh=[ int(t[5:]) if t is not None else None for t in [ next(( t for t in r[11:] if t.startswith("NH:i:") ), None) for r in reference ] ]
+        assert [ None if pd.isna(v) else int(v) for v in sam["NH"] ] == nh
+
+def test_fetchBAM_matches_pysam(tmp_path):
+    bam=_write(tmp_path)
+    index=readBAMindex(bam+".bai")
+    rng=np.random.default_rng(1)
+    regions=[ ("chr1", 1, 200000), ("chr2", 1, 100000), ("chr3", 1, 1000), ("chr1", 16384, 16384), ("chr1", 199990, 200000) ]
+    regions+=[ (str(c), int(s), int(s+rng.integers(0, 40000))) for c, s in zip(rng.choice(["chr1","chr2"], 40), rng.integers(1, 100000, 40)) ]
+    with pysam.AlignmentFile(bam, "rb") as f:
+        for seqname, start, end in regions:
+            reference=_pysamRows(f.fetch(seqname, start-1, end))
+            sam=fetchBAM(bam, seqname, start, end, tags=["NH"], index=index, chunksize=50)
+            assert sam.index.tolist() == list(range(len(reference)))
+            assert _rows(sam) == reference, (seqname, start, end)
+    assert len(fetchBAM(bam, "chrX", 1, 1000)) == 0
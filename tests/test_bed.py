@@ -0,0 +1,24 @@
+import warnings
+import pandas as pd
+from AGEpy.bed import AnnotateBED
+
+GTF=[ ["chr1","test","gene",1101,1400,".","+",".",'gene_id "g1"; gene_name "G1";'],
+      ["chr1","test","transcript",1101,1400,".","+",".",'gene_id "g1"; transcript_id "t1"; gene_name "G1";'],
+      ["chr1","test","exon",1101,1200,".","+",".",'gene_id "g1"; transcript_id "t1"; gene_name "G1";'] ]
+
+def test_AnnotateBED(tmp_path):
+    gtf=tmp_path/"test.gtf"
+    gtf.write_text("".join([ "\t".join(map(str, l))+"\n" for l in GTF ]))
+    genome=tmp_path/"test.genome"
+    genome.write_text("chr1\t5000\n")
+    bed=pd.DataFrame({"chrom":["chr1","chr1","chr1"],"start":[1150,1350,4000],"end":[1160,1360,4010]})
+    with warnings.catch_warnings():
+        if hasattr(pd.errors, "SettingWithCopyWarning"):
+            warnings.filterwarnings("error", message=".*gene_name_.*", category=pd.errors.SettingWithCopyWarning)
+        df=AnnotateBED(bed, str(gtf), str(genome))
+    df=df.sort_values("start").reset_index(drop=True)
+    # intervals without annotation are dropped by the grouping of the features
+    assert df["start"].tolist() == [1150,1350]
+    assert set(df.loc[0,"annotated_gene_features"].split(": ")[1].split(", ")) == {"exon","promoter"}
+    assert df.loc[0,"annotated_gene_features"].startswith("G1/g1")
+    assert df.loc[1,"annotated_gene_features"] == "G1/g1"
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from AGEpy.cache import readCache, writeCache
+
+def test_cache_round_trip(tmp_path):
+    df=pd.DataFrame({"start":np.array([1,2,3], dtype=np.int32),
+                     "score":[0.5,np.nan,1.0],
+                     "seqname":pd.Categorical(["1","1","X"]),
+                     "gene_name":["a",None,"c"],
+                     "exon_number":pd.array([1,None,3], dtype="Int64"),
+                     "basic":pd.array([True,None,False], dtype="boolean")})
+    writeCache(df, "key", {"path":"test.gtf"}, cache_folder=str(tmp_path))
+    cached=readCache("key", cache_folder=str(tmp_path))
+    pd.testing.assert_frame_equal(cached, df)
+
+def test_cache_miss(tmp_path):
+    assert readCache("missing", cache_folder=str(tmp_path)) is None
+
+def test_readGTF_file_object_is_not_cached(tmp_path, monkeypatch):
+    import io
+    from AGEpy.gtf import readGTF
+    monkeypatch.setenv("AGEPY_CACHE", str(tmp_path))
+    text=b'1\ttest\texon\t11\t20\t.\t+\t.\tgene_id "g1";\n'
+    gtf=readGTF(io.BytesIO(text))
+    assert len(gtf) == 1
+    assert list(tmp_path.iterdir()) == []
+
+def test_readGTF_cache_hit(tmp_path, monkeypatch):
+    from AGEpy.gtf import readGTF
+    path=tmp_path/"test.gtf"
+    path.write_text('1\ttest\texon\t11\t20\t.\t+\t.\tgene_id "g1";\n')
+    cache=tmp_path/"cache"
+    monkeypatch.setenv("AGEPY_CACHE", str(cache))
+    first=readGTF(str(path), parse=True)
+    assert len(list(cache.iterdir())) == 2
+    pd.testing.assert_frame_equal(readGTF(str(path), parse=True), first)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pysam
+from AGEpy.cigar import parseCIGAR, CIGARstats, alignedBlocks
+
+CIGARS=["10M","5M100N5M","3S7M","7M3S","2H3S5M2S1H","2M1I7M","4M2D6M","5=1X4=","3M2P1I4M","10M5H","*","1S2I3M"]
+
+def _segment(cigar, pos):
+    a=pysam.AlignedSegment()
+    a.cigarstring=cigar
+    a.reference_start=pos-1
+    return a
+
+def test_parseCIGAR_matches_pysam():
+    cigar=pd.Series(CIGARS*3)
+    ops=parseCIGAR(cigar)
+    expected=[ (i, op, length) for i, c in enumerate(cigar) if c != "*" for op, length in _segment(c, 1).cigartuples ]
+    assert list(zip(ops["read"], ops["op"], ops["length"])) == expected
+
+def test_CIGARstats_matches_pysam():
+    cigar=pd.Series(CIGARS, index=np.arange(len(CIGARS))*2)
+    stats=CIGARstats(cigar)
+    assert stats.index.tolist() == cigar.index.tolist()
+    for c, row in zip(CIGARS, stats.itertuples(index=False)):
+        if c == "*":
+            assert set(row) == {0}
+            continue
+        a=_segment(c, 1)
+        tuples=a.cigartuples
+        clips=[ t for t in tuples if t[0] != 5 ]
+        assert row.reference_length == a.reference_length
+        assert row.query_length == a.infer_query_length()
+        assert row.aligned_length == sum([ l for op, l in tuples if op in [0,7,8] ])
+        assert row.soft_clip_left == ( clips[0][1] if clips[0][0] == 4 else 0 )
+        assert row.soft_clip_right == ( clips[-1][1] if clips[-1][0] == 4 and len(clips) > 1 else 0 )
+        for name, op in [("hard_clip",5), ("insertions",1), ("deletions",2), ("skipped",3)]:
+            assert getattr(row, name) == sum([ l for o, l in tuples if o == op ])
+
+def test_alignedBlocks_matches_pysam():
+    pos=np.arange(len(CIGARS))*10+1
+    blocks=alignedBlocks(pos, CIGARS)
+    expected=[]
+    for i, (c, p) in enumerate(zip(CIGARS, pos)):
+        if c == "*":
+            continue
+        # pysam reports the blocks around an insertion separately
+        merged=[]
+        for s, e in _segment(c, p).get_blocks():
+            if merged and merged[-1][1] == s:
+                merged[-1][1]=e
+            else:
+                merged.append([s, e])
+        expected+=[ (i, s, e) for s, e in merged ]
+    assert list(zip(blocks["read"], blocks["start"], blocks["end"])) == expected
+
+def test_empty():
+    assert len(parseCIGAR([])) == 0
+    assert len(CIGARstats(pd.Series([], dtype=object))) == 0
+    assert len(alignedBlocks(np.array([], dtype=np.int64), [])) == 0
+    assert len(alignedBlocks(np.array([1]), ["*"])) == 0
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from AGEpy.composition import kmerNames, sequenceComposition
+
+def _reverseComplement(seq):
+    complement=dict(zip("ACGTNacgtn", "TGCANtgcan"))
+    return "".join([ complement[b] for b in reversed(seq) ])
+
+def _reference(seq, k):
+    # per interval reference with str.count and a sliding window
+    upper=seq.upper()
+    counts={ b:upper.count(b) for b in "ACGT" }
+    acgt=sum(counts.values())
+    res={"length":len(seq), "N":len(seq)-acgt, "CpG":sum([ upper[i:i+2] == "CG" for i in range(len(seq)-1) ])}
+    res.update(counts)
+    res["GC content"]=( counts["C"]+counts["G"] )/acgt if acgt > 0 else np.nan
+    res["CpG o/e"]=res["CpG"]*acgt/( counts["C"]*counts["G"] ) if counts["C"]*counts["G"] > 0 else np.nan
+    for kmer in kmerNames(k):
+        res[kmer]=sum([ upper[i:i+k] == kmer for i in range(len(seq)-k+1) ])
+    return res
+
+def test_kmerNames():
+    assert kmerNames(1) == ["A","C","G","T"]
+    assert kmerNames(2)[:5] == ["AA","AC","AG","AT","CA"]
+    assert len(kmerNames(3)) == 64
+
+def test_sequenceComposition_matches_reference(tmp_path):
+    rng=np.random.default_rng(0)
+    seqs={"1":"".join(rng.choice(list("ACGTacgtN"), 500)), "2":"CGCGCGNNNNacgt"*5}
+    fasta=tmp_path/"genome.fa"
+    fasta.write_text("".join([ ">%s\n%s\n" %(name, "\n".join([ seq[i:i+60] for i in range(0, len(seq), 60) ])) for name, seq in seqs.items() ]))
+    chrom=rng.choice(["1","2","Y"], 50)
+    start=rng.integers(0, 60, 50)
+    bed=pd.DataFrame({"chrom":chrom, "start":start, "end":start+rng.integers(0, 40, 50), "name":"x", "score":0,
+                      "strand":rng.choice(["+","-"], 50)})
+    for k, n_jobs, chunksize in [(None,1,10000),(1,1,10000),(2,1,7),(3,2,20)]:
+        df=sequenceComposition(bed, str(fasta), k=k, n_jobs=n_jobs, chunksize=chunksize)
+        columns=['length','A','C','G','T','N','GC content','CpG','CpG o/e']+( kmerNames(k) if k and k > 1 else [] )
+        # k-mer columns do not repeat the base and GC content columns
+        assert df.columns.is_unique
+        assert df.columns.tolist() == columns
+        assert df.index.tolist() == bed.index.tolist()
+        for i, r in bed.iterrows():
+            if r["chrom"] not in seqs:
+                assert df.loc[i].isnull().all()
+                continue
+            seq=seqs[r["chrom"]][r["start"]:r["end"]]
+            if r["strand"] == "-":
+                seq=_reverseComplement(seq)
+            expected=_reference(seq, k or 1)
+            np.testing.assert_allclose(df.loc[i].to_numpy(dtype=float), [ expected[c] for c in columns ], equal_nan=True)
@@ -0,0 +1,62 @@
+import numpy as np
+from AGEpy.gtf import readGTF
+from AGEpy.counts import countReads
+
+GTF=[ ["chr1","test","exon",101,200,".","+",".",'gene_id "g1"; transcript_id "t1";'],
+      ["chr1","test","exon",301,400,".","+",".",'gene_id "g1"; transcript_id "t1";'],
+      ["chr2","test","exon",101,200,".","-",".",'gene_id "g2"; transcript_id "t2";'] ]
+
+def _write(tmp_path, reads):
+    gtf=tmp_path/"test.gtf"
+    gtf.write_text("".join([ "\t".join(map(str, l))+"\n" for l in GTF ]))
+    sam=tmp_path/"sample.sam"
+    header="@SQ\tSN:chr1\tLN:10000\n@SQ\tSN:chr2\tLN:10000\n"
+    sam.write_text(header+"".join([ "r%i\t%i\t%s\t%i\t60\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\n" %(i, flag, seq, pos) for i, (flag, seq, pos) in enumerate(reads) ]))
+    return str(sam), readGTF(str(gtf))
+
+def test_countReads_assigns_reads(tmp_path):
+    sam, gtf = _write(tmp_path, [(0,"chr1",150), (0,"chr1",350), (16,"chr2",150), (0,"chr1",5000)])
+    counts, summary = countReads(sam, gtf, summary=True)
+    assert counts["gene_id"].tolist() == ["g1","g2"]
+    assert counts["length"].tolist() == [200,100]
+    assert counts["sample"].tolist() == [2,1]
+    assert summary.loc["Assigned","sample"] == 3
+    assert summary.loc["Unassigned_NoFeatures","sample"] == 1
+
+def test_countReads_shard_without_features(tmp_path):
+    # all reads of the chr1 shard are intergenic
+    sam, gtf = _write(tmp_path, [(0,"chr1",5000)])
+    counts, summary = countReads(sam, gtf, summary=True)
+    assert np.all(counts["sample"] == 0)
+    assert summary.loc["Unassigned_NoFeatures","sample"] == 1
+
+def test_countReads_stranded_shard_without_features(tmp_path):
+    # reverse stranded: the reverse read is on the plus strand of chr1, where it overlaps no feature
+    sam, gtf = _write(tmp_path, [(16,"chr1",5000), (0,"chr2",150)])
+    counts, summary = countReads(sam, gtf, stranded=2, summary=True)
+    assert counts["sample"].tolist() == [0,1]
+    assert summary.loc["Unassigned_NoFeatures","sample"] == 1
+
+def test_countReads_stranded_many_contigs(tmp_path):
+    # 130 contigs in the header, 100 with reads: the chunk's RNAME categories have int8 codes, too narrow for the shard keys
+    contigs=[ "c%03i" %i for i in range(130) ]
+    gtf=tmp_path/"many.gtf"
+    gtf.write_text("c000\ttest\texon\t101\t200\t.\t+\t.\tgene_id \"gA\";\n"+
+                   "c086\ttest\texon\t101\t200\t.\t-\t.\tgene_id \"gB\";\n")
+    sam=tmp_path/"many.sam"
+    sam.write_text("".join([ "@SQ\tSN:%s\tLN:10000\n" %c for c in contigs ])+
+                   "".join([ "r%i\t0\t%s\t1\t60\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\n" %(i, c) for i, c in enumerate(contigs[:100]) ])+
+                   "a\t0\tc000\t150\t60\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\n"+
+                   "b\t16\tc086\t150\t60\t10M\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII\n")
+    counts=countReads(str(sam), readGTF(str(gtf)), stranded=1)
+    assert counts["many"].tolist() == [1,1]
+
+def test_countReads_multimapping(tmp_path):
+    sam, gtf = _write(tmp_path, [(0,"chr1",150)])
+    text=open(sam).read().rstrip("\n")+"\tNH:i:2\n"
+    open(sam, "w").write(text)
+    for skip in [False, 0, np.False_]:
+        assert countReads(sam, gtf)["sample"].tolist() == [0,0]
+        assert countReads(sam, gtf, multimapping=skip)["sample"].tolist() == [0,0]
+    assert countReads(sam, gtf, multimapping=True)["sample"].tolist() == [1,0]
+    assert countReads(sam, gtf, multimapping="fraction")["sample"].tolist() == [0.5,0]
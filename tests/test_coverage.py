@@ -0,0 +1,69 @@
+import numpy as np
+import pysam
+from AGEpy.coverage import SAMcoverage, SAMtoBedGraph
+
+HEADER="@HD\tVN:1.6\tSO:unsorted\n@SQ\tSN:chr1\tLN:3000\n@SQ\tSN:chr2\tLN:2000\n@SQ\tSN:chr3\tLN:1000\n"
+
+def _queryLength(cigar):
+    a=pysam.AlignedSegment()
+    a.cigarstring=cigar
+    return a.infer_query_length()
+
+def _write(tmp_path):
+    rng=np.random.default_rng(0)
+    lines=[]
+    for i in range(400):
+        flag=int(rng.choice([0,16,0,16,256,1024,4,512]))
+        cigar=str(rng.choice(["20M","10M100N10M","5S15M","8M2D12M","10M2I8M","5M5H"]))
+        length=_queryLength(cigar)
+        lines.append("r%i\t%i\t%s\t%i\t%i\t%s\t*\t0\t0\t%s\t%s\n" %(i, flag, rng.choice(["chr1","chr2"]), rng.integers(1, 1800), rng.integers(0, 61), cigar, "A"*length, "I"*length))
+    sam=tmp_path/"sample.sam"
+    sam.write_text(HEADER+"".join(lines))
+    bam=str(tmp_path/"sample.bam")
+    pysam.sort("-o", bam, str(sam))
+    pysam.index(bam)
+    sorted_sam=tmp_path/"sorted.sam"
+    sorted_sam.write_text(pysam.view("-h", bam))
+    return str(sam), bam, str(sorted_sam)
+
+def _samtoolsDepth(bam, *args):
+    # samtools depth lists the positions with depth, and some without within deletions and skipped regions
+    depth={}
+    for line in pysam.depth(*args, bam).splitlines():
+        name, pos, d = line.split("\t")
+        if int(d) > 0:
+            depth.setdefault(name, {})[int(pos)-1]=int(d)
+    return depth
+
+def _nonZero(coverage):
+    return { name:{ int(p):int(d[p]) for p in np.flatnonzero(d) } for name, d in coverage.items() }
+
+def test_SAMcoverage_matches_samtools_depth(tmp_path):
+    sam, bam, sorted_sam = _write(tmp_path)
+    for path, chunksize in [(sam,1000),(sam,37),(sorted_sam,29)]:
+        coverage=SAMcoverage(path, chunksize=chunksize)
+        assert set(coverage) == {"chr1","chr2"}
+        assert len(coverage["chr1"]) == 3000
+        assert _nonZero(coverage) == _samtoolsDepth(bam)
+        assert _nonZero(SAMcoverage(path, min_mapq=30, chunksize=chunksize)) == _samtoolsDepth(bam, "-Q", "30")
+    assert list(SAMcoverage(sam, seqnames=["chr2"])) == ["chr2"]
+    plus=SAMcoverage(sam, strand="+")
+    minus=SAMcoverage(sam, strand="-")
+    total=SAMcoverage(sam)
+    for name in total:
+        assert np.array_equal(plus[name]+minus[name], total[name])
+
+def test_SAMtoBedGraph(tmp_path):
+    sam, bam, sorted_sam = _write(tmp_path)
+    coverage=SAMcoverage(sam)
+    out=str(tmp_path/"sample.bedGraph")
+    n=SAMtoBedGraph(sorted_sam, out, chunksize=29)
+    lines=open(out).read().splitlines()
+    assert len(lines) == n
+    depth={ name:np.zeros(len(d), dtype=np.int32) for name, d in coverage.items() }
+    for line in lines:
+        name, start, end, value = line.split("\t")
+        assert int(value) > 0
+        depth[name][int(start):int(end)]=int(value)
+    for name in coverage:
+        assert np.array_equal(depth[name], coverage[name])
@@ -0,0 +1,140 @@
+import gzip
+import shutil
+import numpy as np
+import pandas as pd
+import pysam
+from AGEpy.fasta import reverseComplement, fetchFastaIntervals, writeFasta, writeFastaRecords, indexFasta, readFai, fetchFasta, rewriteFasta, rewriteFastaRecords
+
+SEQS=[ ("1", "ACGTACGTAC"*13+"ACG"),
+       ("2", "GGGCCCAAATTT"*5),
+       ("X", "N"*60),
+       ("MT", "ACGT") ]
+
+def _write(tmp_path, width=60, name="genome.fa", seqs=SEQS):
+    fasta=tmp_path/name
+    text=""
+    for seqname, seq in seqs:
+        text+=">%s description\n" %seqname
+        text+="".join([ seq[i:i+width]+"\n" for i in range(0, len(seq), width) ])
+    fasta.write_text(text)
+    return str(fasta)
+
+def test_indexFasta_matches_samtools(tmp_path):
+    # samtools leaves empty sequences out
+    seqs=SEQS[:2]+[("empty", "")]+SEQS[2:]
+    for width in [7,60]:
+        fasta=_write(tmp_path, width=width, name="a%i.fa" %width, seqs=seqs)
+        ref=_write(tmp_path, width=width, name="b%i.fa" %width, seqs=seqs)
+        indexFasta(fasta)
+        pysam.faidx(ref)
+        assert open(fasta+".fai").read() == open(ref+".fai").read()
+
+def test_fetchFasta_matches_pysam(tmp_path):
+    fasta=_write(tmp_path, width=7)
+    ref=pysam.FastaFile(fasta)
+    for seqname, seq in SEQS:
+        assert fetchFasta(fasta, seqname) == ref.fetch(seqname) == seq
+        for start, end in [(1,1),(3,9),(7,8),(max(1,len(seq)-4),len(seq))]:
+            region="%s:%i-%i" %(seqname, start, end)
+            assert fetchFasta(fasta, region) == ref.fetch(region=region) == seq[start-1:end]
+    assert fetchFasta(fasta, "Y") is None
+
+def test_readFai_read_only(tmp_path, monkeypatch):
+    # an index that cannot be written is kept in memory
+    fasta=_write(tmp_path)
+    def deny(*args, **kwargs):
+        raise PermissionError("read-only")
+    monkeypatch.setattr(pd.DataFrame, "to_csv", deny)
+    fai=readFai(fasta)
+    assert fai["name"].tolist() == [ s[0] for s in SEQS ]
+    assert fai["length"].tolist() == [ len(s[1]) for s in SEQS ]
+    assert fetchFasta(fasta, "2:4-6") == "CCC"
+    assert not (tmp_path/"genome.fa.fai").exists()
+
+def _records(text):
+    # header and sequence of each record of a fasta text
+    records=[]
+    for record in text.split(">")[1:]:
+        header, _, seq = record.partition("\n")
+        records.append((header, seq.replace("\n", "")))
+    return records
+
+def test_rewriteFastaRecords(tmp_path):
+    fasta=_write(tmp_path, width=7)
+    for buffer_size in [3,16,1024]:
+        out=str(tmp_path/("out%i.fa" %buffer_size))
+        # sequences can be given in pieces
+        records={"2":"TTTTAAAACCCC"*3, "MT":iter(["AC","GT","A"])}
+        assert rewriteFastaRecords(records, fasta, out, width=10, buffer_size=buffer_size) == ["2","MT"]
+        text=open(out).read()
+        expected=[ ("%s description" %name, {"2":"TTTTAAAACCCC"*3, "MT":"ACGTA"}.get(name, seq)) for name, seq in SEQS ]
+        assert _records(text) == expected
+        # untouched records are copied as they are
+        assert text.split(">")[1] == open(fasta).read().split(">")[1]
+        assert "\nTTTTAAAACC\nCCTTTTAAAA\n" in text
+
+def test_rewriteFasta(tmp_path):
+    fasta=_write(tmp_path)
+    out=str(tmp_path/"out.fa")
+    rewriteFasta("ACGT"*20, 1, fasta, out)
+    assert pysam.FastaFile(out).fetch("1") == "ACGT"*20
+    assert pysam.FastaFile(out).fetch("X") == "N"*60
+
+def test_writeFastaRecords_matches_samtools(tmp_path):
+    records=SEQS[:2]+[("empty", "")]+SEQS[2:]
+    for name in ["out.fa","out.fa.gz"]:
+        out=str(tmp_path/name)
+        writeFastaRecords(records, out, width=7, index=True)
+        # samtools faidx of the same file
+        ref=str(tmp_path/("ref_"+name))
+        shutil.copy(out, ref)
+        pysam.faidx(ref)
+        assert open(out+".fai").read() == open(ref+".fai").read()
+        if name.endswith(".gz"):
+            assert open(out+".gzi", "rb").read() == open(ref+".gzi", "rb").read()
+            text=gzip.open(out, "rt").read()
+        else:
+            text=open(out).read()
+        assert _records(text) == records
+        fasta=pysam.FastaFile(out)
+        for seqname, seq in SEQS:
+            assert fasta.fetch(seqname) == seq
+
+def test_writeFasta(tmp_path):
+    out=str(tmp_path/"out.fa")
+    writeFasta("ACGT"*40, "chr1 test", out)
+    assert open(out).read() == ">chr1 test\n"+"ACGT"*15+"\n"+"ACGT"*15+"\n"+"ACGT"*10+"\n"
+
+def _reverseComplementReference(seq):
+    complement=dict(zip("ACGTNacgtnRY", "TGCANtgcanYR"))
+    return "".join([ complement[b] for b in reversed(seq) ])
+
+def test_reverseComplement():
+    seq="ACGTNacgtnRYAAC"
+    assert reverseComplement(seq) == _reverseComplementReference(seq)
+    assert reverseComplement(seq.encode()) == _reverseComplementReference(seq).encode()
+    assert reverseComplement("") == ""
+
+def test_fetchFastaIntervals_matches_pysam(tmp_path):
+    fasta=_write(tmp_path, width=7)
+    ref=pysam.FastaFile(fasta)
+    rng=np.random.default_rng(0)
+    chrom=rng.choice(["1","2","MT","Y"], 200)
+    start=rng.integers(0, 130, 200)
+    bed=pd.DataFrame({"chrom":chrom, "start":start, "end":start+rng.integers(0, 30, 200),
+                      "name":"x", "score":0, "strand":rng.choice(["+","-"], 200)},
+                     index=np.arange(200)[::-1])
+    expected=[]
+    for c, s, e, strand in zip(bed["chrom"], bed["start"], bed["end"], bed["strand"]):
+        if c not in ref.references:
+            expected.append(None)
+            continue
+        seq=ref.fetch(c, min(s, ref.get_reference_length(c)), min(e, ref.get_reference_length(c)))
+        expected.append(_reverseComplementReference(seq) if strand == "-" else seq)
+    for n_jobs, chunksize in [(1,100000),(1,3),(2,20)]:
+        seqs=fetchFastaIntervals(bed, fasta, n_jobs=n_jobs, chunksize=chunksize)
+        assert seqs.index.tolist() == bed.index.tolist()
+        assert seqs.tolist() == expected
+    # few intervals over a long sequence are read one by one
+    sparse=pd.DataFrame({"chrom":["1","1"], "start":[0,130], "end":[2,133]})
+    assert fetchFastaIntervals(sparse, fasta).tolist() == [ref.fetch("1", 0, 2), ref.fetch("1", 130, 133)]
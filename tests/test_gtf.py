@@ -0,0 +1,197 @@
+import gzip
+import numpy as np
+import pysam
+import pandas as pd
+from AGEpy.gtf import indexGTF, queryGTF, getPromotersBed, writeGTF, readGTF, parseGTF, _tokenizeGTF, retrieve_GTF_field, attributesGTF, MAPGenoToTrans, GetTransPosition, intervalsGenoToTrans, GenoToTransPositions, TransToGenoPositions
+
+GTF=[ ["chr1","test","gene",101,400,".","+",".",'gene_id "g1"; gene_name "G1";'],
+      ["chr1","test","transcript",101,400,".","+",".",'gene_id "g1"; transcript_id "t1"; tag "basic"; tag "CCDS";'],
+      ["chr1","test","exon",101,200,".","+",".",'gene_id "g1"; transcript_id "t1"; exon_number 1;'],
+      ["chr1","test","exon",301,400,".","+",".",'gene_id "g1"; transcript_id "t1"; exon_number 2;'],
+      ["chr2","test","gene",101,200,".","-",".",'gene_id "g2";'],
+      ["chr2","test","exon",301,350,".","-",".",'gene_id "g2"; transcript_id "t2"; exon_number 1;'],
+      ["chr2","test","exon",101,200,".","-",".",'gene_id "g2"; transcript_id "t2"; exon_number 2;'] ]
+
+def _write(tmp_path, lines=GTF):
+    gtf=tmp_path/"test.gtf"
+    gtf.write_text("#!genome-build test\n"+"".join([ "\t".join(map(str, l))+"\n" for l in lines ]))
+    return str(gtf)
+
+def _parseReference(attribute):
+    # row by row reference, the last value of repeated attributes is kept
+    rows=[]
+    for a in attribute:
+        row={}
+        for pair in a.split(";"):
+            pair=pair.strip()
+            if pair:
+                k, v = pair.split(" ",1)
+                row[k]=v.strip('"')
+        rows.append(row)
+    return rows
+
+def test_parseGTF_matches_reference(tmp_path):
+    gtf=readGTF(_write(tmp_path))
+    parsed=parseGTF(gtf)
+    assert list(parsed.columns[:8]) == ["seqname","source","feature","start","end","score","strand","frame"]
+    assert list(parsed.columns[8:]) == ["gene_id","gene_name","transcript_id","tag","exon_number"]
+    for i, row in enumerate(_parseReference(gtf["attribute"])):
+        for field in parsed.columns[8:]:
+            if field in row:
+                assert parsed.loc[i, field] == row[field]
+            else:
+                assert pd.isnull(parsed.loc[i, field])
+
+def test_tokenizeGTF_blocks():
+    # tokenizing in small row blocks gives the same tokens as a single block
+    attribute=pd.Series([ l[8] for l in GTF ]*5)
+    one=_tokenizeGTF(attribute, block=len(attribute))
+    for block in [1,4,7]:
+        blocks=_tokenizeGTF(attribute, block=block)
+        for a, b in zip(one, blocks):
+            assert np.array_equal(a, b)
+    rows, keys, values = _tokenizeGTF(attribute, fields=["transcript_id"], block=4)
+    assert set(keys) == {"transcript_id"}
+    assert rows.tolist() == [ i for i in range(len(attribute)) if "transcript_id" in attribute[i] ]
+
+def test_tokenizeGTF_empty():
+    rows, keys, values = _tokenizeGTF(pd.Series([], dtype=object))
+    assert len(rows) == len(keys) == len(values) == 0
+
+def _basesReference(parsed):
+    # per base reference: all bases of the exons of each transcript in transcript order
+    bases={}
+    exons=parsed[parsed["feature"] == "exon"]
+    for t, df in exons.groupby("transcript_id"):
+        minus=df["strand"].iloc[0] == "-"
+        df=df.sort_values("start", ascending=not minus)
+        bases[t]=[ p for s, e in zip(df["start"], df["end"]) for p in ( range(e, s-1, -1) if minus else range(s, e+1) ) ]
+    return bases
+
+def test_MAPGenoToTrans_matches_reference(tmp_path):
+    parsed=parseGTF(readGTF(_write(tmp_path)))
+    reference=_basesReference(parsed)
+    GtoT=MAPGenoToTrans(parsed, "exon")
+    assert GtoT == { t:",".join(map(str, b)) for t, b in reference.items() }
+
+def test_GetTransPosition(tmp_path):
+    parsed=parseGTF(readGTF(_write(tmp_path)))
+    reference=_basesReference(parsed)
+    df=pd.DataFrame({"transcript_id":["t1","t1","t1","t2","t2","t2","t3"],
+                     "target":[101,250,400,350,101,250,101]})
+    expected=[ reference[t].index(p)+1 if p in reference.get(t, []) else np.nan for t, p in zip(df["transcript_id"], df["target"]) ]
+    for dic in [intervalsGenoToTrans(parsed, "exon"), MAPGenoToTrans(parsed, "exon")]:
+        np.testing.assert_array_equal(GetTransPosition(df, "target", dic), expected)
+        np.testing.assert_array_equal(df.apply(GetTransPosition, args=("target", dic), axis=1).to_numpy(dtype=float), expected)
+
+def test_TransToGenoPositions_round_trip(tmp_path):
+    parsed=parseGTF(readGTF(_write(tmp_path)))
+    tmap=intervalsGenoToTrans(parsed, "exon")
+    for t, bases in _basesReference(parsed).items():
+        positions=np.arange(1, len(bases)+1)
+        genome=TransToGenoPositions(tmap, [t]*len(bases), positions)
+        assert genome.tolist() == bases
+        assert GenoToTransPositions(tmap, [t]*len(bases), bases).tolist() == positions.tolist()
+    assert np.isnan(TransToGenoPositions(tmap, ["t1"], [10000])[0])
+
+def test_retrieve_GTF_field(tmp_path):
+    gtf=readGTF(_write(tmp_path))
+    reference=_parseReference(gtf["attribute"])
+    fields=retrieve_GTF_field(["transcript_id","gene_id","missing"], gtf)
+    assert fields.columns.tolist() == ["transcript_id","gene_id","missing"]
+    assert fields["gene_id"].tolist() == [ r["gene_id"] for r in reference ]
+    assert [ None if pd.isnull(v) else v for v in fields["transcript_id"] ] == [ r.get("transcript_id") for r in reference ]
+    assert fields["missing"].isnull().all()
+    assert retrieve_GTF_field("gene_id", gtf).columns.tolist() == ["gene_id"]
+    assert attributesGTF(gtf) == ["gene_id","gene_name","transcript_id","tag","exon_number"]
+
+def test_readGTF_filters(tmp_path):
+    gtf=_write(tmp_path)
+    reference=pd.read_csv(gtf, sep="\t", comment="#", header=None, names=["seqname","source","feature","start","end","score","strand","frame","attribute"])
+    df=readGTF(gtf, chunksize=2)
+    assert df["attribute"].tolist() == reference["attribute"].tolist()
+    for c in ["seqname","source","feature","strand","frame"]:
+        assert isinstance(df[c].dtype, pd.CategoricalDtype)
+        assert df[c].astype(str).tolist() == reference[c].astype(str).tolist()
+    assert df["start"].dtype == np.int32
+    assert df["start"].tolist() == reference["start"].tolist()
+    df=readGTF(gtf, features=["exon"], seqnames=["chr2"], columns=["start","end","attribute"], chunksize=2)
+    keep=( reference["feature"] == "exon" ) & ( reference["seqname"] == "chr2" )
+    assert df.columns.tolist() == ["start","end","attribute"]
+    assert df["start"].tolist() == reference.loc[keep, "start"].tolist()
+    # categories of features filtered out are not kept
+    df=readGTF(gtf, features=["gene"], chunksize=2)
+    assert df["feature"].cat.categories.tolist() == ["gene"]
+    df=readGTF(gtf, seqnames=["chr3"])
+    assert len(df) == 0
+    assert df.columns.tolist() == reference.columns.tolist()
+
+def _mergeReference(intervals):
+    # merges overlapping and book-ended intervals one by one
+    merged=[]
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1]=max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def test_getPromotersBed(tmp_path):
+    fa=tmp_path/"genome.fa"
+    fa.write_text(">1 dna:chromosome chromosome:GRCm38:1:1:5000:1 REF\nACGT\n>2 dna:chromosome chromosome:GRCm38:2:1:3000:1 REF\nACGT\n")
+    lines=[ ["1","test","transcript",1000,1500,".","+",".",'gene_id "g1"; transcript_id "t1"; gene_name "G1";'],
+            ["1","test","transcript",1100,1500,".","+",".",'gene_id "g1"; transcript_id "t2"; gene_name "G1";'],
+            ["1","test","transcript",4000,4500,".","+",".",'gene_id "g1"; transcript_id "t3"; gene_name "G1";'],
+            ["1","test","transcript",2000,2900,".","-",".",'gene_id "g2"; transcript_id "t4"; gene_name "G2";'],
+            ["2","test","transcript",500,2900,".","-",".",'gene_id "g3"; transcript_id "t5"; gene_name "G3";'] ]
+    bed=getPromotersBed(_write(tmp_path, lines), str(fa), upstream=1000, downstream=200)
+    sizes={"1":5000,"2":3000}
+    reference=[]
+    for gene in ["g1","g2","g3"]:
+        rows=[ l for l in lines if '"%s"' %gene in l[8] ]
+        intervals=[]
+        for l in rows:
+            tss=l[4] if l[6] == "-" else l[3]
+            up, down = (200, 1000) if l[6] == "-" else (1000, 200)
+            intervals.append((max(tss-up, 0), min(tss+down, sizes[l[0]])))
+        name="%s, G%s" %(gene, gene[1])
+        reference+=[ (rows[0][0], s, e, name, rows[0][6]) for s, e in _mergeReference(intervals) ]
+    reference=sorted(reference, key=lambda r: (r[0], r[1]))
+    assert bed.columns.tolist() == ["chrom","start","stop","name","score","strand"]
+    assert [ (r.chrom, r.start, r.stop, r.name.split(": ",1)[1], r.strand) for r in bed.itertuples(index=False) ] == reference
+    assert bed["name"].str.split(": ").str[0].tolist() == [ str(i) for i in range(len(bed)) ]
+
+def test_writeGTF_round_trip(tmp_path):
+    gtf=_write(tmp_path)
+    df=readGTF(gtf)
+    for name in ["out.gtf","out.gtf.gz"]:
+        out=str(tmp_path/name)
+        writeGTF(df, out, chunksize=4)
+        pd.testing.assert_frame_equal(readGTF(out), df)
+    with gzip.open(str(tmp_path/"out.gtf.gz"), "rt") as f:
+        assert f.read() == "".join([ "\t".join(map(str, l))+"\n" for l in GTF ])
+    # parsed GTFs are written with their attribute columns collapsed
+    parsed=parseGTF(df)
+    out=str(tmp_path/"parsed.gtf")
+    writeGTF(parsed, out, compression=None, chunksize=4)
+    pd.testing.assert_frame_equal(parseGTF(readGTF(out)), parsed)
+
+def test_indexGTF_matches_tabix(tmp_path):
+    rng=np.random.default_rng(0)
+    start=rng.integers(1, 200000, 300)
+    lines=[ [rng.choice(["chr1","chr2"]),"test","exon",s,s+rng.integers(0, 20000),".","+",".",'gene_id "g%i";' %i] for i, s in enumerate(start) ]
+    gtf=indexGTF(_write(tmp_path, lines))
+    # the same BGZF file indexed by tabix
+    ref=str(tmp_path/"ref.gtf.gz")
+    with open(ref, "wb") as f:
+        f.write(open(gtf, "rb").read())
+    pysam.tabix_index(ref, preset="gff", force=True)
+    # htslib reads the index of indexGTF
+    ours=pysam.TabixFile(gtf, index=gtf+".tbi")
+    tabix=pysam.TabixFile(ref)
+    for seqname, s, e in [("chr1",1,10),("chr1",5000,5100),("chr2",100000,150000),("chr1",1,300000),("chr3",1,100)]:
+        expected=list(tabix.fetch(seqname, s-1, e)) if seqname in tabix.contigs else []
+        df=queryGTF(gtf, seqname, s, e)
+        assert df["attribute"].tolist() == [ l.split("\t")[8] for l in expected ]
+        if seqname in ours.contigs:
+            assert list(ours.fetch(seqname, s-1, e)) == expected
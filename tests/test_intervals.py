@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from AGEpy.intervals import overlapIndex, intersectBED
+
+def _random(rng, n):
+    start=rng.integers(0, 1000, n)
+    return pd.DataFrame({"chrom":rng.choice(["chr1","chr2"], n),
+                         "start":start,
+                         "end":start+rng.integers(1, 200, n),
+                         "strand":rng.choice(["+","-","."], n)})
+
+def _bruteForce(a, b, how, strand):
+    opposite={"+":"-","-":"+"}
+    pairs=[]
+    for i, x in enumerate(a.itertuples(index=False)):
+        found=False
+        for j, y in enumerate(b.itertuples(index=False)):
+            if x.chrom != y.chrom:
+                continue
+            if strand == "same" and ( x.strand not in "+-" or x.strand != y.strand ):
+                continue
+            if strand == "opposite" and opposite.get(x.strand) != y.strand:
+                continue
+            overlap=min(x.end, y.end)-max(x.start, y.start)
+            if overlap > 0:
+                pairs.append((i, j, overlap))
+                found=True
+        if how == "loj" and not found:
+            pairs.append((i, -1, 0))
+    return sorted(pairs)
+
+def test_overlapIndex_matches_brute_force():
+    rng=np.random.default_rng(0)
+    a=_random(rng, 60)
+    b=_random(rng, 80)
+    for how in ["wo","loj"]:
+        for strand in [None,"same","opposite"]:
+            ai, bj, overlap = overlapIndex(a, b, how=how, strand=strand)
+            assert list(zip(ai.tolist(), bj.tolist(), overlap.tolist())) == _bruteForce(a, b, how, strand)
+
+def test_overlapIndex_unstranded():
+    # as bedtools -s, intervals without strand do not overlap each other
+    a=pd.DataFrame({"chrom":["chr1"],"start":[100],"end":[200],"strand":["."]})
+    ai, bj, overlap = overlapIndex(a, a.copy(), strand="same")
+    assert len(ai) == 0
+    ai, bj, overlap = overlapIndex(a, a.copy())
+    assert overlap.tolist() == [100]
+
+def test_intersectBED_columns():
+    a=pd.DataFrame({"chrom":["chr1","chr1"],"start":[100,500],"end":[200,600],"name":["a1","a2"]})
+    b=pd.DataFrame({"chrom":["chr1"],"start":[150],"end":[300],"name":["b1"]})
+    df=intersectBED(a, b, how="loj")
+    assert df.columns.tolist() == ["chrom","start","end","name","chrom_b","start_b","end_b","name_b","overlap"]
+    assert df["name_b"].tolist()[0] == "b1"
+    assert pd.isnull(df["name_b"].tolist()[1])
+    assert df["overlap"].tolist() == [50,0]
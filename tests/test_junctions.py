@@ -0,0 +1,85 @@
+import re
+import numpy as np
+import pandas as pd
+from AGEpy.gtf import readGTF
+from AGEpy.junctions import spliceJunctions, countJunctions, annotateJunctions
+
+GTF=[ ["chr1","test","exon",101,200,".","+",".",'gene_id "g1"; transcript_id "t1";'],
+      ["chr1","test","exon",301,400,".","+",".",'gene_id "g1"; transcript_id "t1";'],
+      ["chr1","test","exon",501,600,".","+",".",'gene_id "g1"; transcript_id "t1";'] ]
+
+def _reads(rng, n):
+    reads=[]
+    for i in range(n):
+        seq=rng.choice(["chr1","chr2"])
+        pos=int(rng.integers(1, 500))
+        cigar=rng.choice(["10M","5M100N5M","5M100N3M50N2M","3M2D2M90N5M","5M1I4M","4M100N1M100N5M"])
+        xs=rng.choice(["\tXS:A:+","\tXS:A:-",""])
+        nh="\tNH:i:%i" %rng.integers(1, 3)
+        reads.append("r%i\t0\t%s\t%i\t60\t%s\t*\t0\t0\tACGTACGTAC\tIIIIIIIIII%s%s\n" %(i, seq, pos, cigar, xs, nh))
+    return reads
+
+def _write(tmp_path, reads):
+    sam=tmp_path/"sample.sam"
+    sam.write_text("@SQ\tSN:chr2\tLN:10000\n@SQ\tSN:chr1\tLN:10000\n"+"".join(reads))
+    return str(sam)
+
+def _bruteForce(reads):
+    counts={}
+    for r in reads:
+        f=r.rstrip("\n").split("\t")
+        pos=int(f[3])
+        strand=dict([ t.split(":A:") for t in f[11:] if t.startswith("XS") ]).get("XS", ".")
+        nh=int([ t for t in f[11:] if t.startswith("NH") ][0].split(":")[2])
+        for length, op in re.findall(r"(\d+)([MIDNSHP=X])", f[5]):
+            length=int(length)
+            if op == "N":
+                key=(f[2], pos, pos+length-1, strand)
+                u, m = counts.get(key, (0,0))
+                counts[key]=(u+(nh == 1), m+(nh > 1))
+            if op in "MDN=X":
+                pos=pos+length
+    return counts
+
+def test_spliceJunctions():
+    junctions=spliceJunctions(np.array([100,200,300]), ["5M100N5M","10M","2M3D2M10N5M20N1M"])
+    assert junctions['read'].tolist() == [0,2,2]
+    assert junctions['start'].tolist() == [105,307,322]
+    assert junctions['end'].tolist() == [204,316,341]
+
+def test_countJunctions_matches_brute_force(tmp_path):
+    reads=_reads(np.random.default_rng(0), 300)
+    sam=_write(tmp_path, reads)
+    df=countJunctions(sam)
+    counts=_bruteForce(reads)
+    assert len(df) == len(counts)
+    for r in df.itertuples(index=False):
+        assert counts[(r.seqname, r.start, r.end, r.strand)] == (r.unique, r.multi)
+    # sorted by header order and position
+    assert df["seqname"].tolist() == sorted(df["seqname"].tolist(), key=lambda s: s != "chr2")
+
+def test_countJunctions_merges_chunks(tmp_path):
+    # small chunks merged every few chunks give the same counts as one chunk
+    sam=_write(tmp_path, _reads(np.random.default_rng(1), 200))
+    ref=countJunctions(sam)
+    for chunksize, merge_every in [(7,2),(13,3),(50,1)]:
+        df=countJunctions(sam, chunksize=chunksize, merge_every=merge_every)
+        pd.testing.assert_frame_equal(df.reset_index(drop=True), ref.reset_index(drop=True))
+
+def test_countJunctions_empty(tmp_path):
+    sam=_write(tmp_path, [])
+    df=countJunctions(sam)
+    assert len(df) == 0
+    assert df.columns.tolist() == ["seqname","start","end","strand","unique","multi"]
+
+def test_annotateJunctions(tmp_path):
+    gtf=tmp_path/"test.gtf"
+    gtf.write_text("".join([ "\t".join(map(str, l))+"\n" for l in GTF ]))
+    junctions=pd.DataFrame({"seqname":["chr1","chr1","chr1","chr1"],
+                            "start":[201,201,401,201],
+                            "end":[300,350,500,300],
+                            "strand":["+","+",".","-"]})
+    df=annotateJunctions(junctions, readGTF(str(gtf)))
+    assert df["known"].tolist() == [True,False,True,False]
+    assert df["known_start"].tolist() == [True,True,True,False]
+    assert df["known_end"].tolist() == [True,False,True,False]
@@ -0,0 +1,147 @@
+import gzip
+import numpy as np
+import pandas as pd
+import pysam
+from AGEpy.sam import SAMflagsTable, isPrimary, isMapped, isProperPair, isDuplicate, isSupplementary, filterSAM, readSAMchunks, readSAM, writeSAMchunks, writeSAM
+
+HEADER="@HD\tVN:1.6\tSO:unsorted\n@SQ\tSN:chr1\tLN:10000\n@SQ\tSN:chr2\tLN:5000\n"
+
+def _random(rng, n):
+    lines=[]
+    for i in range(n):
+        flag=int(rng.choice([0,16,99,147,83,163,256,1024,2048,512]))
+        cigar=str(rng.choice(["10M","5M100N5M","3S7M","2M1I7M","4M2D6M"]))
+        seq="".join(rng.choice(list("ACGTN"), 10))
+        tags=[]
+        if rng.random() < 0.8:
+            tags.append("NH:i:%i" %rng.integers(1, 4))
+        if rng.random() < 0.5:
+            tags.append("XS:A:%s" %rng.choice(["+","-"]))
+        if rng.random() < 0.3:
+            tags.append("MD:Z:%i" %rng.integers(0, 10))
+        if rng.random() < 0.3:
+            tags.append("NM:i:%i" %rng.integers(0, 3))
+        fields=["r%i" %i, str(flag), str(rng.choice(["chr1","chr2"])), str(rng.integers(1, 4000)), str(rng.integers(0, 61)),
+                cigar, "=", str(rng.integers(1, 4000)), str(rng.integers(-300, 300)), seq, "IIIIIIIIII"]
+        lines.append("\t".join(fields+tags)+"\n")
+    # an unmapped read
+    lines.append("u1\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\n")
+    return lines
+
+def _write(tmp_path, lines, name="sample.sam", blank=False):
+    path=tmp_path/name
+    text=HEADER+"".join([ l+( "\n" if blank and i%7 == 3 else "" ) for i, l in enumerate(lines) ])
+    if name.endswith(".gz"):
+        with gzip.open(str(path), "wt") as f:
+            f.write(text)
+    else:
+        path.write_text(text)
+    return str(path)
+
+def _pysamLines(path):
+    # the alignments as formatted by htslib
+    with pysam.AlignmentFile(path, "r") as f:
+        return [ a.to_string().split("\t") for a in f ]
+
+def test_readSAMchunks_matches_pysam(tmp_path):
+    lines=_random(np.random.default_rng(0), 300)
+    reference=_pysamLines(_write(tmp_path, lines, name="reference.sam"))
+    for name, blank, chunksize in [("sample.sam",False,1000),("blank.sam",True,17),("sample.sam.gz",True,50)]:
+        head, chunks = readSAMchunks(_write(tmp_path, lines, name=name, blank=blank), chunksize=chunksize, header=True)
+        assert "".join(head) == HEADER
+        chunks=list(chunks)
+        assert max([ len(c) for c in chunks ]) <= chunksize
+        for c in chunks:
+            assert c["FLAG"].dtype == np.uint16
+            assert c["POS"].dtype == np.int32
+            assert isinstance(c["RNAME"].dtype, pd.CategoricalDtype)
+            assert isinstance(c["CIGAR"].dtype, pd.CategoricalDtype)
+        sam=pd.concat(chunks)
+        assert sam.index.tolist() == list(range(len(lines)))
+        parsed=[ [ str(v) for v in row[:11] ]+( row[11].decode().split("\t") if len(row[11]) > 0 else [] ) for row in sam.itertuples(index=False) ]
+        assert parsed == reference
+
+def test_readSAM(tmp_path):
+    lines=_random(np.random.default_rng(1), 50)
+    sam, head = readSAM(_write(tmp_path, lines), header=True)
+    assert "".join(head) == HEADER
+    assert sam.columns.tolist() == ['QNAME','FLAG','RNAME','POS','MAPQ','CIGAR','RNEXT','PNEXT','TLEN','SEQ','QUAL']
+    assert [ "\t".join(map(str, row))+"\n" for row in sam.itertuples(index=False) ] == lines
+
+def test_readSAMchunks_tags_match_pysam(tmp_path):
+    lines=_random(np.random.default_rng(2), 200)
+    path=_write(tmp_path, lines)
+    with pysam.AlignmentFile(path, "r") as f:
+        reference=[ { t:a.get_tag(t) if a.has_tag(t) else None for t in ["NH","XS","MD","NM","AS"] } for a in f ]
+    chunks=list(readSAMchunks(path, chunksize=17, tags=["NH","XS:A","MD","NM","AS"]))
+    for c in chunks:
+        # the same dtypes in every chunk whether the field is present or not
+        assert c["NH"].dtype == "Int64"
+        assert c["NM"].dtype == "Int64"
+        assert c["AS"].dtype == "Int64"
+        assert c["XS"].dtype == object
+        assert c["MD"].dtype == object
+    sam=pd.concat(chunks)
+    for t in ["NH","XS","MD","NM","AS"]:
+        assert [ None if pd.isnull(v) else v for v in sam[t] ] == [ r[t] for r in reference ]
+
+def test_readSAMchunks_tag_types(tmp_path):
+    # YXF is not XF
+    path=_write(tmp_path, ["r1\t0\tchr1\t1\t60\t4M\t*\t0\t0\tACGT\tIIII\tXF:f:1.5\tZZ:Z:a\tXI:i:-3\tXB:B:c,1,2\n",
+                           "r2\t0\tchr1\t1\t60\t4M\t*\t0\t0\tACGT\tIIII\tZZ:Z:b\tYXF:f:2\n"])
+    sam=next(readSAMchunks(path, tags=["XF:f","ZZ","XI:i","XB"]))
+    assert sam["XF"].dtype == np.float64
+    assert sam["XF"].tolist()[0] == 1.5 and np.isnan(sam["XF"].tolist()[1])
+    assert sam["ZZ"].tolist() == ["a","b"]
+    assert sam["XI"].tolist()[0] == -3 and pd.isnull(sam["XI"].tolist()[1])
+    assert sam["XB"].tolist()[0] == "c,1,2"
+
+def test_writeSAM_round_trip(tmp_path):
+    lines=_random(np.random.default_rng(3), 120)
+    path=_write(tmp_path, lines)
+    sam, head = readSAM(path, header=True)
+    for name in ["out.sam","out.sam.gz"]:
+        out=str(tmp_path/name)
+        writeSAM(sam, out, header=head, chunksize=13)
+        if name.endswith(".gz"):
+            text=gzip.open(out, "rt").read()
+        else:
+            text=open(out).read()
+        assert text == HEADER+"".join(lines)
+        assert _pysamLines(out) == _pysamLines(path)
+
+def test_writeSAMchunks_round_trip(tmp_path):
+    lines=_random(np.random.default_rng(4), 120)
+    path=_write(tmp_path, lines)
+    head, chunks = readSAMchunks(path, chunksize=11, header=True, tags=["NH"])
+    out=str(tmp_path/"out.sam")
+    assert writeSAMchunks(chunks, out, header=head) == len(lines)
+    assert open(out).read() == HEADER+"".join(lines)
+
+def test_SAMflagsTable_matches_pysam():
+    flags=pd.Series(np.arange(4096, dtype=np.uint16), index=np.arange(4096)+10)
+    table=SAMflagsTable(flags)
+    assert table.index.tolist() == flags.index.tolist()
+    properties=[("paired","is_paired"),("proper_pair","is_proper_pair"),("unmapped","is_unmapped"),("mate_unmapped","mate_is_unmapped"),
+                ("reverse","is_reverse"),("mate_reverse","mate_is_reverse"),("first","is_read1"),("second","is_read2"),
+                ("secondary","is_secondary"),("qcfail","is_qcfail"),("duplicate","is_duplicate"),("supplementary","is_supplementary")]
+    assert table.columns.tolist() == [ c for c, p in properties ]
+    a=pysam.AlignedSegment()
+    for flag in range(4096):
+        a.flag=flag
+        assert table.loc[flag+10].tolist() == [ getattr(a, p) for c, p in properties ]
+    values=flags.to_numpy()
+    assert np.array_equal(isPrimary(flags), ~( table["secondary"] | table["supplementary"] ).to_numpy())
+    assert np.array_equal(isMapped(values), ~table["unmapped"].to_numpy())
+    assert np.array_equal(isProperPair(flags), table["proper_pair"].to_numpy())
+    assert np.array_equal(isDuplicate(flags), table["duplicate"].to_numpy())
+    assert np.array_equal(isSupplementary(flags), table["supplementary"].to_numpy())
+
+def test_filterSAM_matches_samtools(tmp_path):
+    lines=_random(np.random.default_rng(5), 300)
+    path=_write(tmp_path, lines)
+    sam=readSAM(path)
+    for include, exclude, mapq in [(0,0,0),(1,0,0),(0,1796,0),(64,256,20),(3,16,0),(0,0,30)]:
+        keep=filterSAM(sam, include, exclude, mapq)
+        view=pysam.view("-f", str(include), "-F", str(exclude), "-q", str(mapq), path)
+        assert sam.loc[keep, "QNAME"].tolist() == [ l.split("\t")[0] for l in view.splitlines() ]
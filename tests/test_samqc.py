@@ -0,0 +1,107 @@
+import numpy as np
+import pysam
+import pytest
+from AGEpy.sam import SAM_FLAGS
+from AGEpy.samqc import SAMstats, SAMqc
+
+HEADER="@HD\tVN:1.6\tSO:unsorted\n@SQ\tSN:chr1\tLN:10000\n@SQ\tSN:chr2\tLN:5000\n@SQ\tSN:chr3\tLN:5000\n"
+
+def _write(tmp_path, seed, n, name):
+    rng=np.random.default_rng(seed)
+    lines=[]
+    for i in range(n):
+        flag=int(rng.choice([0,16,99,147,83,163,97,145,65,256,1024,2048,512,4,73,133]))
+        cigar=str(rng.choice(["20M","3S17M","10M10S","2S16M2S","5M100N15M","4H20M","8S2M10S"]))
+        if flag & 4:
+            rname, pos, cigar = "*", 0, "*"
+        else:
+            rname, pos = str(rng.choice(["chr1","chr2"])), int(rng.integers(1, 4000))
+        lines.append("r%i\t%i\t%s\t%i\t%i\t%s\t=\t%i\t%i\t*\t*\n" %(i, flag, rname, pos, rng.integers(0, 61), cigar, rng.integers(1, 4000), rng.integers(-400, 400)))
+    path=tmp_path/name
+    path.write_text(HEADER+"".join(lines))
+    return str(path)
+
+def _reference(paths, max_insert, max_clip):
+    # the statistics computed read by read from the records as parsed by htslib
+    ref={ "records":0, "flags":np.zeros(len(SAM_FLAGS), dtype=np.int64), "primary":0, "mapped":0, "proper_pairs":0,
+          "mapq":np.zeros(256, dtype=np.int64), "insert_size":np.zeros(max_insert+2, dtype=np.int64),
+          "soft_clip":np.zeros(max_clip+2, dtype=np.int64), "query_bases":0, "clipped_bases":0, "seqnames":{} }
+    for path in paths:
+        with pysam.AlignmentFile(path, "r") as f:
+            for a in f:
+                ref["records"]+=1
+                ref["flags"]+=np.array([ a.flag & bit != 0 for bit, name in SAM_FLAGS ])
+                if a.is_secondary or a.is_supplementary:
+                    continue
+                ref["primary"]+=1
+                if a.is_unmapped:
+                    continue
+                ref["mapped"]+=1
+                ref["mapq"][a.mapping_quality]+=1
+                if a.is_paired and a.is_proper_pair:
+                    ref["proper_pairs"]+=1
+                    if a.template_length > 0:
+                        ref["insert_size"][min(a.template_length, max_insert+1)]+=1
+                clipped=sum([ l for op, l in a.cigartuples if op == 4 ])
+                ref["soft_clip"][min(clipped, max_clip+1)]+=1
+                ref["clipped_bases"]+=clipped
+                ref["query_bases"]+=a.infer_query_length()
+                ref["seqnames"][a.reference_name]=ref["seqnames"].get(a.reference_name, 0)+1
+    return ref
+
+def _flagstat(path):
+    # the QC-passed plus QC-failed counts of samtools flagstat
+    counts={}
+    for line in pysam.flagstat(path).splitlines():
+        passed, rest = line.split(" + ", 1)
+        failed, name = rest.split(" ", 1)
+        counts[name.split(" (")[0]]=int(passed)+int(failed)
+    return counts
+
+def _assertEqual(stats, ref):
+    for attr, value in ref.items():
+        if isinstance(value, np.ndarray):
+            assert getattr(stats, attr).tolist() == value.tolist(), attr
+        else:
+            assert getattr(stats, attr) == value, attr
+
+def test_SAMqc_matches_pysam(tmp_path):
+    path=_write(tmp_path, 0, 500, "sample.sam")
+    ref=_reference([path], 200, 12)
+    assert ref["insert_size"][-1] > 0 and ref["soft_clip"][-1] > 0
+    for chunksize in [1000, 37]:
+        stats=SAMqc(path, max_insert=200, max_clip=12, chunksize=chunksize)
+        _assertEqual(stats, ref)
+
+    flagstat=_flagstat(path)
+    summary=stats.summary()
+    assert summary["records"] == flagstat["in total"]
+    assert summary["primary"] == flagstat["primary"]
+    assert summary["mapped"] == flagstat["primary mapped"]
+    assert summary["secondary"] == flagstat["secondary"]
+    assert summary["supplementary"] == flagstat["supplementary"]
+    assert summary["duplicate"] == flagstat["duplicates"]
+    assert summary["mapping rate"] == pytest.approx(ref["mapped"]/float(ref["primary"]))
+    assert summary["proper pair rate"] == pytest.approx(ref["proper_pairs"]/float(ref["mapped"]))
+    mapq=np.repeat(np.arange(256), ref["mapq"])
+    assert summary["mean MAPQ"] == pytest.approx(mapq.mean())
+    assert summary["median MAPQ"] == np.median(mapq)
+    inserts=np.repeat(np.arange(201), ref["insert_size"][:-1])
+    assert summary["mean insert size"] == pytest.approx(inserts.mean())
+    assert summary["median insert size"] == np.median(inserts)
+    assert summary["insert size > 200"] == ref["insert_size"][-1]
+    assert summary["soft clipped reads"] == pytest.approx(1-ref["soft_clip"][0]/float(ref["mapped"]))
+    assert summary["soft clip rate"] == pytest.approx(ref["clipped_bases"]/float(ref["query_bases"]))
+
+def test_SAMqc_merges_files(tmp_path):
+    paths=[ _write(tmp_path, i, 200, "lane%i.sam" %i) for i in range(3) ]
+    ref=_reference(paths, 1000, 250)
+    _assertEqual(SAMqc(paths, chunksize=50), ref)
+    _assertEqual(SAMqc(paths, n_jobs=2, chunksize=50), ref)
+
+def test_SAMstats_empty_and_mismatched():
+    summary=SAMstats().summary()
+    assert summary["records"] == 0
+    assert np.isnan(summary["mapping rate"]) and np.isnan(summary["median MAPQ"])
+    with pytest.raises(ValueError):
+        SAMstats(max_insert=100).merge(SAMstats(max_insert=200))
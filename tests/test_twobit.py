@@ -0,0 +1,44 @@
+import pickle
+import struct
+import numpy as np
+from AGEpy.twobit import fastaTO2bit, TwoBitReader
+
+def _random(rng, n):
+    seq=np.array(list("ACGTacgtNnR"))[rng.integers(0, 11, n)]
+    # runs of N and of soft masked bases
+    seq[n//4:n//4+n//8]="N"
+    seq[n//2:n//2+n//5]=np.char.lower(seq[n//2:n//2+n//5])
+    return "".join(seq)
+
+def _expected(seq):
+    # bases other than A, C, G and T are read back as N, keeping the case
+    return "".join([ b if b in "ACGTacgt" else ( "n" if b.islower() else "N" ) for b in seq ])
+
+def test_fastaTO2bit_round_trip(tmp_path):
+    rng=np.random.default_rng(0)
+    seqs={"1":_random(rng, 1001), "2":_random(rng, 64), "MT":"ACG", "chrUn_1":_random(rng, 7)}
+    fasta=tmp_path/"genome.fa"
+    fasta.write_text("".join([ ">%s\n%s\n" %(name, "\n".join([ seq[i:i+60] for i in range(0, len(seq), 60) ])) for name, seq in seqs.items() ]))
+    out=str(tmp_path/"genome.2bit")
+    sizes=fastaTO2bit(str(fasta), out)
+    assert sizes["name"].tolist() == list(seqs)
+    assert sizes["length"].tolist() == [ len(s) for s in seqs.values() ]
+    # header as in the UCSC specification
+    signature, version, count, reserved = struct.unpack("<IIII", open(out, "rb").read(16))
+    assert (signature, version, count, reserved) == (0x1A412743, 0, 4, 0)
+    with TwoBitReader(out) as reader:
+        assert reader.lengths == { name:len(seq) for name, seq in seqs.items() }
+        for name, seq in seqs.items():
+            expected=_expected(seq)
+            assert reader.fetch(name) == expected
+            assert reader.fetch(name, mask=False) == expected.upper()
+            for s in range(0, len(seq), 13):
+                for e in [s+1, s+5, s+97, len(seq)]:
+                    assert reader.fetch("%s:%i-%i" %(name, s+1, e)) == expected[s:e]
+        assert reader.fetch("1", start=10, end=20) == _expected(seqs["1"])[9:20]
+        assert reader.fetch("1:10-20", as_array=True).tobytes().decode() == _expected(seqs["1"])[9:20]
+        assert reader.fetch("Y") is None
+        # readers reopen the file when passed to other processes
+        copy=pickle.loads(pickle.dumps(reader))
+        assert copy.fetch("2") == _expected(seqs["2"])
+        copy.close()